@@ -1,16 +1,33 @@
-from flask import Flask, request, jsonify, render_template, redirect, session, url_for, flash, send_file, render_template_string, request
+from flask import Flask, request, jsonify, render_template, redirect, session, url_for, flash, send_file, render_template_string, request, Response, stream_with_context, g
 from flask_cors import CORS
-from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
-from datetime import datetime, timedelta, date
+import importlib
+import time
+from functools import wraps
+import json
 import io
+import shutil
+import tempfile
+from datetime import datetime, timedelta, date, timezone
 from collections import defaultdict
 import random
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
+from verify_cache import VerificationIndex, BATCH_TABLE, SERIAL_TABLE
+from products import ProductCatalog, normalize_code
+from dates import is_expired, parse_iso_timestamp, parse_wall_clock
+import metrics
+from session_store import ProfileCache, ServerSideSessionInterface, create_session_store, rotate_session_id
+from log_queue import LogQueue
+from data_access import execute
+from errors import is_api_error
+from storage import LazyClient
+from replica import VerificationReplica
+from code_filter import KnownCodes
+from record_import import RecordImport, InvalidImport, detect_format, iter_rows
+import log_aggregation
+import report_cache
+from report_cache import ReportCache
+from pdf_jobs import PDFJobQueue, QueueFull
 
 # Load environment variables
 load_dotenv()
@@ -18,40 +35,275 @@ load_dotenv()
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
-app.config['SECRET_KEY'] = 'PharmaCheck'
-
-# Initialize Supabase client
+app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "PharmaCheck")
+
+# Server-side sessions (session_store.py): with SESSION_STORE=sqlite the cookie only carries
+# a session id, so workers no longer depend on sharing SECRET_KEY. Default: signed cookies.
+session_store = create_session_store()
+if session_store is not None:
+    app.session_interface = ServerSideSessionInterface(
+        session_store, ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", str(12 * 3600))))
+
+# Initialize the storage client: Supabase (keep-alive pool + timeouts, see data_access.py)
+# or the local SQLite backend when STORAGE_BACKEND=sqlite (see storage.py).
+# Created on first use, so importing the app stays fast (storage.LazyClient)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = LazyClient()
+
+# Bloom filter over every known batch/serial number (code_filter.py): codes that are
+# definitely unknown are answered as COUNTERFEIT without a query. Set CODE_FILTER=0 to disable.
+known_codes = None
+if os.getenv("CODE_FILTER", "1") == "1":
+    known_codes = KnownCodes(
+        supabase,
+        # With the replica, the filter is rebuilt from it after every sync instead
+        rebuild_interval=None if os.getenv("REPLICA_PATH") else int(os.getenv("CODE_FILTER_REBUILD_SECONDS", "300")),
+        # Bumped by every worker that registers a code, so the others stop rejecting until they rebuild
+        generation_path=os.getenv("CODE_FILTER_GENERATION_PATH",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), "known_codes.generation")),
+    )
+
+# Cached email -> role lookups from profiles, used at login and by every role check
+profile_cache = ProfileCache(supabase, ttl_seconds=int(os.getenv("PROFILE_CACHE_TTL", "300")))
+
+# Registered products (products.py); batches and serials of all of them share one registry
+product_catalog = ProductCatalog(supabase, ttl_seconds=int(os.getenv("PRODUCT_CACHE_TTL", "300")))
+
+# In-memory batch/serial index used by /api/verify
+verification_index = VerificationIndex(supabase, ttl_seconds=int(os.getenv("VERIFY_CACHE_TTL", "300")),
+                                       missing_ttl=int(os.getenv("VERIFY_MISSING_TTL", "5")),
+                                       code_filter=known_codes)
+
+# Set by gunicorn.conf.py when the app is imported once in the gunicorn master and then
+# forked: nothing may open connections or start threads before the fork (see warm_up)
+PRELOADED = os.getenv("PHARMACHECK_PRELOADED") == "1"
+
+# Optional local replica of the batch/serial registries (replica.py). Once it has
+# synced, verifications are answered from it and keep working while Supabase is down.
+replica = None
+replica_index = None
+if os.getenv("REPLICA_PATH"):
+    replica = VerificationReplica(
+        supabase,
+        os.getenv("REPLICA_PATH"),
+        sync_interval=int(os.getenv("REPLICA_SYNC_SECONDS", "60")),
+        full_sync_interval=int(os.getenv("REPLICA_FULL_SYNC_SECONDS", str(6 * 3600))),
+    )
+    replica_index = VerificationIndex(replica.store, ttl_seconds=int(os.getenv("VERIFY_CACHE_TTL", "300")),
+                                      missing_ttl=int(os.getenv("VERIFY_MISSING_TTL", "5")),
+                                      code_filter=known_codes)
+    if known_codes is not None:
+        known_codes.client = replica.store
+
+    def on_replica_sync():
+        # Cached lookups and the known-code filter are refreshed whenever a sync changes rows
+        replica_index.invalidate()
+        if known_codes is not None:
+            known_codes.rebuild()
+
+    replica.on_sync = on_replica_sync
+    # Under gunicorn with preload (gunicorn.conf.py) each worker starts its thread after the fork;
+    # one of them syncs the shared file, the others follow its changes (replica.py)
+    if not PRELOADED:
+        replica.start()
+
+# Cached report results (JSON and PDF) keyed by date range + filters
+report_results = ReportCache()
+
+# PDF exports are rendered by a background pool into PDF_JOB_DIR and downloaded when done (pdf_jobs.py)
+pdf_jobs = PDFJobQueue(
+    os.getenv("PDF_JOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_exports")),
+    workers=int(os.getenv("PDF_JOB_WORKERS", "2")),
+    ttl_seconds=int(os.getenv("PDF_JOB_TTL_SECONDS", "3600")),
+)
+# Longest a client may hold GET /api/pdf_jobs/<id>?wait= open
+PDF_JOB_MAX_WAIT = 25
+
+def invalidate_report_days(days, *kinds):
+    """Drops cached reports and finished PDF exports of `kinds` whose range covers any of `days`."""
+    report_results.invalidate_days(days, *kinds)
+    pdf_jobs.release(lambda key: key[0] in kinds and ReportCache.covers(key, days))
+
+# Write-behind queue for pharmlogs; verification logs are batch-inserted off the request path.
+# Each flush changes the numbers of the days its rows fall on, so reports covering them are dropped.
+log_queue = LogQueue(
+    supabase,
+    spill_path=os.getenv("LOG_SPILL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pharmlogs_spill.jsonl")),
+    on_flush=lambda days: invalidate_report_days(days, report_cache.QUERY_REPORT, report_cache.QUERY_REPORT_PDF),
+)
+log_queue.install_exit_flush()
 
 def checkForExpiry(dateString):
-    expiry_date = datetime.strptime(dateString, "%Y-%m-%d").date()
-    # Get today's date
-    today = date.today()
-    # Compare and return True if Expiredd, otherwise False
-    if today > expiry_date:
-        return True
+    # True if the expiry date has passed. Dates are parsed once into ordinals and
+    # compared with today's, which only changes at midnight (dates.py)
+    return is_expired(dateString)
+
+# -------------------------------
+# Request timing and metrics (metrics.py)
+# -------------------------------
+# One JSON line per request with its storage calls, e.g. to see where verify_data spends its time
+METRICS_LOG = os.getenv("METRICS_LOG", "0") == "1"
+# Bearer token a Prometheus scraper sends to /metrics; without one, /metrics needs an Admin login
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.storage_calls = metrics.start_trace()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or "<unmatched>"
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint, response.status_code)
+    if METRICS_LOG:
+        calls = g.get("storage_calls") or []
+        print(json.dumps({
+            "event": "request",
+            "endpoint": endpoint,
+            "method": request.method,
+            "status": response.status_code,
+            "duration_ms": round(elapsed * 1000, 2),
+            "storage_ms": round(sum(call["ms"] for call in calls), 2),
+            "storage_calls": calls,
+        }), flush=True)
+    metrics.end_trace()
+    return response
+
+
+@metrics.register_collector
+def collect_component_metrics():
+    caches = {"reports": report_results.stats(), "verification": verification_index.stats(),
+              "profiles": profile_cache.stats()}
+    if replica_index is not None:
+        caches["replica_verification"] = replica_index.stats()
+    samples = []
+    for cache, stats in caches.items():
+        lookups = stats["hits"] + stats["misses"]
+        samples += [
+            ("pharmacheck_cache_hits_total", "counter", "Cache hits.", {"cache": cache}, stats["hits"]),
+            ("pharmacheck_cache_misses_total", "counter", "Cache misses.", {"cache": cache}, stats["misses"]),
+            ("pharmacheck_cache_hit_ratio", "gauge", "Hits / lookups since start.", {"cache": cache},
+             round(stats["hits"] / lookups, 4) if lookups else None),
+        ]
+    queue = log_queue.stats()
+    samples += [
+        ("pharmacheck_log_queue_depth", "gauge", "pharmlogs rows waiting to be inserted.", {}, queue["depth"]),
+        ("pharmacheck_log_queue_inserted_total", "counter", "pharmlogs rows inserted.", {}, queue["inserted"]),
+        ("pharmacheck_log_queue_spilled_total", "counter", "pharmlogs rows spilled to disk.", {}, queue["spilled"]),
+        ("pharmacheck_log_queue_failed_flushes_total", "counter", "Failed pharmlogs flushes.", {},
+         queue["failed_flushes"]),
+        ("pharmacheck_log_queue_rejected_total", "counter", "pharmlogs rows rejected by the database.", {},
+         queue["rejected"]),
+    ]
+    exports = pdf_jobs.stats()
+    samples += [
+        ("pharmacheck_pdf_jobs", "gauge", "PDF export jobs in this worker by status.", {"status": status}, count)
+        for status, count in exports["jobs"].items()
+    ]
+    samples += [
+        ("pharmacheck_pdf_jobs_submitted_total", "counter", "PDF export jobs started.", {}, exports["submitted"]),
+        ("pharmacheck_pdf_jobs_deduplicated_total", "counter", "PDF exports served by an existing job.", {},
+         exports["deduplicated"]),
+        ("pharmacheck_pdf_jobs_failed_total", "counter", "PDF export jobs that failed.", {}, exports["failed"]),
+    ]
+    if known_codes is not None:
+        filter_stats = known_codes.stats()
+        samples += [
+            ("pharmacheck_known_codes", "gauge", "Codes in the known-code filter.", {}, filter_stats["codes"]),
+            ("pharmacheck_known_code_rejections_total", "counter", "Scans rejected by the known-code filter.", {},
+             filter_stats["rejections"]),
+            ("pharmacheck_known_code_stale_passes_total", "counter",
+             "Filter misses looked up anyway because codes were registered since its build.", {},
+             filter_stats["stale_passes"]),
+        ]
+    if replica is not None:
+        freshness = replica.freshness()
+        samples.append(("pharmacheck_replica_staleness_seconds", "gauge", "Age of the registry replica.", {},
+                        freshness["stalenessSeconds"] if freshness else None))
+    return samples
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format: latency histograms, storage-call timings, cache and queue gauges."""
+    if METRICS_TOKEN:
+        if request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            return jsonify({"error": "Invalid metrics token."}), 401
     else:
-        return False
+        # Same answers as login_required gives API routes
+        user, role = resolve_identity()
+        if user is None:
+            return jsonify({"error": "Not logged in."}), 401
+        if role != "Admin":
+            return jsonify({"error": "Admin login required."}), 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# -------------------------------
+# Auth guard
+# -------------------------------
+
+
+def resolve_identity():
+    """(user, role) for this request, resolved once from the session and the profile cache."""
+    if "identity" not in g:
+        user = session.get("user")
+        # Falls back to the role stored at login if profiles cannot be reached
+        role = profile_cache.role(user, default=session.get("role")) if user else None
+        g.identity = (user, role)
+    return g.identity
+
+
+def current_role():
+    return resolve_identity()[1]
+
+
+def login_required(*roles, api=None):
+    """
+    Guards a route: the user must be logged in and, if `roles` are given, have one of them.
+
+    API routes (by default anything under /api/) get JSON 401/403 responses;
+    pages redirect to the login page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def guarded(*args, **kwargs):
+            user, role = resolve_identity()
+            is_api = request.path.startswith("/api/") if api is None else api
+            if user is None:
+                if is_api:
+                    return jsonify({"error": "Not logged in."}), 401
+                return redirect(url_for("auth"))
+            if roles and role not in roles:
+                if is_api:
+                    return jsonify({"error": f"{' or '.join(roles)} login required."}), 403
+                return redirect(url_for("auth"))
+            return view(*args, **kwargs)
+        return guarded
+    return decorator
+
 
 @app.route("/admin")
+@login_required("Admin")
 def admin_dashboard():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for("auth"))
     return render_template("admin.html")
 
 
 @app.route("/pharm")
+@login_required("Pharmacist")
 def pharm_dashboard():
-    if "user" not in session or session.get("role") != "Pharmacist":
-        return redirect(url_for("auth"))
     return render_template("pharm.html")
 
 @app.route("/report")
+@login_required("Pharmacist")
 def pharm_report():
-    if "user" not in session or session.get("role") != "Pharmacist":
-        return redirect(url_for("auth"))
     return render_template("pharmReport.html")
 
 
@@ -62,9 +314,9 @@ def pharm_report():
 @app.route("/auth")
 def auth():
     if "user" in session:
-        if session.get("role") == "Admin":
+        if current_role() == "Admin":
             return redirect(url_for("admin_dashboard"))
-        elif session.get("role") == "Pharmacist":
+        elif current_role() == "Pharmacist":
             return redirect(url_for("pharm_dashboard"))
     session.pop("user", None)
     return render_template("auth.html")
@@ -88,12 +340,13 @@ def signup():
         })
 
         # 2. Store extended profile
-        supabase.table("profiles").insert({
+        execute(supabase.table("profiles").insert({
             "user_id": user.user.id,
             "email": email,
             "license": license_no,
             "role": role
-        }).execute()
+        }), idempotent=False)
+        profile_cache.put(email, role)
 
         flash("Registration successful! Please confirm your email then log in.", "success")
         return redirect(url_for("auth"))
@@ -119,19 +372,13 @@ def login():
 
         user_email = auth_res.user.email
 
-        # 2️⃣ Fetch role from profiles table
-        profile = (
-            supabase
-            .table("profiles")
-            .select("role")
-            .eq("email", user_email)
-            .single()
-            .execute()
-        )
-
-        role = profile.data["role"]
+        # 2️⃣ Role from the profile cache (a profiles query only when it is cold)
+        role = profile_cache.role(user_email)
+        if role is None:
+            raise LookupError(f"No profile for {user_email}")
 
         # 3️⃣ Store session
+        rotate_session_id(session)
         session["user"] = user_email
         session["role"] = role
 
@@ -183,43 +430,102 @@ def index():
 #     return jsonify({"Table Data":response1.data})
 
 # Verify serial/batch numbers here
+def queue_verification_log(user_email, serial, status):
+    """Queues the pharmlogs row for a verification (replaces the client's /api/log call)."""
+    log_queue.enqueue({
+        "user_id": user_email,
+        "serial": serial,
+        "status": status,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    })
+
+
+def verification_source():
+    """(index, freshness): the local replica once it has synced, otherwise the Supabase-backed index."""
+    if replica is not None and replica.ready():
+        return replica_index, replica.freshness()
+    return verification_index, None
+
+
+def build_verification_result(batch, serial, user_email):
+    """Builds the /api/verify payload from an index lookup."""
+    if not batch:
+        return {"status": "COUNTERFEIT", "user": user_email}
+    result = {
+        "status": "EXPIRED" if checkForExpiry(batch['expiry_date']) else "AUTHENTIC",
+        "product": batch['product_code'],
+        "productName": product_catalog.name(batch['product_code']),
+        "expiryDate": batch['expiry_date'],
+        "batch": batch['batch_number'],
+        "manufacturer": batch['manufacturer'],
+    }
+    if serial:
+        result["serial"] = serial['serial_no']
+    result["user"] = user_email
+    return result
+
+
 @app.route('/api/verify', methods=['POST'])
+@login_required()
 def verify_data():
-    if "user" not in session:
-        return redirect(url_for(request.referrer))
-    user_input = request.json.get('serial')
-    response1 = supabase.table("AMOXICILLIN_BATCH").select("*").eq("batch_number", user_input).execute() 
-    response2 = supabase.table("AMOXICILLIN_SERIAL").select("*").eq("serial_no", user_input).execute()
+    user_input = (request.get_json(silent=True) or {}).get('serial')
+    if not isinstance(user_input, str) or not user_input.strip():
+        return jsonify({"error": "A 'serial' value is required."}), 400
+    user_input = user_input.strip()
     user_email = session["user"]
-    #Evaluate cases
-    if response1.data:
-        for record in response1.data:
-            if checkForExpiry(record['expiry_date']):
-                return jsonify({"status": "EXPIRED","expiryDate": record['expiry_date'], "batch": record['batch_number'], "manufacturer": record['manufacturer'],"user":user_email})
-            else:
-                return jsonify({"status": "AUTHENTIC", "expiryDate": record['expiry_date'], "batch": record['batch_number'], "manufacturer": record['manufacturer'],"user":user_email})
-            # print(record['expiry_date'])
-    
-    elif response2.data:
-        for record2 in response2.data:
-            response3 = supabase.table("AMOXICILLIN_BATCH").select("*").eq("batch_number", record2['batch_number']).execute() 
-            if response3.data:
-                for record3 in response3.data:
-                    # Convert expiry string to a date object
-                    if checkForExpiry(record3['expiry_date']):
-                        return jsonify({"status": "EXPIRED","expiryDate": record3['expiry_date'], "batch": record3['batch_number'], "manufacturer": record3['manufacturer'], "serial": record2['serial_no'],"user":user_email})
-                    else:
-                        return jsonify({"status": "AUTHENTIC", "expiryDate": record3['expiry_date'], "batch": record3['batch_number'], "manufacturer": record3['manufacturer'], "serial": record2['serial_no'],"user":user_email})
-            else:
-                return jsonify({"status": "COUNTERFEIT","user":user_email})
-    else:
-        return jsonify({"status": "COUNTERFEIT","user":user_email})
+    # Answered from the in-memory index; Supabase (or the local replica) is only queried on a cache miss
+    index, freshness = verification_source()
+    batch, serial = index.lookup(user_input)
+    result = build_verification_result(batch, serial, user_email)
+    if freshness:
+        result.update(freshness)
+    queue_verification_log(user_email, user_input, result["status"])
+    return jsonify(result)
+
+
+# Upper bound on codes per bulk request
+MAX_BULK_CODES = 5000
+
+@app.route('/api/verify/bulk', methods=['POST'])
+@login_required()
+def verify_bulk():
+    """Verifies a list of serial/batch numbers in one request (e.g. a whole carton)."""
+    data = request.get_json(silent=True) or {}
+    codes = data.get('serials')
+
+    if not isinstance(codes, list) or not codes:
+        return jsonify({"error": "A non-empty 'serials' list is required."}), 400
+    if len(codes) > MAX_BULK_CODES:
+        return jsonify({"error": f"At most {MAX_BULK_CODES} codes per request."}), 400
+
+    # Validated and normalised exactly as verify_data does, so a code gets the same answer
+    # either way; nothing is looked up or logged for a request with an unusable entry
+    for position, code in enumerate(codes):
+        if not isinstance(code, str) or not code.strip():
+            return jsonify({"error": f"Entry {position} of 'serials' must be a non-blank string."}), 400
+    codes = [code.strip() for code in codes]
+    user_email = session["user"]
+    index, freshness = verification_source()
+    resolved = index.lookup_many(codes)
+
+    # One entry per submitted code, in the submitted order (duplicates included)
+    results = []
+    for code in codes:
+        batch, serial = resolved[code]
+        result = build_verification_result(batch, serial, user_email)
+        result["code"] = code
+        results.append(result)
+        queue_verification_log(user_email, code, result["status"])
+
+    response = {"results": results}
+    if freshness:
+        response.update(freshness)
+    return jsonify(response)
 
 
 @app.route("/api/report", methods=["POST"])
+@login_required()
 def add_report():
-    if "user" not in session:
-        return redirect(url_for(request.referrer))
     data = request.get_json()
 
     # Extract nested form_data
@@ -254,7 +560,7 @@ def add_report():
         record["email"] = reporter_email
 
     # --- Insert into Supabase ---
-    response = supabase.table("report_page").insert(record).execute()
+    response = execute(supabase.table("report_page").insert(record), idempotent=False)
 
     # ✅ Check status code instead of .error
     if not response:
@@ -263,6 +569,9 @@ def add_report():
         }), 400
 
     
+    # created_at is set by the database: the row lands on today
+    invalidate_report_days({report_cache.today_utc()}, report_cache.REPORT_PAGE, report_cache.REPORT_PAGE_PDF)
+
     flash(f"Report added successfully! ", "success")
     return jsonify({
         "message": "Report added successfully!",
@@ -271,42 +580,81 @@ def add_report():
 
 
 @app.route("/api/log", methods=["POST"])
+@login_required()
 def log_transaction():
-    if "user" not in session:
-        return redirect(url_for("auth"))
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON object is required."}), 400
+
+    # Extract fields from incoming JS object. Validated here, since the row is
+    # inserted later in a batch where a bad one can no longer be answered with 400
+    user_id = data.get("userId")
+    serial = data.get("serial")
+    status = data.get("status")
+    timestamp = data.get("timestamp")
+    if not isinstance(serial, str) or not serial.strip():
+        return jsonify({"error": "A 'serial' value is required."}), 400
+    # pharmlogs_daily (sql/003) keys its rollups on status, so every row needs one
+    if not isinstance(status, str) or not status.strip():
+        return jsonify({"error": "A 'status' value is required."}), 400
+    if user_id is not None and not isinstance(user_id, str):
+        return jsonify({"error": "'userId' must be a string."}), 400
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).isoformat()
+    else:
+        try:
+            timestamp = parse_iso_timestamp(timestamp).isoformat()
+        except (TypeError, ValueError):
+            return jsonify({"error": "'timestamp' must be an ISO 8601 date and time."}), 400
+
+    # Queued for the background batch insert into pharmlogs
+    # (/api/verify already logs its own scans; this stays for other clients)
+    log_queue.enqueue({
+        "user_id": user_id,
+        "serial": serial.strip(),
+        "status": status,
+        "timestamp": timestamp,
+    })
 
-    try:
-        # Extract fields from incoming JS object
-        user_id = data.get("userId")
-        serial = data.get("serial")
-        status = data.get("status")
-        timestamp = data.get("timestamp")
-
-        # Insert into Supabase pharmLogs table
-        supabase.table("pharmlogs").insert({
-            "user_id": user_id,
-            "serial": serial,
-            "status": status,
-            "timestamp": timestamp,
-        }).execute()
-
-        return jsonify({"success": True}), 201
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+    return jsonify({"success": True}), 202
 
 
 @app.route('/admin/add-records', methods=['GET'])
+@login_required("Admin")
 def add_records():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for("auth"))
-    return render_template('addRecords.html')
+    return render_template('addRecords.html', products=product_catalog.all())
+
+
+def form_product_code():
+    """The registered product picked on an add-record form, or None (after flashing why)."""
+    product_code = normalize_code(request.form.get('product_code'))
+    if not product_code or product_catalog.get(product_code) is None:
+        flash(f"Choose a registered product (got {product_code or 'none'}).", "danger")
+        return None
+    return product_code
+
+
+@app.route('/admin/add-product', methods=['POST'])
+@login_required("Admin")
+def add_product():
+    code = normalize_code(request.form.get('code'))
+    name = (request.form.get('name') or "").strip()
+    if not code or not name:
+        flash("Product code and name are required.", "danger")
+    elif product_catalog.get(code) is not None:
+        flash(f"Product {code} already exists.", "danger")
+    else:
+        product_catalog.add(code, name)
+        flash(f"Product {name} ({code}) added successfully.", "success")
+    return redirect(url_for('add_records'))
+
 
 @app.route('/admin/add-batch', methods=['POST'])
+@login_required("Admin")
 def add_batch():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for("auth"))
+    product_code = form_product_code()
+    if product_code is None:
+        return redirect(url_for('add_records'))
     # Extract form data
     batch_number = request.form.get('batch_number')
     manufacturer = request.form.get('manufacturer')
@@ -325,6 +673,7 @@ def add_batch():
 
     # Insert into Supabase table
     data = {
+        "product_code": product_code,
         "batch_number": batch_number,
         "manufacturer": manufacturer,
         "manufacture_date": manufacture_date,
@@ -333,21 +682,27 @@ def add_batch():
         "source_distributor": source_distributor
     }
 
-    response = supabase.table("AMOXICILLIN_BATCH").insert(data).execute()
+    response = execute(supabase.table(BATCH_TABLE).insert(data), idempotent=False)
 
     # Check for errors
     if isinstance(response.data, dict) and response.data.get("error"):
         flash(f"Error adding batch {batch_number}: {response.data['error']}", "danger")
     else:
+        verification_index.put_batch(data)
+        if replica is not None:
+            replica.apply(BATCH_TABLE, data)
+            replica_index.put_batch(data)
         flash(f"Batch {batch_number} added successfully.", "success")
 
     return redirect(url_for('add_records'))
  
 
 @app.route('/admin/add-serial', methods=['POST'])
+@login_required("Admin")
 def add_serial():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for(request.referrer))
+    product_code = form_product_code()
+    if product_code is None:
+        return redirect(url_for('add_records'))
     serial_no = request.form.get('serial_no')
     strength_form = request.form.get('strength_form')
     units_per_pack = request.form.get('units_per_pack')
@@ -360,6 +715,7 @@ def add_serial():
     packs_per_box = int(packs_per_box) if packs_per_box else None
 
     data = {
+        "product_code": product_code,
         "serial_no": serial_no,
         "strength_form": strength_form,
         "units_per_pack": units_per_pack,
@@ -368,26 +724,131 @@ def add_serial():
         "batch_number": batch_number
     }
 
-    response = supabase.table("AMOXICILLIN_SERIAL").insert(data).execute()
+    response = execute(supabase.table(SERIAL_TABLE).insert(data), idempotent=False)
 
     if isinstance(response.data, dict) and response.data.get("error"):
         flash(f"Error adding serial {serial_no}: {response.data['error']}", "danger")
     else:
+        verification_index.put_serial(data)
+        if replica is not None:
+            replica.apply(SERIAL_TABLE, data)
+            replica_index.put_serial(data)
         flash(f"Serial {serial_no} added successfully.", "success")
 
     return redirect(url_for('add_records'))
-    
+
+
+# -------------------------------
+# Bulk import (CSV / JSONL), see record_import.py
+# -------------------------------
+def refresh_imported_codes(table, records):
+    """Keeps the verification caches in step with a chunk of imported records."""
+    key = "batch_number" if table == BATCH_TABLE else "serial_no"
+    for record in records:
+        # Drops any cached "not found" answer for the code
+        verification_index.invalidate(record[key])
+    if known_codes is not None:
+        known_codes.add_many(record[key] for record in records)
+    if replica is not None:
+        replica.apply_many(table, records)
+        for record in records:
+            replica_index.invalidate(record[key])
+
+
+@app.route('/admin/import-records', methods=['GET'])
+@login_required("Admin")
+def import_records_page():
+    return render_template('importRecords.html', products=product_catalog.all())
+
+
+@app.route('/admin/import-records', methods=['POST'])
+@login_required("Admin", api=True)
+def import_records():
+    """Streams an uploaded CSV/JSONL file into the registries; responds with NDJSON progress lines."""
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return jsonify({"error": "Choose a CSV or JSONL file to import."}), 400
+    try:
+        fmt = detect_format(upload.filename, request.form.get("format"))
+        job = RecordImport(supabase, request.form.get("kind"), on_chunk=refresh_imported_codes,
+                           product=request.form.get("product_code"),
+                           known_products={product["code"] for product in product_catalog.all()})
+    except InvalidImport as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Flask closes the upload when this view returns, before the response is streamed,
+    # so the import reads from its own spooled copy
+    source = tempfile.TemporaryFile()
+    shutil.copyfileobj(upload.stream, source)
+    source.seek(0)
+
+    def events():
+        try:
+            for progress in job.run(iter_rows(source, fmt)):
+                yield json.dumps({"type": "progress", **progress}) + "\n"
+            yield json.dumps({"type": "done", **job.result()}) + "\n"
+        except Exception as e:
+            print(f"Import of {upload.filename} stopped: {e}")
+            yield json.dumps({"type": "error", "error": str(e), **job.result()}) + "\n"
+        finally:
+            source.close()
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson")
+
 
 """ ADMIN REPORTS """
 # -------------------------------
 # Pharmacy Vericication Queries report
 # -------------------------------
 
-def get_logs_from_db(start_date_str, end_date_str):
+# Rows per page when streaming pharmlogs / report_page
+KEYSET_PAGE_SIZE = 1000
+
+def iter_rows_by_keyset(table, columns, ts_column, start_iso, end_iso, page_size=KEYSET_PAGE_SIZE):
     """
-    Fetches raw log data from the database within the specified time frame.
+    Yields rows of `table` with start_iso <= ts_column <= end_iso, one page at a time.
 
-    NOTE: This is the critical function you must implement using your Supabase client.
+    Pages are walked with keyset pagination on (ts_column, id) instead of one
+    unbounded select, so nothing is silently cut off at the PostgREST row cap and
+    only one page is held in memory at a time.
+    """
+    last_ts = None
+    last_id = None
+    while True:
+        query = supabase.table(table) \
+            .select(f"{columns}, id") \
+            .gte(ts_column, start_iso) \
+            .lte(ts_column, end_iso)
+        if last_ts is not None:
+            # Resume strictly after the last row we returned
+            query = query.or_(f'{ts_column}.gt."{last_ts}",and({ts_column}.eq."{last_ts}",id.gt.{last_id})')
+        response = execute(query
+            .order(ts_column)
+            .order("id")
+            .limit(page_size))
+
+        page = response.data or []
+        for row in page:
+            last_ts = row[ts_column]
+            last_id = row.pop("id")
+            yield row
+        if len(page) < page_size:
+            break
+
+
+# Converts a pharmlogs timestamp string back to a datetime for the aggregation logic:
+# one ISO parser for every format Supabase and the SQLite backend return, keeping the
+# wall-clock time of offset-bearing values like the columnar engine does (dates.py)
+parse_log_timestamp = parse_wall_clock
+
+
+def iter_logs_from_db(start_date_str, end_date_str, columns='serial, status, timestamp', parse_timestamps=True):
+    """
+    Streams raw log data from the database within the specified time frame.
+
+    Timestamps are converted to datetime objects for the aggregation logic unless
+    parse_timestamps is False (the columnar engine parses them in bulk itself).
+    `columns` must include timestamp.
     """
     # 1. Parse date strings into datetime objects
     try:
@@ -398,45 +859,29 @@ def get_logs_from_db(start_date_str, end_date_str):
         end_date = end_date.replace(hour=23, minute=59, second=59)
     except ValueError:
         print("Error parsing date inputs.")
-        return []
+        return
 
-    # --- SUPABASE INTEGRATION POINT (IMPLEMENTATION REQUIRED) ---
-    raw_logs = []
-    if supabase:
-        try:
-            # Use the schema specified by the user: 'pharmlogs'
-            response = supabase.table('pharmlogs') \
-                .select('serial, status, timestamp') \
-                .gte('timestamp', start_date.isoformat()) \
-                .lte('timestamp', end_date.isoformat()) \
-                .execute()
-
-            # Supabase responses need to be parsed, usually response.data
-            raw_logs = response.data
-        except Exception as e:
-            print(f"Supabase query failed: {e}")
-            raw_logs = []
-    else:
-        print("Supabase client not initialized. Returning empty data.")
+    rows = iter_rows_by_keyset('pharmlogs', columns, 'timestamp',
+                               start_date.isoformat(), end_date.isoformat())
+    try:
+        for log in rows:
+            # IMPORTANT: The database returns timestamps as strings.
+            if parse_timestamps and isinstance(log['timestamp'], str):
+                log['timestamp'] = parse_log_timestamp(log['timestamp'])
+            yield log
+    except Exception as e:
+        # Raised rather than ending the stream early, so a partial report is never cached as complete
+        print(f"Supabase query failed: {e}")
+        raise
 
-    # IMPORTANT: The database returns timestamps as strings.
-    # We must convert them back to datetime objects for aggregation logic.
-    # Assuming the timestamp format is 'YYYY-MM-DD HH:MM:SS.mmm' or 'YYYY-MM-DDTHH:MM:SS+00:00'
-    for log in raw_logs:
-        if isinstance(log['timestamp'], str):
-            try:
-                # Attempt to parse common ISO formats returned by Supabase
-                log['timestamp'] = datetime.fromisoformat(log['timestamp'].replace('Z', '+00:00'))
-            except ValueError:
-                # Fallback for simpler format like 'YYYY-MM-DD HH:MM:SS.mmm'
-                try:
-                    log['timestamp'] = datetime.strptime(log['timestamp'], '%Y-%m-%d %H:%M:%S.%f')
-                except:
-                    # Fallback for format 'YYYY-MM-DD HH:MM:SS'
-                    log['timestamp'] = datetime.strptime(log['timestamp'], '%Y-%m-%d %H:%M:%S')
-
-    return raw_logs
-    # --- END SUPABASE INTEGRATION POINT ---
+
+def get_logs_from_db(start_date_str, end_date_str):
+    """
+    Fetches raw log data from the database within the specified time frame.
+
+    Materialises iter_logs_from_db; prefer the iterator for large ranges.
+    """
+    return list(iter_logs_from_db(start_date_str, end_date_str))
 
 
 def aggregate_log_data(raw_logs):
@@ -506,188 +951,251 @@ def aggregate_log_data(raw_logs):
     }
 
 
+REPORT_ENGINES = ("db", "python", "columnar")
+
+REPORT_RPC_PAGE_SIZE = 1000
+# Report RPCs that turned out not to be installed, so we stop asking for them
+MISSING_REPORT_RPCS = set()
+# PostgREST / Postgres "function does not exist"
+MISSING_FUNCTION_CODES = {"PGRST202", "42883"}
+
+REPORT_COUNT_KEYS = ('total_queries', 'authentic_count', 'counterfeit_count', 'expired_count', 'other_count')
+
+
+def call_report_rpc(name, params):
+    """Pages through a per-serial report RPC. Returns its rows, or None if the RPC is unavailable."""
+    if name in MISSING_REPORT_RPCS:
+        return None
+    rows = []
+    try:
+        # One row per distinct serial; page in case there are more serials than the row cap
+        offset = 0
+        while True:
+            response = execute(supabase.rpc(name, params)
+                .range(offset, offset + REPORT_RPC_PAGE_SIZE - 1))
+            page = response.data or []
+            rows.extend(page)
+            if len(page) < REPORT_RPC_PAGE_SIZE:
+                break
+            offset += REPORT_RPC_PAGE_SIZE
+    except Exception as e:
+        # Only a missing function is remembered; a timeout or 5xx falls back for this call alone
+        if is_api_error(e, *MISSING_FUNCTION_CODES):
+            print(f"{name} RPC not installed, computing reports in Python: {e}")
+            MISSING_REPORT_RPCS.add(name)
+        else:
+            print(f"{name} RPC failed, falling back for this report: {e}")
+        return None
+    return rows
+
+
+def summarize_report(report_data):
+    """Totals for the summary widgets, summed over per-serial rows."""
+    summary = {"total_queries": 0, "authentic_count": 0, "counterfeit_count": 0, "expired_count": 0}
+    for item in report_data:
+        for key in summary:
+            summary[key] += item[key]
+    return summary
+
+
+def merge_report_data(*parts):
+    """Combines per-serial report rows computed over disjoint date ranges."""
+    merged = {}
+    for part in parts:
+        for item in part:
+            entry = merged.get(item['serial'])
+            if entry is None:
+                merged[item['serial']] = dict(item)
+                continue
+            for key in REPORT_COUNT_KEYS:
+                entry[key] += item.get(key, 0)
+            # 'YYYY-MM-DD HH:MM:SS' strings compare chronologically
+            if (item['last_query_timestamp'] or '') > (entry['last_query_timestamp'] or ''):
+                entry['last_query_timestamp'] = item['last_query_timestamp']
+    return list(merged.values())
+
+
+def get_aggregated_logs_from_db(start_date_str, end_date_str):
+    """
+    Per-serial counts and totals computed in Postgres (sql/002_pharmlogs_report.sql).
+
+    Returns the same (report_data, summary) pair as aggregate_log_data, or None if
+    the RPC is unavailable so the caller can fall back to the Python path.
+    """
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+    except ValueError:
+        print("Error parsing date inputs.")
+        return [], summarize_report([])
+
+    params = {"start_ts": start_date.isoformat(), "end_ts": end_date.isoformat()}
+    report_data = call_report_rpc("pharmlogs_report", params)
+    if report_data is None:
+        return None
+    return report_data, summarize_report(report_data)
+
+
+def get_aggregated_logs_from_rollups(start_date_str, end_date_str):
+    """
+    Report built from the daily rollups (sql/003_pharmlogs_daily.sql).
+
+    Closed days come pre-aggregated from pharmlogs_daily; only today's raw
+    pharmlogs rows are scanned, so long ranges cost about the same as short ones.
+    Returns None if the rollup RPC is unavailable.
+    """
+    try:
+        start_day = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_day = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        print("Error parsing date inputs.")
+        return [], summarize_report([])
+
+    # pharmlogs timestamps are stored in UTC
+    today = datetime.now(timezone.utc).date()
+    closed_end = min(end_day, today - timedelta(days=1))
+
+    parts = []
+    if start_day <= closed_end:
+        closed = call_report_rpc("pharmlogs_rollup_report", {
+            "start_day": start_day.isoformat(),
+            "end_day": closed_end.isoformat(),
+        })
+        if closed is None:
+            return None
+        parts.append(closed)
+
+    if end_day >= today and start_day <= end_day:
+        open_start = max(start_day, today).isoformat()
+        live = get_aggregated_logs_from_db(open_start, end_date_str)
+        if live is None:
+            live = aggregate_log_data(iter_logs_from_db(open_start, end_date_str))
+        parts.append(live[0])
+
+    report_data = merge_report_data(*parts)
+    return report_data, summarize_report(report_data)
+
+
+def parse_report_filters(args):
+    """
+    Reads the report filters from request args / JSON.
+
+    engine: "db" (rollups, then RPC, then python), "python" or "columnar".
+    breakdown: comma-separated subset of log_aggregation.BREAKDOWNS; needs the columnar engine.
+    Returns (engine, breakdowns, error_message).
+    """
+    engine = args.get('engine') or 'db'
+    breakdowns = [b for b in (args.get('breakdown') or '').split(',') if b]
+    if engine not in REPORT_ENGINES:
+        return None, None, f"Unknown engine '{engine}'."
+    if any(b not in log_aggregation.BREAKDOWNS for b in breakdowns):
+        return None, None, f"Breakdown must be one of {', '.join(log_aggregation.BREAKDOWNS)}."
+    if breakdowns:
+        engine = 'columnar'
+    if engine == 'columnar' and not log_aggregation.AVAILABLE:
+        return None, None, "The columnar engine requires numpy on the server."
+    return engine, tuple(breakdowns), None
+
+
+def compute_query_report(start_date, end_date, engine='db', breakdowns=()):
+    """Aggregated verification query report for a date range: (report_data, summary). Cached."""
+    key, includes_today = ReportCache.make_key(report_cache.QUERY_REPORT, start_date, end_date, engine, breakdowns)
+    aggregated = report_results.get(key)
+    if aggregated is None:
+        aggregated = _compute_query_report(start_date, end_date, engine, breakdowns)
+        report_results.put(key, aggregated, includes_today)
+    return aggregated
+
+
+def _compute_query_report(start_date, end_date, engine, breakdowns):
+    aggregated = None
+    if engine == 'db':
+        aggregated = get_aggregated_logs_from_rollups(start_date, end_date)
+        if aggregated is None:
+            aggregated = get_aggregated_logs_from_db(start_date, end_date)
+    if engine == 'columnar':
+        columns = 'serial, status, timestamp, user_id' if 'user' in breakdowns else 'serial, status, timestamp'
+        raw_logs = iter_logs_from_db(start_date, end_date, columns, parse_timestamps=False)
+        aggregated = log_aggregation.aggregate_log_data_columnar(raw_logs, breakdowns)
+    elif aggregated is None:
+        # Fallback: stream raw rows through the Python aggregation
+        raw_logs = iter_logs_from_db(start_date, end_date)
+        aggregated = aggregate_log_data(raw_logs)
+    return aggregated
+
+
 @app.route('/api/report', methods=['GET'])
+@login_required("Admin")
 def get_report_data():
     """Endpoint to fetch and return aggregated log data as JSON."""
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for(request.referrer))
-    else:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
 
-        if not start_date or not end_date:
-            return jsonify({"error": "Start and end dates are required."}), 400
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates are required."}), 400
 
-        raw_logs = get_logs_from_db(start_date, end_date)
-        aggregated_data, summary = aggregate_log_data(raw_logs)
+    engine, breakdowns, error = parse_report_filters(request.args)
+    if error:
+        return jsonify({"error": error}), 400
 
-        return jsonify({
-            "reportData": aggregated_data,
-            "summary": summary
-        })
+    try:
+        aggregated_data, summary = compute_query_report(start_date, end_date, engine, breakdowns)
+    except Exception as e:
+        return jsonify({"error": f"Failed to load the report: {e}"}), 500
+
+    return jsonify({
+        "reportData": aggregated_data,
+        "summary": summary
+    })
 
 
 @app.route('/api/generate_pdf', methods=['POST'])
+@login_required("Admin")
 def generate_pdf_report():
     """
-    Endpoint to generate a PDF report from the aggregated data.
+    Endpoint to generate a PDF report of the verification queries for a date range.
     """
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for(request.referrer))
-    else:
-        # 1. Get the JSON data sent from the client
-        data = request.get_json()
-        if not data or 'reportData' not in data:
-            return jsonify({"error": "No report data provided."}), 400
-
-        report_data = data['reportData']
-        start_date = data.get('startDate', 'N/A')
-        end_date = data.get('endDate', 'N/A')
-
-        # Calculate summary data
-        total_queries = sum(row.get("total_queries", 0) for row in report_data)
-        authentic_count = sum(row.get("authentic_count", 0) for row in report_data)
-        counterfeit_count = sum(row.get("counterfeit_count", 0) for row in report_data)
-        expired_count = sum(row.get("expired_count", 0) for row in report_data)
-
-        # --- PDF GENERATION LOGIC (Example using ReportLab concept) ---
-        try:
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter, title="Verification Log Report")
-            styles = getSampleStyleSheet()
-            elements = []
-
-            # -----------------------------------------------------
-            # 1. PHARMACHECK TEXT LOGO
-            # -----------------------------------------------------
-            logo_style = ParagraphStyle(
-                name="LogoStyle",
-                parent=styles["Normal"],
-                fontName="Helvetica-Oblique",
-                fontSize=22,
-                textColor=colors.HexColor("#2A6A50"),  # Logo color
-                alignment=1,
-            )
-
-            elements.append(Paragraph("Pharmacheck", logo_style))
-            elements.append(Spacer(1, 18))
-
-            # -----------------------------------------------------
-            # 2. TITLE + DATE PERIOD
-            # -----------------------------------------------------
-            elements.append(Paragraph("Pharmacy Query Log Report", styles["Title"]))
-            elements.append(Paragraph(f"Period: {start_date} to {end_date}", styles["Normal"]))
-
-            # -----------------------------------------------------
-            # 3. SUMMARY SECTION (New Section Added)
-            # -----------------------------------------------------
-            elements.append(Spacer(1, 18))  # Space before the summary section
-            summary_text = f"""
-                <b>Total Queries:</b> {total_queries}<br/>
-                <b>Authentic Queries:</b> {authentic_count}<br/>
-                <b>Counterfeit Queries:</b> {counterfeit_count}<br/>
-                <b>Expired Queries:</b> {expired_count}
-            """
-            elements.append(Paragraph(summary_text, styles["Normal"]))
-
-            # Add space before table
-            elements.append(Spacer(1, 24))
-
-            # -----------------------------------------------------
-            # 4. TABLE DATA
-            # -----------------------------------------------------
-            table_headers = [
-                "Serial No.",
-                "Total Queries",
-                "Authentic Count",
-                "Counterfeit Count",
-                "Expired Count",
-                "Last Query"
-            ]
-
-            table_rows = [table_headers]
-
-            for row in report_data:
-                table_rows.append([
-                    row.get("serial", ""),
-                    str(row.get("total_queries", "")),
-                    str(row.get("authentic_count", "")),
-                    str(row.get("counterfeit_count", "")),
-                    str(row.get("expired_count", "")),
-                    row.get("last_query_timestamp") or ""
-                ])
-
-            # -----------------------------------------------------
-            # 5. TABLE STYLE
-            # -----------------------------------------------------
-            if len(table_rows) > 1:
-
-                table = Table(table_rows)
-
-                header_bg = colors.HexColor("#12B981")  # Your green
-
-                table.setStyle(TableStyle([
-                    # HEADER
-                    ("BACKGROUND", (0, 0), (-1, 0), header_bg),
-                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                    ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-                    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                    ("FONTSIZE", (0, 0), (-1, 0), 11),
-                    ("TOPPADDING", (0, 0), (-1, 0), 6),
-                    ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
-
-                    # BODY
-                    ("BACKGROUND", (0, 1), (-1, -1), colors.white),
-                    ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),
-                    ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-                    ("FONTSIZE", (0, 1), (-1, -1), 10),
-                    ("ALIGN", (0, 1), (-1, -1), "CENTER"),
-
-                    # GRID
-                    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-
-                    # Padding
-                    ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                    ("TOPPADDING", (0, 1), (-1, -1), 4),
-                    ("BOTTOMPADDING", (0, 1), (-1, -1), 4),
-                ]))
-
-                elements.append(table)
-
-            else:
-                elements.append(Paragraph(
-                    "No data available for the selected time frame.",
-                    styles["Normal"]
-                ))
-
-            # -----------------------------------------------------
-            # 6. FINALIZE PDF
-            # -----------------------------------------------------
-            doc.build(elements)
-            buffer.seek(0)
-
-            return send_file(
-                buffer,
-                mimetype='application/pdf',
-                as_attachment=True,
-                download_name=f'pharm_log_report_{start_date}_to_{end_date}.pdf'
-            )
-
-        except ImportError:
-            # Fallback if ReportLab is not installed
-            print("ReportLab library not found. PDF generation not supported.")
-            return jsonify({"error": "PDF generation library (e.g., ReportLab) is not installed on the server."}), 500
-        except Exception as e:
-            print(f"An error occurred during PDF generation: {e}")
-            return jsonify({"error": f"Failed to generate PDF: {str(e)}"}), 500
+    # 1. Only the date range (and filters) comes from the client;
+    #    the report itself is regenerated here rather than posted back
+    data = request.get_json(silent=True) or {}
+    start_date = data.get('startDate')
+    end_date = data.get('endDate')
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates are required."}), 400
+
+    engine, breakdowns, error = parse_report_filters(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # --- PDF GENERATION LOGIC (pdf_reports.py) ---
+    try:
+        # ReportLab is only imported by the first export, not at startup
+        import pdf_reports
+    except ImportError:
+        # Fallback if ReportLab is not installed
+        print("ReportLab library not found. PDF generation not supported.")
+        return jsonify({"error": "PDF generation library (e.g., ReportLab) is not installed on the server."}), 500
+
+    key, includes_today = ReportCache.make_key(report_cache.QUERY_REPORT_PDF, start_date, end_date, engine, breakdowns)
+    return export_pdf(key, includes_today, f'pharm_log_report_{start_date}_to_{end_date}.pdf',
+                      lambda: build_query_log_pdf(key, includes_today, start_date, end_date, engine, breakdowns),
+                      wait=data.get('wait') is True)
+
+
+def build_query_log_pdf(key, includes_today, start_date, end_date, engine, breakdowns):
+    import pdf_reports
+    pdf_file = cached_pdf(key)
+    if pdf_file is None:
+        report_data, summary = compute_query_report(start_date, end_date, engine, breakdowns)
+        with metrics.PDF_RENDER_SECONDS.time("query_log"):
+            pdf_file = pdf_reports.render_query_log_pdf(report_data, start_date, end_date, summary)
+        pdf_file = cache_pdf(key, pdf_file, includes_today)
+    return pdf_file
 
 @app.route('/admin/reports/queries')
+@login_required("Admin")
 def admin_reports():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for('auth'))
-    else:
-        return render_template("admin_reports.html")
+    return render_template("admin_reports.html")
 
 # -------------------------------
 # Pharmacy Reported Drugs report
@@ -695,178 +1203,292 @@ def admin_reports():
 # Fetch rows directly from report_page
 # -------------------------------
 
-def get_reports_from_db(start_date_str, end_date_str):
+def iter_reports_from_db(start_date_str, end_date_str):
     try:
         # Parse the input date strings into datetime objects
         start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
         end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
     except ValueError:
         print("Date parsing failed")
-        return []
+        return
 
-    try:
-        # Normalize the start_date to the beginning of the day (00:00:00)
-        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Normalize the end_date to the end of the day (23:59:59)
-        end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        # Query the database for records within the date range
-        response = supabase.table("report_page") \
-            .select("product_name, batch_serial, location, description, email, created_at") \
-            .gte("created_at", start_date.isoformat()) \
-            .lte("created_at", end_date.isoformat()) \
-            .execute()
-
-        # Return the data or an empty list if no data is found
-        return response.data or []
+    # Normalize the start_date to the beginning of the day (00:00:00)
+    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
 
+    # Normalize the end_date to the end of the day (23:59:59)
+    end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+    # Stream the records within the date range page by page
+    rows = iter_rows_by_keyset("report_page", "product_name, batch_serial, location, description, email, created_at",
+                               "created_at", start_date.isoformat(), end_date.isoformat())
+    try:
+        yield from rows
     except Exception as e:
+        # Raised, not swallowed: callers cache what they stream (cached_report_rows)
         print(f"Supabase query error: {e}")
-        return []
+        raise
+
+
+def get_reports_from_db(start_date_str, end_date_str):
+    # Materialises iter_reports_from_db; prefer the iterator for large ranges
+    return list(iter_reports_from_db(start_date_str, end_date_str))
+
+
+def format_report_row(row):
+    # Format timestamps
+    if "created_at" in row and isinstance(row["created_at"], str):
+        row["created_at"] = row["created_at"].replace("T", " ").split("+")[0]
+    return row
+
+
+# Larger results are streamed but not cached
+MAX_CACHED_REPORT_ROWS = 20_000
+MAX_CACHED_PDF_BYTES = 4 * 1024 * 1024
+
+def cached_report_rows(start_date, end_date):
+    """Formatted report_page rows for a range, from the cache or streamed from Supabase (and cached)."""
+    key, includes_today = ReportCache.make_key(report_cache.REPORT_PAGE, start_date, end_date)
+    rows = report_results.get(key)
+    if rows is not None:
+        return iter(rows)
+    return _cache_while_streaming(key, includes_today,
+                                  (format_report_row(row) for row in iter_reports_from_db(start_date, end_date)))
+
+
+def _cache_while_streaming(key, includes_today, rows):
+    # Cached only once `rows` is exhausted: an error from the source propagates before put()
+    kept = []
+    for row in rows:
+        if kept is not None:
+            kept.append(row)
+            if len(kept) > MAX_CACHED_REPORT_ROWS:
+                kept = None
+        yield row
+    if kept is not None:
+        report_results.put(key, kept, includes_today)
+
+
+def cached_pdf(key):
+    pdf_bytes = report_results.get(key)
+    return io.BytesIO(pdf_bytes) if pdf_bytes is not None else None
+
+
+def cache_pdf(key, pdf_file, includes_today):
+    """Caches a rendered PDF if it is small enough; returns a file object to send either way."""
+    size = pdf_file.seek(0, os.SEEK_END)
+    pdf_file.seek(0)
+    if size > MAX_CACHED_PDF_BYTES:
+        return pdf_file
+    pdf_bytes = pdf_file.read()
+    pdf_file.close()
+    report_results.put(key, pdf_bytes, includes_today)
+    return io.BytesIO(pdf_bytes)
+
+
+def stream_json_list(rows):
+    """
+    Serialises an iterable of dicts as a JSON array without building the whole list.
+
+    The 200 status is sent with the first element, so a failure further on cannot
+    become an error response. Instead the array ends with one last element
+    {"error": "..."}; a client that finds it knows the rows before it are
+    incomplete. A complete array never contains an "error" key.
+    """
+    yield "["
+    i = 0
+    try:
+        for row in rows:
+            yield ("," if i else "") + json.dumps(row)
+            i += 1
+    except Exception as e:
+        print(f"Report stream failed after {i} rows: {e}")
+        yield ("," if i else "") + json.dumps({"error": "The report was cut short by a server error; please try again."})
+    yield "]"
 
 # -------------------------------
 # API returns JSON list
 # -------------------------------
 @app.route("/api/report2", methods=["GET"])
+@login_required("Admin")
 def get_report_data2():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for(request.referrer))
-    else:
-        start_date = request.args.get("start_date")
-        end_date = request.args.get("end_date")
-
-        if not start_date or not end_date:
-            return jsonify({"error": "Start and end dates required"}), 400
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
 
-        rows = get_reports_from_db(start_date, end_date)
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
 
-        # Format timestamps
-        for row in rows:
-            if "created_at" in row and isinstance(row["created_at"], str):
-                row["created_at"] = row["created_at"].replace("T", " ").split("+")[0]
+    rows = cached_report_rows(start_date, end_date)
 
-        return jsonify(rows)
+    # Streamed so large ranges are never held in memory as one list. If reading fails
+    # mid-stream the array ends with an {"error": ...} element (stream_json_list).
+    return Response(stream_json_list(rows), mimetype="application/json")
 
 # -------------------------------
 # PDF GENERATION
 # -------------------------------
 @app.route("/api/generate_pdf_2", methods=["POST"])
+@login_required("Admin")
 def generate_pdf_report_2():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for(request.referrer))
-    else:
-        data = request.get_json()
-        if not data or "reportData" not in data:
-            return jsonify({"error": "No report data provided"}), 400
-
-        report_data = data["reportData"]
-        start_date = data.get("startDate", "N/A")
-        end_date = data.get("endDate", "N/A")
+    # Only the date range comes from the client; rows are streamed from report_page
+    data = request.get_json(silent=True) or {}
+    start_date = data.get("startDate")
+    end_date = data.get("endDate")
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
+
+    key, includes_today = ReportCache.make_key(report_cache.REPORT_PAGE_PDF, start_date, end_date)
+    return export_pdf(key, includes_today, f"report_page_{start_date}_to_{end_date}.pdf",
+                      lambda: build_report_page_pdf(key, includes_today, start_date, end_date),
+                      wait=data.get("wait") is True)
+
+
+def build_report_page_pdf(key, includes_today, start_date, end_date):
+    import pdf_reports
+    pdf_file = cached_pdf(key)
+    if pdf_file is None:
+        report_data = cached_report_rows(start_date, end_date)
+        with metrics.PDF_RENDER_SECONDS.time("report_page"):
+            pdf_file = pdf_reports.render_report_page_pdf(report_data, start_date, end_date)
+        pdf_file = cache_pdf(key, pdf_file, includes_today)
+    return pdf_file
 
+# -------------------------------
+# PDF export jobs (pdf_jobs.py)
+# -------------------------------
+def export_pdf(key, includes_today, filename, build, wait=False):
+    """
+    Queues `build` as a background export and answers 202 with the job; identical
+    exports in flight share one job. With "wait": true in the request the PDF is
+    rendered and sent in the response instead, as before.
+    """
+    if wait:
         try:
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter, title="Report Page Export")
-            styles = getSampleStyleSheet()
-            elements = []
-
-
-            # -----------------------------------------------------
-            # TEXT LOGO AT TOP
-            # -----------------------------------------------------
-            logo_style = ParagraphStyle(
-                name="LogoStyle",
-                parent=styles["Normal"],
-                fontName="Helvetica-Oblique",       # Italic
-                fontSize=22,
-                textColor=colors.HexColor("#2A6A50"),
-                alignment=1,
-            )
-
-            logo_paragraph = Paragraph("Pharmacheck", logo_style)
-            elements.append(logo_paragraph)
-            elements.append(Spacer(1, 18))   # Space under logo
-
-
-            # Title
-            elements.append(Paragraph("Report Page Export", styles["Title"]))
-            elements.append(Paragraph(f"Period: {start_date} to {end_date}", styles["Normal"]))
-            elements.append(Paragraph("<br/>", styles["Normal"]))
-
-            # Extra spacing before table
-            elements.append(Spacer(1, 24))
-
-            # Table headers
-            headers = ["Product Name", "Batch/Serial No", "Location", "Description", "Email", "Created At"]
-            rows = [headers]
-
-            # Table rows
-            for r in report_data:
-                rows.append([
-                    r.get("product_name", ""),
-                    r.get("batch_serial", ""),
-                    r.get("location", ""),
-                    r.get("description", ""),
-                    r.get("email", ""),
-                    r.get("created_at", "")
-                ])
-
-            table = Table(rows)
-            
-            # Header color you wanted
-            header_bg = colors.HexColor("#12B981")
-
-            # -----------------------------------------------------
-            # TABLE STYLE
-            # -----------------------------------------------------
-            table.setStyle(TableStyle([
-                # HEADER
-                ("BACKGROUND", (0, 0), (-1, 0), header_bg),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-                ("FONTSIZE", (0, 0), (-1, 0), 11),
-
-                # BODY
-                ("BACKGROUND", (0, 1), (-1, -1), colors.white),
-                ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),
-                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-                ("FONTSIZE", (0, 1), (-1, -1), 10),
-
-                # GRID
-                ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-
-                # Padding for readability
-                ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                ("TOPPADDING", (0, 0), (-1, -1), 4),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-            ]))
-
-            elements.append(table)
-            doc.build(elements)
-            buffer.seek(0)
-
-            return send_file(
-                buffer,
-                mimetype="application/pdf",
-                as_attachment=True,
-                download_name=f"report_page_{start_date}_to_{end_date}.pdf"
-            )
-
+            return send_file(build(), mimetype="application/pdf", as_attachment=True, download_name=filename)
         except Exception as e:
-            print(e)
-            return jsonify({"error": f"PDF error: {str(e)}"}), 500
+            print(f"An error occurred during PDF generation: {e}")
+            return jsonify({"error": f"Failed to generate PDF: {str(e)}"}), 500
+    try:
+        job = pdf_jobs.submit(key, filename, build, live=includes_today)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(pdf_job_response(job)), 202
+
+
+def pdf_job_response(job):
+    response = {
+        "jobId": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "size": job["size"],
+        "error": job["error"],
+        "statusUrl": url_for("pdf_job_status", job_id=job["id"]),
+    }
+    if job["status"] == "done":
+        response["downloadUrl"] = url_for("download_pdf_job", job_id=job["id"])
+    return response
+
+
+@app.route("/api/pdf_jobs/<job_id>", methods=["GET"])
+@login_required("Admin")
+def pdf_job_status(job_id):
+    """Status of an export; ?wait=<seconds> holds the request until it finishes (long-poll)."""
+    try:
+        wait = min(float(request.args.get("wait", 0)), PDF_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds."}), 400
+    job = pdf_jobs.wait(job_id, wait) if wait > 0 else pdf_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired export."}), 404
+    return jsonify(pdf_job_response(job))
+
+
+@app.route("/api/pdf_jobs/<job_id>/download", methods=["GET"])
+@login_required("Admin")
+def download_pdf_job(job_id):
+    job = pdf_jobs.get(job_id)
+    path = pdf_jobs.pdf_path(job_id)
+    if job is None or path is None:
+        return jsonify({"error": "The export is not ready or has expired."}), 404
+    return send_file(path, mimetype="application/pdf", as_attachment=True, download_name=job["filename"])
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required("Admin")
+def cache_stats():
+    """Hit/miss counters for the caches and per-route timings (for tuning)."""
+    return jsonify({
+        "reports": report_results.stats(),
+        "verification": verification_index.stats(),
+        "log_queue": log_queue.stats(),
+        "pdf_jobs": pdf_jobs.stats(),
+        "replica": replica.stats() if replica is not None else None,
+        "known_codes": known_codes.stats() if known_codes is not None else None,
+        "products": product_catalog.stats(),
+        "profiles": profile_cache.stats(),
+        "sessions": session_store.stats() if session_store is not None else None,
+        "routes": metrics.REQUEST_SECONDS.stats(),
+    })
+
 
 @app.route('/admin/reports/pharmReports', methods=['GET'])
+@login_required("Admin")
 def admin_reports2():
-    if "user" not in session or session.get("role") != "Admin":
-        return redirect(url_for('auth'))
-    else:
-        return render_template("admin_reports2.html")
+    return render_template("admin_reports2.html")
+
+
+# -------------------------------
+# Warm-up (gunicorn.conf.py / serve.py)
+# -------------------------------
+def precompile_templates():
+    """Compiles every template once; done in the gunicorn master so forked workers share them."""
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+# Imported on first use rather than at startup (fast cold starts); see benchmarks/importtime.py
+DEFERRED_MODULES = ("pdf_reports", "supabase", "postgrest", "httpx", "numpy")
 
 
+def preload_libraries():
+    """
+    Imports the DEFERRED_MODULES without creating any client. The gunicorn master
+    does this before forking, so workers share them instead of importing their own.
+    """
+    loaded = []
+    for name in DEFERRED_MODULES:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            pass
+    return loaded
+
+
+def warm_up(verification=True):
+    """
+    Readies this worker before (or while) it takes traffic: starts its background
+    replica sync and known-code filter, loads the product catalog and, with
+    `verification`, bulk-loads the verification index so first scans are not
+    cache misses. Returns what was loaded, for the server log.
+    """
+    started = time.perf_counter()
+    loaded = {}
+    if replica is not None:
+        replica.start()
+    if known_codes is not None:
+        known_codes.start()
+    try:
+        loaded["products"] = len(product_catalog.all())
+        if verification:
+            index, _ = verification_source()
+            loaded["verification_rows"] = index.warm()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+    loaded["seconds"] = round(time.perf_counter() - started, 2)
+    return loaded
+
 
-# Run the app
+# Run the app (development server; see serve.py for production)
 if __name__ == '__main__':
     app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
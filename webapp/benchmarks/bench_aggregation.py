@@ -0,0 +1,79 @@
+"""
+Compares the two pharmlogs aggregation engines used by /api/report.
+
+    cd webapp
+    python benchmarks/bench_aggregation.py                 # 10k, 100k and 1M rows
+    python benchmarks/bench_aggregation.py --rows 10000 --repeat 5
+
+Rows are synthetic (datagen.make_logs) but shaped like PostgREST returns them
+(ISO timestamp strings). Each engine is timed the way /api/report runs it: the
+Python engine includes parse_log_timestamp per row, the columnar engine parses
+in bulk.
+Each run also checks that both engines return identical results, on these
+rows and on a copy whose timestamps carry UTC offsets (which both engines
+must drop the same way), and exits with status 1 if they differ.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datagen import make_logs  # noqa: E402
+from app import aggregate_log_data, parse_log_timestamp  # noqa: E402
+import log_aggregation  # noqa: E402
+
+
+def python_engine(rows):
+    for log in rows:
+        log["timestamp"] = parse_log_timestamp(log["timestamp"])
+    return aggregate_log_data(rows)
+
+
+def columnar_engine(rows):
+    return log_aggregation.aggregate_log_data_columnar(rows)
+
+
+def best_of(fn, logs, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        # Fresh copies: the Python engine parses timestamps in place
+        rows = [dict(log) for log in logs]
+        started = time.perf_counter()
+        result = fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run(sizes, repeat):
+    results = []
+    for n_rows in sizes:
+        logs = make_logs(n_rows)
+        python_s, python_result = best_of(python_engine, logs, repeat)
+        row = {"rows": n_rows, "python_s": round(python_s, 4)}
+        if log_aggregation.AVAILABLE:
+            columnar_s, columnar_result = best_of(columnar_engine, logs, repeat)
+            row["columnar_s"] = round(columnar_s, 4)
+            row["speedup"] = round(python_s / columnar_s, 2)
+            row["identical"] = python_result == columnar_result
+            offset_logs = make_logs(n_rows, offsets=True)
+            row["identical_with_offsets"] = (python_engine([dict(log) for log in offset_logs])
+                                             == columnar_engine(offset_logs))
+        results.append(row)
+        print(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if not log_aggregation.AVAILABLE:
+        print("numpy is not installed; only timing the Python engine.")
+    results = run(args.rows, args.repeat)
+    if not all(row.get("identical", True) and row.get("identical_with_offsets", True) for row in results):
+        sys.exit("The engines disagree.")
@@ -0,0 +1,100 @@
+"""
+Times the date parsing on the report and verification paths (dates.py).
+
+    cd webapp
+    python benchmarks/bench_dates.py                       # 1M rows
+    python benchmarks/bench_dates.py --rows 100000 --repeat 5
+
+Timestamps: the old three-attempt parse_log_timestamp against
+dates.parse_iso_timestamp and its pre-3.11 fallback, on pharmlogs timestamps
+in the shapes the backends return them:
+
+    sqlite     '2025-01-01T10:00:00.123'        (SQLite backend)
+    supabase   '2025-01-01T10:00:00.123+00:00'  (PostgREST, timestamptz)
+    trimmed    '2025-01-01 10:00:00.12'         (trailing zeros dropped, space separator)
+
+Expiry: the old strptime-per-scan checkForExpiry against dates.is_expired,
+one scan per row over the expiry dates of datagen batches.
+Each run also checks that old and new give identical results.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datagen import make_batches, make_logs  # noqa: E402
+import dates  # noqa: E402
+
+
+def legacy_parse_log_timestamp(value):
+    # parse_log_timestamp before dates.py
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+        except ValueError:
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def legacy_check_for_expiry(date_string):
+    # checkForExpiry before dates.py
+    return date.today() > datetime.strptime(date_string, "%Y-%m-%d").date()
+
+
+def timestamp_shapes(n_rows):
+    sqlite = [log["timestamp"] for log in make_logs(n_rows)]
+    return {
+        "sqlite": sqlite,
+        "supabase": [value + "+00:00" for value in sqlite],
+        "trimmed": [value.replace("T", " ").rstrip("0").rstrip(".") for value in sqlite],
+    }
+
+
+def best_of(fn, values, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = [fn(value) for value in values]
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run(n_rows, repeat):
+    parsers = {
+        "legacy": legacy_parse_log_timestamp,
+        "parse_iso_timestamp": dates.parse_iso_timestamp,
+        "compat_fallback": dates._parse_iso_timestamp_compat,
+    }
+    for shape, values in timestamp_shapes(n_rows).items():
+        row = {"timestamps": shape, "rows": n_rows}
+        baseline = None
+        for name, parser in parsers.items():
+            seconds, result = best_of(parser, values, repeat)
+            row[f"{name}_s"] = round(seconds, 4)
+            if baseline is None:
+                baseline = result
+            else:
+                row[f"{name}_identical"] = result == baseline
+        row["speedup"] = round(row["legacy_s"] / row["parse_iso_timestamp_s"], 2)
+        print(row)
+
+    expiry_dates = [batch["expiry_date"] for batch in make_batches(2000)]
+    scans = [expiry_dates[i % len(expiry_dates)] for i in range(n_rows)]
+    legacy_s, legacy_result = best_of(legacy_check_for_expiry, scans, repeat)
+    new_s, new_result = best_of(dates.is_expired, scans, repeat)
+    print({"expiry_checks": n_rows, "legacy_s": round(legacy_s, 4), "is_expired_s": round(new_s, 4),
+           "speedup": round(legacy_s / new_s, 2), "identical": legacy_result == new_result})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
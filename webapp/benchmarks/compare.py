@@ -0,0 +1,76 @@
+"""
+Compares two benchmark result files (load_test.py / micro.py --output).
+
+    cd webapp
+    python benchmarks/compare.py baseline.json candidate.json
+    python benchmarks/compare.py baseline.json candidate.json --threshold 0.15
+
+Prints every shared metric with its relative change. Latencies and timings
+(*_ms, *_s, *_us) regress when they grow, throughput when it shrinks, and
+error counts whenever they grow at all. Exits with status 1 if any metric
+regressed by more than `--threshold` (default 10%), so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+# Metric name suffix -> True if larger is better
+DIRECTIONS = {"_rps": True, "_ms": False, "_s": False, "_us": False}
+
+
+def direction(metric):
+    for suffix, higher_is_better in DIRECTIONS.items():
+        if metric.endswith(suffix):
+            return higher_is_better
+    return None
+
+
+def compare(baseline, candidate, threshold):
+    """[(case, metric, old, new, change, regressed)] for metrics present in both files."""
+    rows = []
+    for case, old_metrics in baseline["results"].items():
+        new_metrics = candidate["results"].get(case)
+        if new_metrics is None:
+            continue
+        for metric, old in old_metrics.items():
+            new = new_metrics.get(metric)
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+                continue
+            if metric == "errors":
+                rows.append((case, metric, old, new, None, new > old))
+                continue
+            higher_is_better = direction(metric)
+            if higher_is_better is None or not old:
+                continue
+            change = (new - old) / old
+            regressed = -change > threshold if higher_is_better else change > threshold
+            rows.append((case, metric, old, new, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get("benchmark") != candidate.get("benchmark"):
+        sys.exit(f"Cannot compare a {baseline.get('benchmark')} result with a {candidate.get('benchmark')} result.")
+
+    rows = compare(baseline, candidate, args.threshold)
+    regressions = 0
+    for case, metric, old, new, change, regressed in rows:
+        regressions += regressed
+        change_text = f"{change:+.1%}" if change is not None else ""
+        print(f"{case:<28} {metric:<16} {old:>12} -> {new:<12} {change_text:>8}{'  REGRESSION' if regressed else ''}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%}" if regressions else "No regressions.")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
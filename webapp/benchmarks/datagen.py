@@ -0,0 +1,113 @@
+"""
+Synthetic registry, pharmlogs and report_page data for the benchmarks.
+
+Everything is generated from a seed, so two runs of a benchmark see the same
+rows. `seed_store()` bulk-loads the rows into a storage.SQLiteStore (e.g. the
+one behind fake_postgrest.FakePostgREST) with executemany; going through the
+insert API would make seeding a million logs take minutes.
+"""
+import random
+from datetime import datetime, timedelta
+
+PRODUCT_CODE = "AMOXICILLIN"
+STATUSES = ["AUTHENTIC", "AUTHENTIC", "AUTHENTIC", "COUNTERFEIT", "EXPIRED", "authentic"]
+LOG_START = datetime(2025, 1, 1)
+LOG_DAYS = 90
+# Suffixes for make_logs(offsets=True); "" keeps some rows plain
+UTC_OFFSETS = ["", "Z", "+00:00", "-05:00", "+05:30", "+09"]
+
+
+def make_batches(n, seed=1, expired_share=0.1, product_code=PRODUCT_CODE):
+    rng = random.Random(seed)
+    batches = []
+    for i in range(n):
+        expired = rng.random() < expired_share
+        expiry = datetime(2024, 1, 1) + timedelta(days=rng.randrange(365)) if expired \
+            else datetime(2027, 1, 1) + timedelta(days=rng.randrange(3 * 365))
+        batches.append({
+            "product_code": product_code,
+            "batch_number": f"BTX-{i:06d}",
+            "manufacturer": f"Manufacturer {rng.randrange(20)}",
+            "manufacture_date": (expiry - timedelta(days=730)).date().isoformat(),
+            "expiry_date": expiry.date().isoformat(),
+            "delivery_date": None,
+            "source_distributor": f"Distributor {rng.randrange(10)}",
+        })
+    return batches
+
+
+def make_serials(n, batches, seed=2):
+    rng = random.Random(seed)
+    return [{
+        "product_code": batch["product_code"],
+        "serial_no": f"AMX{i:08d}",
+        "strength_form": "500mg capsule",
+        "units_per_pack": 21,
+        "packs_per_box": 10,
+        "pack_type": "blister",
+        "batch_number": batch["batch_number"],
+    } for i, batch in ((i, rng.choice(batches)) for i in range(n))]
+
+
+def make_logs(n_rows, n_serials=None, seed=42, start=LOG_START, days=LOG_DAYS, offsets=False):
+    """
+    pharmlogs rows shaped like PostgREST returns them (ISO timestamp strings).
+    With `offsets`, some timestamps carry a UTC offset, as /api/log clients may send.
+    """
+    rng = random.Random(seed)
+    n_serials = n_serials or max(n_rows // 20, 1)
+    return [{
+        "serial": f"AMX{rng.randrange(n_serials):08d}",
+        "status": rng.choice(STATUSES),
+        "timestamp": (start + timedelta(seconds=rng.randrange(days * 24 * 3600),
+                                        microseconds=rng.randrange(1000) * 1000)).isoformat(timespec="milliseconds")
+                     + (rng.choice(UTC_OFFSETS) if offsets else ""),
+        "user_id": f"pharmacist{rng.randrange(50)}@example.com",
+    } for _ in range(n_rows)]
+
+
+def make_reports(n, seed=3, start=LOG_START, days=LOG_DAYS):
+    rng = random.Random(seed)
+    return [{
+        "product_name": "Amoxicillin 500mg",
+        "batch_serial": f"AMX{rng.randrange(10**8):08d}",
+        "location": f"Pharmacy {rng.randrange(200)}, Nairobi",
+        "description": "Packaging differs from the usual supplier; blister foil misprinted.",
+        "name": f"Reporter {rng.randrange(500)}",
+        "email": f"reporter{rng.randrange(500)}@example.com",
+        "created_at": (start + timedelta(seconds=rng.randrange(days * 24 * 3600))).isoformat(timespec="milliseconds"),
+    } for _ in range(n)]
+
+
+def date_ranges(count, seed=4, start=LOG_START, days=LOG_DAYS, min_days=7, max_days=30):
+    """(start_date, end_date) strings inside the generated log period."""
+    rng = random.Random(seed)
+    ranges = []
+    for _ in range(count):
+        length = rng.randint(min_days, max_days)
+        first = start + timedelta(days=rng.randrange(days - length))
+        ranges.append((first.date().isoformat(), (first + timedelta(days=length)).date().isoformat()))
+    return ranges
+
+
+def _insert_many(conn, table, rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    conn.executemany(
+        f'insert into "{table}" ({", ".join(columns)}) values ({", ".join("?" * len(columns))})',
+        [tuple(row[c] for c in columns) for row in rows])
+
+
+def seed_store(store, batches=(), serials=(), logs=(), reports=(), profiles=()):
+    """Bulk-loads rows into a storage.SQLiteStore in one transaction."""
+    conn = store.connection()
+    with store.write_lock:
+        conn.execute("begin")
+        _insert_many(conn, "product_batches", list(batches))
+        _insert_many(conn, "product_serials", list(serials))
+        # The pharmlogs_daily trigger fills the rollups as the logs go in
+        _insert_many(conn, "pharmlogs", list(logs))
+        _insert_many(conn, "report_page", list(reports))
+        _insert_many(conn, "profiles", list(profiles))
+        conn.execute("commit")
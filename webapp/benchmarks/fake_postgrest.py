@@ -0,0 +1,175 @@
+"""
+In-process PostgREST stand-in for benchmarks.
+
+Serves /rest/v1/<table> and /rest/v1/rpc/<function> over HTTP from a
+storage.SQLiteStore, so the app runs against it with its normal Supabase
+client (STORAGE_BACKEND=supabase, SUPABASE_URL=<server url>). The whole
+client path is exercised: the httpx keep-alive pool, PostgREST query strings,
+JSON encoding and data_access retries. Only the database is local.
+
+Each response is delayed by `latency_ms` plus up to `jitter_ms`, which stands
+for the network round trip and query time of a hosted Supabase project.
+
+Supported: select with filters (eq/neq/gt/gte/lt/lte/in/is/or), order, limit,
+offset, single-object responses, embeds known to storage.RELATIONSHIPS,
+insert, and upsert (Prefer: resolution=merge-duplicates). Supabase Auth is
+not served, so benchmark clients get their sessions directly instead of
+through /login.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from postgrest.exceptions import APIError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteStore, _split_top_level, _unquote  # noqa: E402
+
+REST_PREFIX = "/rest/v1/"
+
+# PostgREST error code -> HTTP status
+ERROR_STATUS = {
+    "PGRST116": 406,
+    "PGRST202": 404,
+    "23505": 409,
+    "23503": 409,
+    "23502": 400,
+    "42703": 400,
+}
+
+
+def _json_default(value):
+    return str(value)
+
+
+class FakePostgREST:
+
+    def __init__(self, store_path, latency_ms=0.0, jitter_ms=0.0, seed=0):
+        self.store = SQLiteStore(store_path)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.requests = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        server = self
+
+        class Handler(PostgRESTHandler):
+            backend = server
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-postgrest", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def delay(self):
+        with self._random_lock:
+            extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    # -------------------------------
+    # PostgREST -> SQLiteQuery
+    # -------------------------------
+    def build_query(self, method, resource, params, headers, body):
+        if resource.startswith("rpc/"):
+            query = self.store.rpc(resource[4:], body or {})
+        else:
+            query = self.store.table(resource)
+            if method == "POST":
+                if "resolution=merge-duplicates" in headers.get("prefer", ""):
+                    query.upsert(body, on_conflict=dict(params).get("on_conflict", ""))
+                else:
+                    query.insert(body)
+                return query
+        for key, value in params:
+            if key == "select":
+                query.select(value)
+            elif key == "order":
+                for part in value.split(","):
+                    column, *modifiers = part.split(".")
+                    nullsfirst = True if "nullsfirst" in modifiers else False if "nullslast" in modifiers else None
+                    query.order(column, desc="desc" in modifiers, nullsfirst=nullsfirst)
+            elif key == "limit":
+                query.limit(int(value))
+            elif key == "offset":
+                query.offset = int(value)
+            elif key in ("or", "and"):
+                query.where.append(query._logic(key, value[1:-1]))
+            elif key in ("on_conflict", "columns"):
+                continue
+            else:
+                op, _, operand = value.partition(".")
+                if op == "in":
+                    query.in_(key, [_unquote(v) for v in _split_top_level(operand[1:-1])])
+                elif op == "is" and operand == "null":
+                    query.where.append(f"{query._column(key)} is null")
+                elif op in ("eq", "neq", "gt", "gte", "lt", "lte"):
+                    getattr(query, op)(key, _unquote(operand))
+                else:
+                    raise APIError({"code": "PGRST100", "message": f"unsupported filter {key}={value}"})
+        if "vnd.pgrst.object" in headers.get("accept", ""):
+            query.single()
+        return query
+
+
+class PostgRESTHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like PostgREST behind the Supabase gateway
+    protocol_version = "HTTP/1.1"
+    backend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=_json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        backend = self.backend
+        backend.requests += 1
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        backend.delay()
+        if not url.path.startswith(REST_PREFIX):
+            return self._send(404, {"code": "PGRST404", "message": f"{url.path} is not served by the fake"})
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        try:
+            query = backend.build_query(method, url.path[len(REST_PREFIX):], parse_qsl(url.query, keep_blank_values=True),
+                                        headers, body)
+            response = query.execute()
+        except APIError as e:
+            return self._send(ERROR_STATUS.get(e.code, 400), {
+                "code": e.code, "message": e.message, "details": e.details, "hint": e.hint})
+        self._send(201 if method == "POST" and not url.path.startswith(REST_PREFIX + "rpc/") else 200, response.data)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
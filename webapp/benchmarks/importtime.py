@@ -0,0 +1,106 @@
+"""
+Cold-start profile: how long `import app` takes, from `python -X importtime`.
+
+    cd webapp
+    python benchmarks/importtime.py                          # top 15 modules, 3 runs
+    python benchmarks/importtime.py --budget-ms 500          # exit 1 if over budget
+    python benchmarks/importtime.py --output results/importtime.json
+
+Each run is a fresh interpreter importing the app module, which is what a
+container cold start or a gunicorn worker without preload pays before its
+first request. The best of `--runs` is reported with the modules that
+contributed most (cumulative microseconds, as importtime prints them).
+
+It also fails if a module the app defers to first use (app.DEFERRED_MODULES:
+ReportLab via pdf_reports, the supabase client libraries including postgrest
+and httpx, NumPy) was imported at startup, since that is how cold starts
+regress. The app is imported
+against a throwaway SQLite database unless STORAGE_BACKEND is set.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+WEBAPP_DIR = os.path.dirname(BENCH_DIR)
+
+# Checked in the child after the import (pdf_reports stands for ReportLab)
+PROBE = "import sys, app; print(' '.join(m for m in app.DEFERRED_MODULES if m in sys.modules))"
+
+
+def profile_once(env):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=WEBAPP_DIR, env=env,
+                          capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        sys.exit(f"Importing the app failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|").split("|"))
+            modules[name] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue  # header line
+    return modules, proc.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, help="fail if importing the app takes longer")
+    parser.add_argument("--output", help="write the result as JSON (compare.py can diff two of them)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pharmacheck-importtime-")
+    env = dict(os.environ)
+    env.setdefault("STORAGE_BACKEND", "sqlite")
+    env.setdefault("SQLITE_PATH", os.path.join(workdir, "importtime.db"))
+    env.setdefault("LOG_SPILL_PATH", os.path.join(workdir, "pharmlogs_spill.jsonl"))
+    env.setdefault("PDF_JOB_DIR", os.path.join(workdir, "pdf_exports"))
+    try:
+        runs = [profile_once(env) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    modules, eager = min(runs, key=lambda run: run[0].get("app", (0, 0))[1])
+    total_ms = modules["app"][1] / 1000
+
+    print(f"import app: {total_ms:.1f} ms (best of {args.runs})")
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: -item[1][1])[1:args.top + 1]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if eager:
+        failures.append(f"imported at startup instead of on first use: {', '.join(eager)}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append(f"{total_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "importtime",
+                "meta": {
+                    "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "params": {k: v for k, v in vars(args).items() if k != "output"},
+                },
+                "results": {"import_app": {"total_ms": round(total_ms, 1), "eager_deferred_modules": eager}},
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+End-to-end load test: the real app, its Supabase client and a fake PostgREST.
+
+    cd webapp
+    python benchmarks/load_test.py                          # defaults below
+    python benchmarks/load_test.py --concurrency 32 --latency-ms 40 --jitter-ms 20
+    python benchmarks/load_test.py --scenarios verify log --output results/verify.json
+
+A temporary SQLite database is seeded with synthetic batches, serials,
+pharmlogs and report_page rows (datagen.py) and served by
+fake_postgrest.FakePostgREST, which adds `--latency-ms` (+ up to
+`--jitter-ms`) to every call to stand in for the round trip to Supabase. The
+app is imported with SUPABASE_URL pointing at the fake, served by werkzeug's
+threaded server, and driven over HTTP by `--concurrency` client threads per
+scenario:
+
+    verify   POST /api/verify            (Pharmacist)
+    log      POST /api/log               (Pharmacist)
+    report   GET  /api/report            (Admin, query report JSON)
+    report2  GET  /api/report2           (Admin, report_page rows)
+    pdf      POST /api/generate_pdf      (Admin, "wait": true: rendered in the request)
+    pdf2     POST /api/generate_pdf_2    (Admin, "wait": true)
+
+Report scenarios cycle through `--ranges` date ranges, so once every range
+has been seen they measure the report cache; pass --no-report-cache to
+measure the computation on every request.
+
+Per scenario it prints and saves p50/p95/p99 latency, throughput and error
+count. Compare two result files with compare.py.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import datagen  # noqa: E402
+from fake_postgrest import FakePostgREST  # noqa: E402
+
+ADMIN = "admin@example.com"
+PHARMACIST = "pharmacist@example.com"
+
+SCENARIOS = ["verify", "log", "report", "report2", "pdf", "pdf2"]
+
+# PDF scenarios are much slower per request; they run this share of --requests
+PDF_REQUEST_SHARE = 0.1
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class LoadTest:
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="pharmacheck-bench-")
+        self.fake = None
+        self.server = None
+        self.app_module = None
+        self.base_url = None
+        self.cookies = {}
+        self.serials = []
+        self.batches = []
+        self.ranges = datagen.date_ranges(args.ranges)
+
+    # -------------------------------
+    # Setup
+    # -------------------------------
+    def seed(self):
+        args = self.args
+        store_path = os.path.join(self.workdir, "fake_supabase.db")
+        self.fake = FakePostgREST(store_path, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+        self.batches = datagen.make_batches(args.batches)
+        serials = datagen.make_serials(args.serials, self.batches)
+        self.serials = [serial["serial_no"] for serial in serials]
+        started = time.perf_counter()
+        datagen.seed_store(
+            self.fake.store,
+            batches=self.batches,
+            serials=serials,
+            logs=datagen.make_logs(args.logs, n_serials=args.serials),
+            reports=datagen.make_reports(args.reports),
+            profiles=[{"email": ADMIN, "role": "Admin"}, {"email": PHARMACIST, "role": "Pharmacist"}],
+        )
+        print(f"Seeded {args.batches} batches, {args.serials} serials, {args.logs} logs, "
+              f"{args.reports} reports in {time.perf_counter() - started:.1f}s")
+        return self.fake.start()
+
+    def start_app(self, supabase_url):
+        os.environ.update({
+            "STORAGE_BACKEND": "supabase",
+            "SUPABASE_URL": supabase_url,
+            # supabase-py only checks the key's shape; the fake ignores it
+            "SUPABASE_KEY": "benchmark." + "x" * 40,
+            "SESSION_STORE": "cookie",
+            "LOG_SPILL_PATH": os.path.join(self.workdir, "pharmlogs_spill.jsonl"),
+            "PDF_JOB_DIR": os.path.join(self.workdir, "pdf_exports"),
+        })
+        os.environ.pop("REPLICA_PATH", None)
+        import app as app_module
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        if self.args.no_report_cache:
+            app_module.report_results.max_entries = 0
+        self.app_module = app_module
+        self.server = make_server("127.0.0.1", 0, app_module.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=self.server.serve_forever, name="bench-app", daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+        # Supabase Auth is not faked: sign the session cookies the login route would have set
+        flask_app = app_module.app
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        cookie_name = flask_app.config["SESSION_COOKIE_NAME"]
+        for user, role in ((ADMIN, "Admin"), (PHARMACIST, "Pharmacist")):
+            self.cookies[role] = {cookie_name: serializer.dumps({"user": user, "role": role})}
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+        if self.app_module is not None:
+            self.app_module.log_queue.flush()
+        if self.fake is not None:
+            self.fake.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    # -------------------------------
+    # Scenarios: (role, i) -> request kwargs
+    # -------------------------------
+    def request_for(self, scenario, i):
+        start_date, end_date = self.ranges[i % len(self.ranges)]
+        if scenario == "verify":
+            # Mostly known serials, some batch numbers and some unknown codes
+            if i % 10 == 8:
+                code = self.batches[i % len(self.batches)]["batch_number"]
+            elif i % 10 == 9:
+                code = f"FAKE{i:08d}"
+            else:
+                code = self.serials[(i * 7919) % len(self.serials)]
+            return "Pharmacist", "POST", "/api/verify", {"json": {"serial": code}}
+        if scenario == "log":
+            return "Pharmacist", "POST", "/api/log", {"json": {
+                "userId": PHARMACIST, "serial": self.serials[i % len(self.serials)], "status": "AUTHENTIC",
+                "timestamp": datetime.now(timezone.utc).isoformat()}}
+        if scenario == "report":
+            return "Admin", "GET", "/api/report", {"params": {"start_date": start_date, "end_date": end_date}}
+        if scenario == "report2":
+            return "Admin", "GET", "/api/report2", {"params": {"start_date": start_date, "end_date": end_date}}
+        if scenario == "pdf":
+            return "Admin", "POST", "/api/generate_pdf", {"json": {"startDate": start_date, "endDate": end_date, "wait": True}}
+        if scenario == "pdf2":
+            return "Admin", "POST", "/api/generate_pdf_2", {"json": {"startDate": start_date, "endDate": end_date, "wait": True}}
+        raise ValueError(f"Unknown scenario {scenario!r}")
+
+    def run_scenario(self, scenario):
+        args = self.args
+        requests = args.requests if not scenario.startswith("pdf") else max(int(args.requests * PDF_REQUEST_SHARE), 1)
+        clients = {role: httpx.Client(base_url=self.base_url, cookies=cookies, timeout=120)
+                   for role, cookies in self.cookies.items()}
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def one(i):
+            role, method, path, kwargs = self.request_for(scenario, i)
+            started = time.perf_counter()
+            try:
+                response = clients[role].request(method, path, **kwargs)
+                response.read()
+                ok = response.status_code < 400
+                error = None if ok else f"{response.status_code} {response.text[:200]}"
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors.append(error)
+
+        # Warm-up requests are not measured (first connections, catalog and index loads)
+        for i in range(min(args.warmup, requests)):
+            role, method, path, kwargs = self.request_for(scenario, i)
+            clients[role].request(method, path, **kwargs).read()
+        latencies.clear()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - started
+        for client in clients.values():
+            client.close()
+
+        latencies.sort()
+        result = {
+            "requests": requests,
+            "concurrency": args.concurrency,
+            "errors": len(errors),
+            "throughput_rps": round(requests / wall, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+        if errors:
+            result["first_error"] = errors[0]
+        return result
+
+    def run(self):
+        self.start_app(self.seed())
+        results = {}
+        try:
+            for scenario in self.args.scenarios:
+                before = self.fake.requests
+                results[scenario] = self.run_scenario(scenario)
+                results[scenario]["backend_calls"] = self.fake.requests - before
+                print(scenario, results[scenario])
+        finally:
+            self.stop()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario (PDFs run a tenth)")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--batches", type=int, default=2000)
+    parser.add_argument("--serials", type=int, default=50_000)
+    parser.add_argument("--logs", type=int, default=200_000)
+    parser.add_argument("--reports", type=int, default=5000)
+    parser.add_argument("--ranges", type=int, default=10, help="distinct report date ranges to cycle through")
+    parser.add_argument("--no-report-cache", action="store_true")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = LoadTest(args).run()
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "load_test",
+                "meta": {
+                    "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "git_revision": git_revision(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "params": {k: v for k, v in vars(args).items() if k != "output"},
+                },
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Micro-benchmarks for the CPU-bound report and verification helpers.
+
+    cd webapp
+    python benchmarks/micro.py                              # defaults below
+    python benchmarks/micro.py --rows 100000 --repeat 5 --output results/micro.json
+
+Each case is timed best-of-`--repeat` on synthetic data from datagen.py:
+
+    parse_log_timestamp       one ISO timestamp string per pharmlogs row
+    aggregate_log_data        the Python engine, timestamps parsed per row
+    aggregate_log_data_columnar  the NumPy engine (skipped without numpy)
+    checkForExpiry            one expiry date string per batch
+    render_query_log_pdf      the /api/generate_pdf report for the aggregated logs
+    render_report_page_pdf    the /api/generate_pdf_2 export of report_page rows
+
+No server or database is involved; the app is imported against a throwaway
+SQLite backend only so its module-level setup has somewhere to point.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+_workdir = tempfile.mkdtemp(prefix="pharmacheck-micro-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(_workdir, "micro.db"))
+os.environ.setdefault("LOG_SPILL_PATH", os.path.join(_workdir, "pharmlogs_spill.jsonl"))
+os.environ.setdefault("PDF_JOB_DIR", os.path.join(_workdir, "pdf_exports"))
+os.environ.setdefault("CODE_FILTER", "0")
+
+import datagen  # noqa: E402
+from load_test import git_revision  # noqa: E402
+from app import aggregate_log_data, checkForExpiry, format_report_row, parse_log_timestamp  # noqa: E402
+import log_aggregation  # noqa: E402
+import pdf_reports  # noqa: E402
+
+
+def best_of(repeat, prepare, fn):
+    """Best wall time of `fn(prepare())` over `repeat` runs; prepare() is not timed."""
+    best = float("inf")
+    for _ in range(repeat):
+        data = prepare()
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _parse_all(timestamps):
+    for value in timestamps:
+        parse_log_timestamp(value)
+
+
+def _python_engine(rows):
+    for log in rows:
+        log["timestamp"] = parse_log_timestamp(log["timestamp"])
+    return aggregate_log_data(rows)
+
+
+def _expiry_all(dates):
+    for value in dates:
+        checkForExpiry(value)
+
+
+def _read_pdf(pdf_file):
+    size = pdf_file.seek(0, os.SEEK_END)
+    pdf_file.close()
+    return size
+
+
+def run(args):
+    logs = datagen.make_logs(args.rows)
+    batches = datagen.make_batches(args.batches)
+    reports = datagen.make_reports(args.reports)
+    report_data, summary = aggregate_log_data(
+        [{**log, "timestamp": parse_log_timestamp(log["timestamp"])} for log in logs])
+    start_date, end_date = datagen.LOG_START.date().isoformat(), "2025-03-31"
+
+    cases = {
+        "parse_log_timestamp": (len(logs), lambda: [log["timestamp"] for log in logs], _parse_all),
+        "aggregate_log_data": (len(logs), lambda: [dict(log) for log in logs], _python_engine),
+        "checkForExpiry": (len(batches), lambda: [batch["expiry_date"] for batch in batches], _expiry_all),
+        "render_query_log_pdf": (len(report_data), lambda: report_data, lambda rows: _read_pdf(
+            pdf_reports.render_query_log_pdf(rows, start_date, end_date, summary))),
+        "render_report_page_pdf": (len(reports), lambda: [dict(row) for row in reports], lambda rows: _read_pdf(
+            pdf_reports.render_report_page_pdf((format_report_row(row) for row in rows), start_date, end_date))),
+    }
+    if log_aggregation.AVAILABLE:
+        cases["aggregate_log_data_columnar"] = (
+            len(logs), lambda: [dict(log) for log in logs], log_aggregation.aggregate_log_data_columnar)
+
+    results = {}
+    for name in args.cases or cases:
+        if name not in cases:
+            print(f"{name}: skipped (numpy is not installed)")
+            continue
+        items, prepare, fn = cases[name]
+        seconds = best_of(args.repeat, prepare, fn)
+        results[name] = {
+            "items": items,
+            "best_s": round(seconds, 5),
+            "per_item_us": round(seconds / items * 1e6, 3) if items else None,
+        }
+        print(name, results[name])
+    return results
+
+
+CASES = ["parse_log_timestamp", "aggregate_log_data", "aggregate_log_data_columnar", "checkForExpiry",
+         "render_query_log_pdf", "render_report_page_pdf"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="+", choices=CASES)
+    parser.add_argument("--rows", type=int, default=100_000, help="pharmlogs rows")
+    parser.add_argument("--batches", type=int, default=100_000, help="expiry dates for checkForExpiry")
+    parser.add_argument("--reports", type=int, default=5000, help="report_page rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "micro",
+                "meta": {
+                    "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "git_revision": git_revision(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "params": {k: v for k, v in vars(args).items() if k != "output"},
+                },
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
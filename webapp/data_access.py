@@ -0,0 +1,182 @@
+"""
+Data-access layer around the Supabase client.
+
+`create_client(url, key)` used to give every worker the library defaults: a
+120 s PostgREST timeout, no retry, and whatever connection reuse httpx picked.
+Here the client runs on one explicitly sized keep-alive pool with short
+connect/pool timeouts, and `execute()` runs a query builder with a bounded
+number of retries (full-jitter exponential backoff) on transient failures:
+
+- reads are retried on any transport error and on gateway / PostgREST
+  connection errors;
+- writes (`idempotent=False`) are only retried when the request never left
+  this process (connect failure, pool exhausted), so a row is never inserted twice.
+
+`run_concurrently()` runs independent queries side by side on a shared thread
+pool for the sync Flask handlers. `create_pooled_async_client()` / `aexecute()`
+/ `agather()` are the same layer for asyncio callers (supabase AsyncClient).
+
+Every call is timed into metrics.STORAGE_SECONDS by table and operation.
+
+All limits can be tuned with SUPABASE_* environment variables.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from errors import is_api_error
+
+# Connection pool (per worker process)
+MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+HTTP2 = os.getenv("SUPABASE_HTTP2", "0") == "1"
+
+# Seconds. READ_TIMEOUT bounds a single PostgREST call; POOL_TIMEOUT is how long a
+# request waits for a free connection before failing instead of queueing forever.
+CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "15"))
+POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "5"))
+
+# Retries after the first attempt, and the backoff window they are drawn from
+MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", "2"))
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 1.0
+
+# Gateway errors (non-JSON bodies carry the HTTP status) and PostgREST "could not
+# connect to the database" errors
+TRANSIENT_API_CODES = {"502", "503", "504", "PGRST000", "PGRST001", "PGRST002"}
+
+# Shared by run_concurrently(); sized to the connection pool
+_query_pool = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS, thread_name_prefix="supabase-query")
+
+
+def pool_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def call_timeout():
+    import httpx
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT)
+
+
+def create_pooled_client(url, key):
+    """Sync Supabase client on a tuned keep-alive pool."""
+    # supabase (auth, storage, realtime, functions) is imported when the first client is made
+    import httpx
+    from supabase import create_client, ClientOptions
+
+    http_client = httpx.Client(limits=pool_limits(), timeout=call_timeout(), http2=HTTP2)
+    options = ClientOptions(postgrest_client_timeout=call_timeout(), httpx_client=http_client)
+    return create_client(url, key, options=options)
+
+
+async def create_pooled_async_client(url, key):
+    """Async Supabase client on a tuned keep-alive pool (one per event loop)."""
+    import httpx
+    from supabase import create_async_client, AsyncClientOptions
+
+    http_client = httpx.AsyncClient(limits=pool_limits(), timeout=call_timeout(), http2=HTTP2)
+    options = AsyncClientOptions(postgrest_client_timeout=call_timeout(), httpx_client=http_client)
+    return await create_async_client(url, key, options=options)
+
+
+def is_retryable(error, idempotent=True):
+    # httpx is imported with the first Supabase client; before that no httpx error can occur
+    httpx = sys.modules.get("httpx")
+    if httpx is not None:
+        # Never sent: safe to retry anything
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        # May have reached the server: only retried for reads
+        if idempotent and isinstance(error, httpx.TransportError):
+            return True
+    return idempotent and is_api_error(error, *TRANSIENT_API_CODES)
+
+
+def backoff_delay(attempt):
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def describe_query(query):
+    """(table, operation) labels for a postgrest request builder or a storage.SQLiteQuery."""
+    request = getattr(query, "request", None)
+    if request is None:
+        return getattr(query, "table", "unknown"), getattr(query, "operation", "unknown")
+    parts = request.path.path.rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2] == "rpc":
+        return parts[-1], "rpc"
+    method = str(getattr(request.http_method, "value", request.http_method)).upper()
+    if method == "POST":
+        operation = "upsert" if "resolution=" in request.headers.get("prefer", "") else "insert"
+    else:
+        operation = {"GET": "select", "HEAD": "select", "PATCH": "update", "DELETE": "delete"}.get(method, method.lower())
+    return parts[-1], operation
+
+
+def execute(query, idempotent=True, retries=MAX_RETRIES):
+    """Runs a postgrest request builder, retrying transient failures."""
+    attempt = 0
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        while True:
+            try:
+                response = query.execute()
+                outcome = "ok"
+                return response
+            except Exception as e:
+                if attempt >= retries or not is_retryable(e, idempotent):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+    finally:
+        metrics.observe_storage_call(*describe_query(query), outcome, time.perf_counter() - started)
+
+
+def run_concurrently(*calls):
+    """
+    Runs zero-argument callables (e.g. `lambda: execute(q)`) side by side and
+    returns their results in order. The first exception is re-raised.
+    """
+    if len(calls) == 1:
+        return [calls[0]()]
+    # Each call runs in a copy of the caller's context so its timings land in the request's trace
+    futures = [_query_pool.submit(contextvars.copy_context().run, call) for call in calls]
+    return [future.result() for future in futures]
+
+
+async def aexecute(query, idempotent=True, retries=MAX_RETRIES):
+    """Async counterpart of execute() for AsyncClient request builders."""
+    attempt = 0
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        while True:
+            try:
+                response = await query.execute()
+                outcome = "ok"
+                return response
+            except Exception as e:
+                if attempt >= retries or not is_retryable(e, idempotent):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+    finally:
+        metrics.observe_storage_call(*describe_query(query), outcome, time.perf_counter() - started)
+
+
+async def agather(*queries):
+    """Executes independent read queries concurrently; results in order."""
+    return await asyncio.gather(*(aexecute(query) for query in queries))
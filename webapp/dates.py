@@ -0,0 +1,127 @@
+"""
+Date handling on the hot paths: batch expiry checks and pharmlogs timestamps.
+
+Expiry
+    /api/verify used to strptime() the batch's expiry date on every scan.
+    Expiry dates are now parsed once into date ordinals (`expiry_ordinal`,
+    memoized: a registry has far fewer distinct expiry dates than scans) and
+    compared with today's ordinal, which `ExpiryClock` recomputes only when
+    the local date changes. A batch therefore turns EXPIRED at the first scan
+    after midnight, exactly as before, without any per-request parsing.
+
+Timestamps
+    `parse_iso_timestamp` is the one parser for timestamps coming back from
+    Supabase ('2025-01-01T10:00:00.12+00:00') or the SQLite backend
+    ('2025-01-01T10:00:00.123'). On Python 3.11+ it is datetime.fromisoformat
+    itself, which accepts every shape PostgREST emits ('Z', a space separator,
+    1-6 fraction digits) in a single C call, no wrapper and no exceptions.
+    Older interpreters reject several of those shapes, so there it is a
+    regex parser that memoizes the date prefix and the UTC-offset suffix,
+    which recur across nearly every row of a report. See
+    benchmarks/bench_dates.py for timings on a million rows.
+
+    The reports read timestamps through `parse_wall_clock`, which drops any
+    UTC offset instead of applying it: pharmlogs."timestamp" has no time
+    zone, so an offset sent to /api/log is discarded on insert, and both
+    report engines bucket rows by the wall-clock time as written.
+"""
+import re
+import sys
+import time as _time
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+
+# Memoized date prefixes / offsets kept by the pre-3.11 parser
+MAX_MEMO_ENTRIES = 100_000
+
+
+# -------------------------------
+# Expiry
+# -------------------------------
+class ExpiryClock:
+    """Today's local date ordinal, recomputed only when the date changes."""
+
+    def __init__(self):
+        self._today = 0
+        self._next_midnight = 0.0
+
+    def today_ordinal(self):
+        if _time.time() >= self._next_midnight:
+            today = date.today()
+            # Ordinal first: a reader that sees the new midnight also sees the new date
+            self._today = today.toordinal()
+            self._next_midnight = datetime.combine(today + timedelta(days=1), time.min).timestamp()
+        return self._today
+
+
+EXPIRY_CLOCK = ExpiryClock()
+
+
+@lru_cache(maxsize=65_536)
+def _date_string_ordinal(value):
+    return date.fromisoformat(value[:10]).toordinal()
+
+
+def expiry_ordinal(value):
+    """Ordinal of an expiry date: a date, 'YYYY-MM-DD', or a timestamp string (its date part)."""
+    if isinstance(value, date):
+        return value.toordinal()
+    return _date_string_ordinal(value)
+
+
+def is_expired(expiry_date, clock=EXPIRY_CLOCK):
+    """True once the expiry date is in the past; a batch with no expiry date is not expired."""
+    if not expiry_date:
+        return False
+    return expiry_ordinal(expiry_date) < clock.today_ordinal()
+
+
+# -------------------------------
+# Timestamps
+# -------------------------------
+_ISO_TIMESTAMP = re.compile(
+    r"(\d{4}-\d\d-\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d+))?)?)?(Z|[+-]\d\d(?::?\d\d)?)?$")
+
+# 'YYYY-MM-DD' -> (year, month, day); offset text -> tzinfo
+_days = {}
+_zones = {"Z": timezone.utc}
+
+
+def _zone(text):
+    tz = _zones.get(text)
+    if tz is None:
+        digits = text[1:].replace(":", "")
+        offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:4] or 0))
+        tz = timezone.utc if not offset else timezone(-offset if text[0] == "-" else offset)
+        if len(_zones) < MAX_MEMO_ENTRIES:
+            _zones[text] = tz
+    return tz
+
+
+def _parse_iso_timestamp_compat(value):
+    """parse_iso_timestamp for Python < 3.11, whose fromisoformat only takes 0, 3 or 6 fraction digits and no 'Z'."""
+    match = _ISO_TIMESTAMP.match(value)
+    if match is None:
+        raise ValueError(f"Invalid isoformat string: {value!r}")
+    day, hour, minute, second, fraction, zone = match.groups()
+    ymd = _days.get(day)
+    if ymd is None:
+        parsed = date.fromisoformat(day)
+        ymd = (parsed.year, parsed.month, parsed.day)
+        if len(_days) < MAX_MEMO_ENTRIES:
+            _days[day] = ymd
+    return datetime(*ymd, int(hour or 0), int(minute or 0), int(second or 0),
+                    int(fraction[:6].ljust(6, "0")) if fraction else 0,
+                    _zone(zone) if zone else None)
+
+
+if sys.version_info >= (3, 11):
+    parse_iso_timestamp = datetime.fromisoformat
+else:
+    parse_iso_timestamp = _parse_iso_timestamp_compat
+
+
+def parse_wall_clock(value):
+    """parse_iso_timestamp with any UTC offset dropped (not applied): a naive wall-clock datetime."""
+    parsed = parse_iso_timestamp(value)
+    return parsed if parsed.tzinfo is None else parsed.replace(tzinfo=None)
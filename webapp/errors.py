@@ -0,0 +1,24 @@
+"""
+postgrest's APIError without importing postgrest at startup.
+
+`from postgrest.exceptions import APIError` pulls in postgrest, httpx and
+pydantic, which is most of what `import app` would otherwise cost (see
+benchmarks/importtime.py). An APIError can only exist once postgrest has
+been imported (by the supabase client, or by `api_error()` below), so
+checking `sys.modules` is exact: nothing is imported to answer "no".
+"""
+import sys
+
+
+def is_api_error(error, *codes):
+    """True if `error` is a postgrest APIError (and, if codes are given, has one of them)."""
+    module = sys.modules.get("postgrest.exceptions")
+    if module is None or not isinstance(error, module.APIError):
+        return False
+    return not codes or str(error.code) in codes
+
+
+def api_error(details):
+    """A postgrest APIError built from its JSON body, for the local backends that mimic PostgREST."""
+    from postgrest.exceptions import APIError
+    return APIError(details)
@@ -0,0 +1,96 @@
+"""
+gunicorn settings for serving Pharmacheck in production.
+
+    cd webapp
+    gunicorn -c gunicorn.conf.py app:app        # or: python serve.py
+
+Sizing: one worker process per CPU core available to the container, each
+running GUNICORN_THREADS threads (gthread workers). Requests spend most of
+their time waiting on Supabase, so threads keep a worker busy while it
+waits, and processes let the CPU-bound parts (report aggregation, PDF
+rendering) run on every core. Override with WEB_CONCURRENCY / GUNICORN_THREADS.
+Keep SUPABASE_MAX_CONNECTIONS at or above the thread count.
+
+Preload (default on): app.py is imported once in the master, which also
+imports the libraries the app defers (ReportLab, supabase, postgrest, httpx,
+NumPy) and compiles every template before forking, so workers share them
+copy-on-write and boot in milliseconds. Nothing creates a client or touches the network
+before the fork (PHARMACHECK_PRELOADED, storage.LazyClient).
+
+Warm-up: each worker then runs app.warm_up() on a background thread; it
+starts its replica thread (one worker per host syncs the shared file, see
+replica.py) and known-code filter, loads the product catalog and bulk-loads
+the verification index (WARM_VERIFY_INDEX=0 to skip). The worker takes
+requests meanwhile; those simply read through to Supabase.
+
+Reloading:
+    kill -HUP <master pid>     restart workers gracefully (config and env
+                               changes; new code only with GUNICORN_PRELOAD=0)
+    kill -USR2 <master pid>    start a new master on new code, then
+    kill -QUIT <old master>    retire the old one: zero-downtime deploy
+In-flight requests get `graceful_timeout` seconds to finish, and queued
+pharmlogs are flushed as each worker exits. PDF exports still rendering in
+an exiting worker are reported failed to the clients polling them.
+"""
+import os
+import threading
+
+os.environ.setdefault("GUNICORN_PRELOAD", "1")
+preload_app = os.environ["GUNICORN_PRELOAD"] == "1"
+if preload_app:
+    os.environ["PHARMACHECK_PRELOADED"] = "1"
+
+
+def available_cores():
+    try:
+        # Honours CPU pinning / container cpusets, unlike os.cpu_count()
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", str(available_cores())))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# PDF exports of long ranges can take several seconds
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# Recycle workers after this many requests (0 = never), staggered by the jitter
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max(max_requests // 10, 0)
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+proc_name = "pharmacheck"
+
+WARM_UP = os.getenv("WARM_UP", "1") == "1"
+WARM_VERIFY_INDEX = os.getenv("WARM_VERIFY_INDEX", "1") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        from app import precompile_templates, preload_libraries
+        server.log.info("Preloaded %s; precompiled %d templates",
+                        ", ".join(preload_libraries()), precompile_templates())
+
+
+def post_worker_init(worker):
+    if not WARM_UP:
+        return
+    from app import warm_up
+
+    def run():
+        worker.log.info("Worker %s warmed up: %s", worker.pid, warm_up(verification=WARM_VERIFY_INDEX))
+
+    # Off the main thread, so a slow Supabase cannot hold the worker past `timeout`
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+
+def worker_exit(server, worker):
+    from app import log_queue, pdf_jobs
+    log_queue.flush()
+    pdf_jobs.shutdown()
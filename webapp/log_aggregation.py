@@ -0,0 +1,188 @@
+"""
+Columnar aggregation engine for pharmlogs reports.
+
+`aggregate_log_data_columnar` produces exactly what `aggregate_log_data` in
+app.py produces, but loads serial/status/timestamp into NumPy arrays and does
+the group-by with `np.unique` + `np.bincount` instead of a per-row dict update.
+It can also break the counts down per day and per user.
+
+NumPy is listed in requirements.txt but stays optional: without it
+`AVAILABLE` is False, /api/report's default engines fall back to the
+pure-Python aggregation, and only an explicit engine=columnar or breakdown
+request is refused. Both engines bucket rows by the wall-clock time as
+written, dropping any UTC offset (dates.parse_wall_clock).
+benchmarks/bench_aggregation.py times them and checks they agree, with and
+without offsets.
+"""
+import importlib.util
+from datetime import datetime, timedelta
+from itertools import islice
+
+from dates import parse_wall_clock
+
+# Optional dependency, imported by the first columnar report rather than at startup
+AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+# Column order of the status counts; anything else lands in "other"
+STATUS_COLUMNS = ("authentic_count", "counterfeit_count", "expired_count", "other_count")
+STATUS_CODES = {"AUTHENTIC": 0, "COUNTERFEIT": 1, "EXPIRED": 2}
+OTHER = 3
+
+BREAKDOWNS = ("day", "user")
+
+# Rows converted to arrays at a time, so a streamed input is never held as dicts
+CHUNK_ROWS = 65_536
+
+EPOCH = datetime(1970, 1, 1)
+ONE_US = timedelta(microseconds=1)
+US_PER_DAY = 86_400_000_000
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def _codes(index, values):
+    """Dictionary-encodes `values` into int codes, numbering new values in order of first appearance."""
+    return np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int64, count=len(values))
+
+
+def _has_offsets(values):
+    # A timestamp without an offset has exactly two dashes (in its date) and no '+' or 'Z'
+    text = "".join(values)
+    return "+" in text or "Z" in text or text.count("-") != 2 * len(values)
+
+
+def _timestamps(values):
+    """
+    Converts timestamps (datetime objects or ISO strings from PostgREST) to int64
+    microseconds of their wall-clock time; a UTC offset is dropped, as the Python
+    engine does, rather than converted to UTC as NumPy would.
+    """
+    if isinstance(values[0], str):
+        try:
+            if not _has_offsets(values):
+                # NumPy parses plain ISO strings far faster than datetime.fromisoformat
+                return np.array(values, dtype="datetime64[us]").astype(np.int64)
+        except ValueError:
+            pass
+        values = [parse_wall_clock(v) for v in values]
+    return np.fromiter(((t.replace(tzinfo=None) - EPOCH) // ONE_US for t in values), dtype=np.int64,
+                       count=len(values))
+
+
+def _load_columns(raw_logs, want_users):
+    serial_index, status_index, user_index = {}, {}, {}
+    serial_parts, status_parts, ts_parts, user_parts = [], [], [], []
+    rows = iter(raw_logs)
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        serial_parts.append(_codes(serial_index, [log['serial'] for log in chunk]))
+        status_parts.append(_codes(status_index, [log['status'] for log in chunk]))
+        ts_parts.append(_timestamps([log['timestamp'] for log in chunk]))
+        if want_users:
+            user_parts.append(_codes(user_index, [log.get('user_id') or "" for log in chunk]))
+    if not serial_parts:
+        return None
+
+    # Upper-case each distinct status once rather than once per row
+    status_lookup = np.array([STATUS_CODES.get(s.upper(), OTHER) for s in status_index], dtype=np.int64)
+    columns = {
+        "serials": list(serial_index),
+        "serial_codes": np.concatenate(serial_parts),
+        "status_codes": status_lookup[np.concatenate(status_parts)],
+        "timestamps": np.concatenate(ts_parts),
+    }
+    if want_users:
+        columns["users"] = list(user_index)
+        columns["user_codes"] = np.concatenate(user_parts)
+    return columns
+
+
+def _count_by(group_codes, n_groups, status_codes):
+    """counts[group, status] via one bincount over a combined key."""
+    return np.bincount(group_codes * 4 + status_codes, minlength=n_groups * 4).reshape(n_groups, 4)
+
+
+def _rows(key, labels, counts):
+    rows = []
+    for label, row in zip(labels, counts.tolist()):
+        item = {key: label, "total_queries": sum(row)}
+        item.update(zip(STATUS_COLUMNS, row))
+        rows.append(item)
+    return rows
+
+
+def aggregate_log_data_columnar(raw_logs, breakdowns=()):
+    """
+    Vectorised equivalent of aggregate_log_data.
+
+    Returns (report_data, summary) like aggregate_log_data; when `breakdowns`
+    contains "day" and/or "user", summary also gets "by_day" / "by_user" lists.
+    Per-user counts need `user_id` in the rows. Timestamps may be datetimes or
+    the unparsed ISO strings PostgREST returns (the fast path).
+    """
+    if not AVAILABLE:
+        raise ImportError("The columnar report engine requires numpy.")
+    _load_numpy()
+
+    want_users = "user" in breakdowns
+    columns = _load_columns(raw_logs, want_users)
+
+    summary = {"total_queries": 0, "authentic_count": 0, "counterfeit_count": 0, "expired_count": 0}
+    if columns is None:
+        if "day" in breakdowns:
+            summary["by_day"] = []
+        if want_users:
+            summary["by_user"] = []
+        return [], summary
+
+    serials = columns["serials"]
+    serial_codes = columns["serial_codes"]
+    status_codes = columns["status_codes"]
+    ts = columns["timestamps"]
+
+    counts = _count_by(serial_codes, len(serials), status_codes)
+
+    # Latest query per serial
+    last = np.full(len(serials), np.iinfo(np.int64).min)
+    np.maximum.at(last, serial_codes, ts)
+    last_strings = np.char.replace(np.datetime_as_string(last.astype("datetime64[us]"), unit="s"), "T", " ").tolist()
+
+    # Serial codes are numbered by first appearance, the same order as the dict-based engine
+    report_data = []
+    for serial, (authentic, counterfeit, expired, other), last_query in zip(serials, counts.tolist(), last_strings):
+        report_data.append({
+            'serial': serial,
+            'total_queries': authentic + counterfeit + expired + other,
+            'authentic_count': authentic,
+            'counterfeit_count': counterfeit,
+            'expired_count': expired,
+            'other_count': other,
+            'last_query_timestamp': last_query,
+        })
+
+    column_totals = counts.sum(axis=0).tolist()
+    summary = {
+        "total_queries": int(len(serial_codes)),
+        "authentic_count": column_totals[0],
+        "counterfeit_count": column_totals[1],
+        "expired_count": column_totals[2],
+    }
+
+    if "day" in breakdowns:
+        days, day_codes = np.unique(ts // US_PER_DAY, return_inverse=True)
+        day_labels = np.datetime_as_string(days.astype("datetime64[D]")).tolist()
+        summary["by_day"] = _rows("day", day_labels, _count_by(day_codes, len(days), status_codes))
+    if want_users:
+        users = columns["users"]
+        user_rows = _rows("user", users, _count_by(columns["user_codes"], len(users), status_codes))
+        summary["by_user"] = sorted(user_rows, key=lambda row: row["user"])
+
+    return report_data, summary
@@ -0,0 +1,311 @@
+"""
+Write-behind queue for pharmlogs.
+
+Verification requests hand their log record to `LogQueue.enqueue()` and return
+straight away; a background thread batch-inserts the queued records into
+Supabase every `flush_interval` seconds or as soon as `batch_size` records are
+waiting.
+
+Memory is bounded by `max_pending`. When the queue is full (Supabase is slow or
+down) or an insert fails, records are appended to a local JSONL spill file
+instead of being dropped, and the flusher replays that file once inserts
+succeed again. Several workers may share one spill file: each replays it
+through a replay file of its own, so a row is never replayed twice.
+
+Rows the database itself rejects (a data or constraint error, SQLSTATE class
+22/23) would fail again on every replay, so they are not spilled: the batch
+is halved until the rejected rows are isolated, the rest is inserted, and
+the rejected rows go to the dead-letter file `<spill_path>.corrupt`, as do
+spill lines that do not parse (e.g. cut short by a crash mid-append).
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from data_access import execute
+from dates import parse_iso_timestamp
+from errors import is_api_error
+
+# SQLSTATE classes of errors caused by the rows themselves (data exception, integrity
+# constraint): the same rows would be rejected again, so they are not retried
+REJECTED_ROW_CLASSES = ("22", "23")
+
+
+def written_days(records):
+    """
+    The days (dates) the rows' timestamps fall on, both as written and in UTC,
+    so a report bounded either way sees the change. Rows without a readable
+    timestamp get the database default, now.
+    """
+    days = set()
+    for record in records:
+        try:
+            written = parse_iso_timestamp(record["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            days.add(datetime.now(timezone.utc).date())
+            continue
+        days.add(written.date())
+        if written.tzinfo is not None:
+            days.add(written.astimezone(timezone.utc).date())
+    return days
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate it; and without gunicorn one process owns the spill file
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else (or the platform cannot tell)
+        return True
+    return True
+
+
+class LogQueue:
+
+    def __init__(self, client, table="pharmlogs", batch_size=500, flush_interval=2.0,
+                 max_pending=10_000, spill_path="pharmlogs_spill.jsonl", on_flush=None):
+        self.client = client
+        # Called with the set of days (written_days) of the rows after every successful insert
+        self.on_flush = on_flush
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.dead_letter_path = f"{spill_path}.corrupt"
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._spill_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # Records the flusher has taken off the queue but not inserted yet
+        self._held = []
+        self._held_lock = threading.Lock()
+        self.inserted = 0
+        self.spilled = 0
+        self.failed_flushes = 0
+        self.rejected = 0
+
+    # -------------------------------
+    # Producer side (request threads)
+    # -------------------------------
+    def enqueue(self, record):
+        """Queues one pharmlogs row. Never blocks on the database."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Backpressure: keep memory bounded and persist the record locally
+            self._spill([record])
+
+    def depth(self):
+        return self._queue.qsize()
+
+    # -------------------------------
+    # Background flusher
+    # -------------------------------
+    def _ensure_started(self):
+        # Started lazily and per process, so forked workers each get their own flusher
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="pharmlogs-flusher", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self, timeout):
+        """Waits up to `timeout` seconds for the first record, then drains up to batch_size."""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _hold(self, records):
+        with self._held_lock:
+            self._held.extend(records)
+            return len(self._held)
+
+    def _release_held(self):
+        with self._held_lock:
+            batch, self._held = self._held, []
+            return batch
+
+    def _run(self):
+        while True:
+            try:
+                self._flush_pass()
+            except Exception as e:
+                # Keep the one flusher this process has alive; rows stay queued or spilled
+                print(f"pharmlogs flusher error: {e}")
+                time.sleep(self.flush_interval)
+
+    def _flush_pass(self):
+        deadline = time.monotonic() + self.flush_interval
+        held = self._hold(self._take_batch(self.flush_interval))
+        # Fill the batch until it is full or the window closes. Records taken off the
+        # queue stay in self._held meanwhile, so flush() can still reach them.
+        while held and held < self.batch_size and time.monotonic() < deadline:
+            more = self._take_batch(max(deadline - time.monotonic(), 0))
+            if not more:
+                break
+            held = self._hold(more)
+        with self._flush_lock:
+            batch = self._release_held()
+            if batch:
+                self._insert(batch)
+            self._replay_spill()
+
+    def _insert(self, batch):
+        """Inserts a batch. Returns False (with the rows spilled) if the database could not take it."""
+        try:
+            # Not idempotent: only retried when the request was never sent
+            execute(self.client.table(self.table).insert(batch), idempotent=False)
+            self.inserted += len(batch)
+        except Exception as e:
+            if not (is_api_error(e) and str(e.code)[:2] in REJECTED_ROW_CLASSES):
+                print(f"pharmlogs batch insert failed, spilling {len(batch)} rows: {e}")
+                self.failed_flushes += 1
+                self._spill(batch)
+                return False
+            if len(batch) == 1:
+                print(f"pharmlogs row rejected, moved to {self.dead_letter_path}: {e}")
+                self.rejected += 1
+                self._dead_letter([json.dumps(batch[0]) + "\n"])
+                return True
+            # Halve to pin down the rejected rows, as RecordImport._upsert does
+            middle = len(batch) // 2
+            if not self._insert(batch[:middle]):
+                self._spill(batch[middle:])
+                return False
+            return self._insert(batch[middle:])
+        if self.on_flush:
+            self.on_flush(written_days(batch))
+        return True
+
+    def flush(self):
+        """Synchronously writes everything queued so far (used at shutdown)."""
+        with self._flush_lock:
+            held = self._release_held()
+            if held and not self._insert(held):
+                return
+            while True:
+                batch = self._take_batch(0)
+                if not batch:
+                    break
+                if not self._insert(batch):
+                    break
+
+    # -------------------------------
+    # Spill file
+    # -------------------------------
+    def _spill(self, records):
+        with self._spill_lock:
+            with open(self.spill_path, "ab+") as f:
+                # A crash mid-append leaves a line without its newline; start on a fresh one
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                for record in records:
+                    f.write((json.dumps(record) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            self.spilled += len(records)
+
+    def _replay_spill(self):
+        """Re-inserts spilled rows once the queue is idle. Rows that fail again are re-spilled."""
+        if not self._queue.empty() or not os.path.exists(self.spill_path):
+            return
+        # Workers of one server share the spill file; each replays through its own file
+        replay_path = f"{self.spill_path}.replay.{os.getpid()}"
+        with self._spill_lock:
+            for leftover in self._orphaned_replays():
+                # Left over from a crash mid-replay: merge it back first
+                with open(leftover, encoding="utf-8") as src, open(self.spill_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(leftover)
+            try:
+                os.replace(self.spill_path, replay_path)
+            except FileNotFoundError:
+                # Another worker took it first
+                return
+
+        batch = []
+        corrupt = []
+        healthy = True
+        with open(replay_path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if not isinstance(record, dict):
+                    corrupt.append(line if line.endswith("\n") else line + "\n")
+                    continue
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    healthy = self._replay_batch(batch, healthy)
+                    batch = []
+        if batch:
+            self._replay_batch(batch, healthy)
+        if corrupt:
+            print(f"Skipped {len(corrupt)} unreadable pharmlogs spill lines; kept in {self.dead_letter_path}")
+            self._dead_letter(corrupt)
+        os.remove(replay_path)
+
+    def _dead_letter(self, lines):
+        with self._spill_lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+    def _orphaned_replays(self):
+        """Replay files of processes that no longer run (and this process's own, from an earlier failure)."""
+        folder = os.path.dirname(os.path.abspath(self.spill_path))
+        prefix = os.path.basename(self.spill_path) + ".replay"
+        orphaned = []
+        for name in os.listdir(folder):
+            if not name.startswith(prefix):
+                continue
+            pid = name[len(prefix) + 1:]
+            if pid.isdigit() and int(pid) != os.getpid() and _process_alive(int(pid)):
+                continue
+            orphaned.append(os.path.join(folder, name))
+        return orphaned
+
+    def _replay_batch(self, batch, healthy):
+        # After the first failure the rest goes straight back to the spill file
+        if healthy:
+            return self._insert(batch)
+        self._spill(batch)
+        return False
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "inserted": self.inserted,
+            "spilled": self.spilled,
+            "failed_flushes": self.failed_flushes,
+            "rejected": self.rejected,
+        }
+
+    def install_exit_flush(self):
+        atexit.register(self.flush)
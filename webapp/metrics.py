@@ -0,0 +1,169 @@
+"""
+Request, storage-call and PDF timings, exposed Prometheus-style on /metrics.
+
+- REQUEST_SECONDS: every request, by endpoint and status code, timed from
+  before_request to after_request (to the first byte for streamed
+  responses). Rejected (401/403) and failed requests get their own series,
+  so they do not skew the latency of the successful ones.
+- STORAGE_SECONDS: every data_access.execute() call, by table, operation
+  (select/insert/upsert/update/delete/rpc) and outcome, retries included.
+- PDF_RENDER_SECONDS: ReportLab rendering, by report.
+- Gauges such as cache hit ratios and the log-queue depth are read from the
+  components when /metrics is scraped (`register_collector`).
+
+With METRICS_LOG=1 each request also prints one JSON line listing the
+storage calls it made (`trace`). That is how you see, for example, that
+verify_data spends its time on the serial -> batch hop.
+
+Histograms keep fixed bucket counts, so memory grows with the number of
+label combinations, not with traffic.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; tuned for a web app whose calls take milliseconds to a few seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Storage calls made by the current request (None outside a traced request)
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if not isinstance(value, int) else str(value)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., count, sum, max]
+        self._series = {}
+
+    def observe(self, seconds, *label_values):
+        label_values = tuple(str(value) for value in label_values)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0, 0.0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-3] += 1
+            series[-2] += seconds
+            series[-1] = max(series[-1], seconds)
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((values, list(counts)) for values, counts in self._series.items())
+        for values, counts in series:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, values, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, values, [('le', '+Inf')])} {counts[-3]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {_number(counts[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {counts[-3]}")
+        return lines
+
+    def stats(self):
+        """{"<label values>": {"count", "avg_ms", "max_ms"}} for JSON stats endpoints."""
+        with self._lock:
+            series = sorted((values, list(counts)) for values, counts in self._series.items())
+        return {
+            " ".join(values): {
+                "count": counts[-3],
+                "avg_ms": round(counts[-2] / counts[-3] * 1000, 2),
+                "max_ms": round(counts[-1] * 1000, 2),
+            }
+            for values, counts in series
+        }
+
+
+REQUEST_SECONDS = Histogram(
+    "pharmacheck_request_duration_seconds", "Request latency by endpoint and status.", ("endpoint", "status"))
+STORAGE_SECONDS = Histogram(
+    "pharmacheck_storage_call_duration_seconds",
+    "Supabase/SQLite call latency (retries included) by table, operation and outcome.",
+    ("table", "operation", "outcome"))
+PDF_RENDER_SECONDS = Histogram(
+    "pharmacheck_pdf_render_seconds", "PDF rendering time by report.", ("report",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+HISTOGRAMS = [REQUEST_SECONDS, STORAGE_SECONDS, PDF_RENDER_SECONDS]
+
+# Callables returning [(name, type, help, {label: value}, value)], read on every scrape
+_collectors = []
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+    return collect
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    families = {}
+    for collect in _collectors:
+        try:
+            samples = collect()
+        except Exception as e:
+            print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+            continue
+        for name, kind, help_text, labels, value in samples:
+            if value is None:
+                continue
+            family = families.setdefault(name, (kind, help_text, []))
+            family[2].append((labels, value))
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------
+# Per-request storage-call traces
+# -------------------------------
+def start_trace():
+    """Starts collecting the storage calls of the current request; returns the list they go into."""
+    spans = []
+    _trace.set(spans)
+    return spans
+
+
+def end_trace():
+    _trace.set(None)
+
+
+def observe_storage_call(table, operation, outcome, seconds):
+    STORAGE_SECONDS.observe(seconds, table, operation, outcome)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append({"table": table, "operation": operation, "outcome": outcome,
+                      "ms": round(seconds * 1000, 2)})
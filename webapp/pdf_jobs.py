@@ -0,0 +1,366 @@
+"""
+Background queue for the PDF exports (/api/generate_pdf and /api/generate_pdf_2).
+
+A large export used to be rendered inside the request: the worker thread was
+busy for as long as ReportLab took and a slow one ran into the proxy's
+timeout. Now the endpoint submits a job and answers 202 with its id straight
+away; a small thread pool renders the PDF into `directory`, and the client
+polls GET /api/pdf_jobs/<id> (optionally long-polling with ?wait=<seconds>)
+until it can download the file.
+
+- Deduplication: a job is keyed like the report caches (kind, date range,
+  filters). While a job for a key is queued or running, the same request
+  gets that job back instead of a second render; a finished one is reused
+  for `reuse_ttl` seconds (`live_reuse_ttl` if the range includes today).
+  Each key is claimed in `directory` by a `<digest>.claim` file naming its
+  job, created with O_EXCL, so this holds across all workers on the host:
+  only the worker whose create succeeded renders. `release()` drops claims
+  whose data has changed since.
+- Storage: `<id>.pdf` plus a `<id>.json` status file, both written
+  atomically. Status is read from the JSON file when the job is not in this
+  process's memory, so any worker on the host can answer the poll or serve
+  the download. Files are deleted `ttl_seconds` after the job finished.
+- A job whose status file says "running" but has not finished within
+  `max_runtime` (its worker was killed or restarted) is reported as failed.
+- At most `max_pending` jobs wait or run per worker; `submit` raises
+  QueueFull beyond that.
+
+Jobs run on threads, not processes: the render functions need the app's
+storage client and report caches, and the pool is sized small
+(PDF_JOB_WORKERS) so exports cannot crowd out request threads.
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: served by one process (serve.py), so the thread lock is enough
+    fcntl = None
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+# secrets.token_urlsafe(16); anything else is not a job id (and never a path)
+JOB_ID = re.compile(r"[A-Za-z0-9_-]{22}")
+
+# Expired files are swept at most this often
+SWEEP_INTERVAL = 60
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PDFJobQueue:
+
+    def __init__(self, directory, workers=2, ttl_seconds=3600, reuse_ttl=3600, live_reuse_ttl=60,
+                 max_pending=20, max_runtime=15 * 60):
+        self.directory = directory
+        self.workers = workers
+        self.ttl_seconds = ttl_seconds
+        self.reuse_ttl = reuse_ttl
+        self.live_reuse_ttl = live_reuse_ttl
+        self.max_pending = max_pending
+        self.max_runtime = max_runtime
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # job id -> job dict, for jobs submitted by this process
+        self._jobs = {}
+        # Serialises claim checks within this process; fcntl.flock across processes
+        self._claim_lock = threading.Lock()
+        self._finished = {}
+        self._pool = None
+        self._pid = None
+        self._swept_at = 0.0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    def _executor(self):
+        # Created lazily and per process, so forked workers each get their own pool
+        if self._pool is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf-job")
+        return self._pool
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    # -------------------------------
+    # Submitting
+    # -------------------------------
+    def submit(self, key, filename, render, live=False):
+        """
+        Queues `render()` (returns a file object with the PDF) unless an equivalent
+        job is pending or recently finished in any worker. `key` None means never
+        deduplicate. Returns the job as a dict.
+        """
+        self._sweep()
+        if key is None:
+            job = self._new_job(filename, live)
+        else:
+            claim_path = self._path(self._digest(key), ".claim")
+            with self._claims_locked():
+                claimed = self._read_claim(claim_path)
+                job = self.get(claimed["id"]) if claimed else None
+                if job is not None and self._reusable(job, time.time()):
+                    self.deduplicated += 1
+                    return job
+                if claimed:
+                    os.remove(claim_path)
+                job = self._new_job(filename, live)
+                try:
+                    fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    # Only possible without flock: another worker claimed it in between
+                    self._forget(job["id"])
+                    claimed = self._read_claim(claim_path)
+                    job = self.get(claimed["id"]) if claimed else None
+                    if job is None:
+                        raise QueueFull("The same export is being queued; try again shortly.")
+                    self.deduplicated += 1
+                    return job
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"id": job["id"], "key": key}, f, default=str)
+        self._executor().submit(self._run, job["id"], render)
+        return job
+
+    def _new_job(self, filename, live):
+        now = time.time()
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j["status"] not in FINISHED)
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} exports are already queued; try again shortly.")
+            job_id = secrets.token_urlsafe(16)
+            job = {
+                "id": job_id,
+                "status": QUEUED,
+                "filename": filename,
+                "live": live,
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None,
+                "expires_at": None,
+                "size": None,
+                "error": None,
+            }
+            self._jobs[job_id] = job
+            self._finished[job_id] = threading.Event()
+            self.submitted += 1
+            # Written before the claim, so whoever reads the claim finds the job
+            self._write_status(job)
+            return dict(job)
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._finished.pop(job_id, None)
+            self.submitted -= 1
+        os.remove(self._path(job_id, ".json"))
+
+    # -------------------------------
+    # Claims (shared between workers)
+    # -------------------------------
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha256(json.dumps(key, default=str).encode("utf-8")).hexdigest()[:32]
+
+    @contextmanager
+    def _claims_locked(self):
+        with self._claim_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, ".claims.lock"), "a") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_claim(path):
+        """The claim file's {"id", "key"}; None if there is none, {"id": None} if it was cut short."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Written by a worker that died mid-claim: the job it named is unknown
+            return {"id": None}
+
+    def release(self, stale):
+        """Drops the claims whose key satisfies `stale(key)`, so the next request for them renders afresh."""
+        with self._claims_locked():
+            for name in os.listdir(self.directory):
+                if not name.endswith(".claim"):
+                    continue
+                claimed = self._read_claim(os.path.join(self.directory, name))
+                if claimed and claimed.get("key") is not None and stale(claimed["key"]):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _reusable(self, job, now):
+        if job["status"] in (QUEUED, RUNNING):
+            return True
+        if job["status"] != DONE or not os.path.exists(self._path(job["id"], ".pdf")):
+            return False
+        return job["finished_at"] + (self.live_reuse_ttl if job["live"] else self.reuse_ttl) > now
+
+    def _run(self, job_id, render):
+        job = self._jobs[job_id]
+        self._update(job, status=RUNNING, started_at=time.time())
+        pdf_path = self._path(job_id, ".pdf")
+        try:
+            pdf_file = render()
+            try:
+                pdf_file.seek(0)
+                with open(pdf_path + ".tmp", "wb") as out:
+                    shutil.copyfileobj(pdf_file, out)
+            finally:
+                pdf_file.close()
+            os.replace(pdf_path + ".tmp", pdf_path)
+            finished = time.time()
+            self._update(job, status=DONE, finished_at=finished, expires_at=finished + self.ttl_seconds,
+                         size=os.path.getsize(pdf_path))
+        except Exception as e:
+            print(f"PDF export {job_id} failed: {e}")
+            self.failed += 1
+            if os.path.exists(pdf_path + ".tmp"):
+                os.remove(pdf_path + ".tmp")
+            finished = time.time()
+            self._update(job, status=FAILED, finished_at=finished, expires_at=finished + self.ttl_seconds,
+                         error=str(e))
+        finally:
+            self._finished[job_id].set()
+
+    def _update(self, job, **changes):
+        with self._lock:
+            job.update(changes)
+            self._write_status(job)
+
+    def _write_status(self, job):
+        path = self._path(job["id"], ".json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(path + ".tmp", path)
+
+    # -------------------------------
+    # Polling and downloads
+    # -------------------------------
+    def get(self, job_id):
+        """The job as a dict, from memory or from its status file; None if unknown or expired."""
+        if not JOB_ID.fullmatch(job_id or ""):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        try:
+            with open(self._path(job_id, ".json"), encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job["status"] not in FINISHED and time.time() - job["created_at"] > self.max_runtime:
+            job.update(status=FAILED, error="The export did not finish (its worker stopped).")
+        return job
+
+    def wait(self, job_id, timeout):
+        """Like get(), but waits up to `timeout` seconds for the job to finish."""
+        deadline = time.monotonic() + timeout
+        finished = self._finished.get(job_id)
+        if finished is not None:
+            finished.wait(timeout)
+            return self.get(job_id)
+        # Submitted by another worker: watch its status file
+        job = self.get(job_id)
+        while job is not None and job["status"] not in FINISHED and time.monotonic() < deadline:
+            time.sleep(0.5)
+            job = self.get(job_id)
+        return job
+
+    def pdf_path(self, job_id):
+        """Path of a finished job's PDF, or None."""
+        job = self.get(job_id)
+        if job is None or job["status"] != DONE:
+            return None
+        path = self._path(job_id, ".pdf")
+        return path if os.path.exists(path) else None
+
+    # -------------------------------
+    # Expiry
+    # -------------------------------
+    def _sweep(self):
+        now = time.time()
+        if now - self._swept_at < SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job["expires_at"] and job["expires_at"] < now]:
+                del self._jobs[job_id]
+                self._finished.pop(job_id, None)
+        # Files are swept by whichever worker gets here first, including other workers' jobs
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            job_id = name[:-len(".json")]
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            stuck = job["status"] not in FINISHED and now - job["created_at"] > self.max_runtime
+            if (job["expires_at"] and job["expires_at"] < now) or stuck:
+                for suffix in (".pdf", ".pdf.tmp", ".json"):
+                    try:
+                        os.remove(self._path(job_id, suffix))
+                    except FileNotFoundError:
+                        pass
+        # Claims whose job has been swept (here or by another worker)
+        with self._claims_locked():
+            for name in os.listdir(self.directory):
+                if name.endswith(".claim"):
+                    claimed = self._read_claim(os.path.join(self.directory, name))
+                    if claimed and not (claimed.get("id") and os.path.exists(self._path(claimed["id"], ".json"))):
+                        os.remove(os.path.join(self.directory, name))
+
+    def shutdown(self):
+        """
+        On worker exit: drops queued jobs and marks unfinished ones failed, so
+        clients polling them are told now rather than after `max_runtime`.
+        """
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] not in FINISHED:
+                    finished = time.time()
+                    job.update(status=FAILED, finished_at=finished, expires_at=finished + self.ttl_seconds,
+                               error="The server restarted before the export finished; please try again.")
+                    self._write_status(job)
+                    self._finished[job["id"]].set()
+
+    def stats(self):
+        with self._lock:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job["status"]] = by_status.get(job["status"], 0) + 1
+        return {
+            "jobs": by_status,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+        }
@@ -0,0 +1,249 @@
+"""
+PDF rendering for the admin report exports (/api/generate_pdf and /api/generate_pdf_2).
+
+Large exports used to become one giant ReportLab Table rendered into a BytesIO.
+Here the rows are cut into page-sized tables that share one precomputed
+TableStyle and repeat the header row, the tables are only created as ReportLab
+reaches them, and the PDF is written to a spooled temp file (memory up to
+SPOOL_MAX_BYTES, disk after that) that the endpoint streams back with send_file.
+"""
+import tempfile
+from itertools import islice
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+# Rows per table chunk: about one letter page at the body font size
+TABLE_CHUNK_ROWS = 30
+
+# Rendered PDFs stay in memory up to this size, then roll over to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+HEADER_BG = colors.HexColor("#12B981")  # Your green
+
+# -------------------------------
+# Styles, built once per process
+# -------------------------------
+STYLES = getSampleStyleSheet()
+
+LOGO_STYLE = ParagraphStyle(
+    name="LogoStyle",
+    parent=STYLES["Normal"],
+    fontName="Helvetica-Oblique",
+    fontSize=22,
+    textColor=colors.HexColor("#2A6A50"),  # Logo color
+    alignment=1,
+)
+
+QUERY_LOG_TABLE_STYLE = TableStyle([
+    # HEADER
+    ("BACKGROUND", (0, 0), (-1, 0), HEADER_BG),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+    ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, 0), 11),
+    ("TOPPADDING", (0, 0), (-1, 0), 6),
+    ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
+
+    # BODY
+    ("BACKGROUND", (0, 1), (-1, -1), colors.white),
+    ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),
+    ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+    ("FONTSIZE", (0, 1), (-1, -1), 10),
+    ("ALIGN", (0, 1), (-1, -1), "CENTER"),
+
+    # GRID
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+
+    # Padding
+    ("LEFTPADDING", (0, 0), (-1, -1), 6),
+    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+    ("TOPPADDING", (0, 1), (-1, -1), 4),
+    ("BOTTOMPADDING", (0, 1), (-1, -1), 4),
+])
+
+REPORT_PAGE_TABLE_STYLE = TableStyle([
+    # HEADER
+    ("BACKGROUND", (0, 0), (-1, 0), HEADER_BG),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+    ("FONTSIZE", (0, 0), (-1, 0), 11),
+
+    # BODY
+    ("BACKGROUND", (0, 1), (-1, -1), colors.white),
+    ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),
+    ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+    ("FONTSIZE", (0, 1), (-1, -1), 10),
+
+    # GRID
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+
+    # Padding for readability
+    ("LEFTPADDING", (0, 0), (-1, -1), 6),
+    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+    ("TOPPADDING", (0, 0), (-1, -1), 4),
+    ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+])
+
+QUERY_LOG_HEADERS = [
+    "Serial No.",
+    "Total Queries",
+    "Authentic Count",
+    "Counterfeit Count",
+    "Expired Count",
+    "Last Query"
+]
+# Fixed widths so every chunk lines up with the one before it. These are the
+# widths ReportLab picked automatically for typical data when this was one table.
+QUERY_LOG_COL_WIDTHS = [100, 83, 98, 106, 88, 106]
+
+REPORT_PAGE_HEADERS = ["Product Name", "Batch/Serial No", "Location", "Description", "Email", "Created At"]
+# Fixed widths for the same reason, computed once as shares of the page width less a
+# quarter inch each side (what the query log's widths add up to): an email and a
+# created_at timestamp need about 140 and 125 points, the other columns their header
+REPORT_PAGE_COL_WIDTHS = [(letter[0] - inch / 2) * share for share in (0.15, 0.16, 0.10, 0.13, 0.24, 0.22)]
+
+
+class LazyFlowables(list):
+    """
+    Flowable list that pulls from a generator as ReportLab consumes it.
+
+    doc.build() only ever looks at the front of the list and deletes items as it
+    places them, so keeping a few flowables buffered is enough; the rest of the
+    report is never materialised.
+    """
+
+    def __init__(self, head, tail, lookahead=2):
+        super().__init__(head)
+        self._tail = iter(tail)
+        self._lookahead = lookahead
+
+    def _fill(self):
+        while self._tail is not None and list.__len__(self) < self._lookahead:
+            try:
+                self.append(next(self._tail))
+            except StopIteration:
+                self._tail = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+
+def chunked_tables(headers, rows, style, col_widths=None):
+    """Yields one Table per TABLE_CHUNK_ROWS rows, each repeating the header row."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, TABLE_CHUNK_ROWS))
+        if not chunk:
+            break
+        yield Table([headers] + chunk, colWidths=col_widths, repeatRows=1, style=style)
+
+
+def _spooled_build(title, head, tail):
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix=".pdf")
+    doc = SimpleDocTemplate(output, pagesize=letter, title=title)
+    doc.build(LazyFlowables(head, tail))
+    output.seek(0)
+    return output
+
+
+def render_query_log_pdf(report_data, start_date, end_date, summary):
+    """Pharmacy query log report. Returns a file object positioned at the start of the PDF."""
+    elements = []
+
+    # -----------------------------------------------------
+    # 1. PHARMACHECK TEXT LOGO
+    # -----------------------------------------------------
+    elements.append(Paragraph("Pharmacheck", LOGO_STYLE))
+    elements.append(Spacer(1, 18))
+
+    # -----------------------------------------------------
+    # 2. TITLE + DATE PERIOD
+    # -----------------------------------------------------
+    elements.append(Paragraph("Pharmacy Query Log Report", STYLES["Title"]))
+    elements.append(Paragraph(f"Period: {start_date} to {end_date}", STYLES["Normal"]))
+
+    # -----------------------------------------------------
+    # 3. SUMMARY SECTION
+    # -----------------------------------------------------
+    elements.append(Spacer(1, 18))  # Space before the summary section
+    summary_text = f"""
+        <b>Total Queries:</b> {summary["total_queries"]}<br/>
+        <b>Authentic Queries:</b> {summary["authentic_count"]}<br/>
+        <b>Counterfeit Queries:</b> {summary["counterfeit_count"]}<br/>
+        <b>Expired Queries:</b> {summary["expired_count"]}
+    """
+    elements.append(Paragraph(summary_text, STYLES["Normal"]))
+
+    # Add space before table
+    elements.append(Spacer(1, 24))
+
+    # -----------------------------------------------------
+    # 4. TABLE DATA, one page-sized table at a time
+    # -----------------------------------------------------
+    table_rows = ([
+        row.get("serial", ""),
+        str(row.get("total_queries", "")),
+        str(row.get("authentic_count", "")),
+        str(row.get("counterfeit_count", "")),
+        str(row.get("expired_count", "")),
+        row.get("last_query_timestamp") or ""
+    ] for row in report_data)
+
+    tables = chunked_tables(QUERY_LOG_HEADERS, table_rows, QUERY_LOG_TABLE_STYLE, QUERY_LOG_COL_WIDTHS)
+    first = next(tables, None)
+    if first is None:
+        elements.append(Paragraph(
+            "No data available for the selected time frame.",
+            STYLES["Normal"]
+        ))
+    else:
+        elements.append(first)
+
+    return _spooled_build("Verification Log Report", elements, tables)
+
+
+def render_report_page_pdf(report_data, start_date, end_date):
+    """Reported drugs (report_page) export. Returns a file object positioned at the start of the PDF."""
+    elements = []
+
+    # -----------------------------------------------------
+    # TEXT LOGO AT TOP
+    # -----------------------------------------------------
+    elements.append(Paragraph("Pharmacheck", LOGO_STYLE))
+    elements.append(Spacer(1, 18))   # Space under logo
+
+    # Title
+    elements.append(Paragraph("Report Page Export", STYLES["Title"]))
+    elements.append(Paragraph(f"Period: {start_date} to {end_date}", STYLES["Normal"]))
+    elements.append(Paragraph("<br/>", STYLES["Normal"]))
+
+    # Extra spacing before table
+    elements.append(Spacer(1, 24))
+
+    # Table rows
+    table_rows = ([
+        r.get("product_name", ""),
+        r.get("batch_serial", ""),
+        r.get("location", ""),
+        r.get("description", ""),
+        r.get("email", ""),
+        r.get("created_at", "")
+    ] for r in report_data)
+
+    tables = chunked_tables(REPORT_PAGE_HEADERS, table_rows, REPORT_PAGE_TABLE_STYLE, REPORT_PAGE_COL_WIDTHS)
+    first = next(tables, None)
+    # An empty export still shows the header row
+    elements.append(first or Table([REPORT_PAGE_HEADERS], colWidths=REPORT_PAGE_COL_WIDTHS,
+                                   style=REPORT_PAGE_TABLE_STYLE))
+
+    return _spooled_build("Report Page Export", elements, tables)
@@ -0,0 +1,78 @@
+"""
+Product catalog for the multi-product registry (sql/006_product_registry.sql).
+
+Batches and serials of every product share the product_batches /
+product_serials tables, each row tagged with its `product_code`. The products
+table only maps those codes to display names, so it is small enough to hold
+in memory whole: `ProductCatalog` loads it on first use and reloads it every
+`ttl_seconds`. A failed reload keeps serving the previous copy, and a code the
+catalog has never seen is shown by its code, so verification never waits on
+or fails because of product names.
+"""
+import threading
+import time
+
+from data_access import execute
+
+PRODUCT_TABLE = "products"
+PRODUCT_COLUMNS = "code, name"
+
+
+def normalize_code(code):
+    """Product codes are stored upper case with no surrounding whitespace."""
+    return (code or "").strip().upper() or None
+
+
+class ProductCatalog:
+
+    def __init__(self, client, ttl_seconds=300):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # code -> {"code", "name"}
+        self._products = {}
+        self._expires_at = 0.0
+        self.reloads = 0
+
+    def _fresh(self):
+        if self._expires_at > time.monotonic():
+            return self._products
+        with self._lock:
+            if self._expires_at > time.monotonic():
+                return self._products
+            try:
+                rows = execute(self.client.table(PRODUCT_TABLE).select(PRODUCT_COLUMNS).order("name")).data or []
+                self._products = {row["code"]: row for row in rows}
+                self.reloads += 1
+                self._expires_at = time.monotonic() + self.ttl_seconds
+            except Exception as e:
+                print(f"Product catalog reload failed: {e}")
+                # Retry sooner than a full TTL, but not on every request
+                self._expires_at = time.monotonic() + min(self.ttl_seconds, 30)
+            return self._products
+
+    def all(self):
+        """Every product, ordered by name."""
+        return list(self._fresh().values())
+
+    def get(self, code):
+        return self._fresh().get(code)
+
+    def name(self, code):
+        product = self.get(code)
+        return product["name"] if product else code
+
+    def add(self, code, name):
+        """Registers a product and makes it visible to this worker straight away."""
+        record = {"code": normalize_code(code), "name": (name or "").strip()}
+        execute(self.client.table(PRODUCT_TABLE).insert(record), idempotent=False)
+        with self._lock:
+            self._products = dict(sorted({**self._products, record["code"]: record}.items(),
+                                         key=lambda item: item[1]["name"]))
+        return record
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    def stats(self):
+        return {"products": len(self._products), "reloads": self.reloads}
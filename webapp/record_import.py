@@ -0,0 +1,294 @@
+"""
+Bulk import of batch and serial records from CSV or JSONL (/admin/import-records).
+
+Manufacturers ship serial lists with tens of thousands of codes; typing them
+into /admin/add-records one at a time does not scale. `RecordImport`
+streams an uploaded file row by row, validates each row, and upserts valid
+rows in chunks of CHUNK_SIZE, keyed on batch_number / serial_no, so re-importing
+a corrected file updates rows instead of failing on duplicates (uses the
+unique constraints in sql/006).
+
+- Memory stays bounded: only the current chunk, the chunk being written and
+  at most MAX_REPORTED_ERRORS error entries are held.
+- Validating the next chunk overlaps with writing the previous one.
+- Serial chunks check their batch numbers with one `in_` query first, so rows
+  pointing at an unknown batch are reported instead of failing the chunk.
+- If a chunk is still rejected, it is split in halves until the bad rows are
+  isolated and reported by line number.
+
+Rows name their product in a `product_code` column; rows without one get the
+product picked on the import page. Every import row replaces the stored
+record: columns missing from the file are written as empty.
+"""
+import codecs
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from data_access import execute
+from errors import is_api_error
+from products import normalize_code
+from verify_cache import BATCH_TABLE, SERIAL_TABLE
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ("csv", "jsonl")
+
+# One chunk is written while the next is validated
+_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="record-import")
+
+
+class InvalidImport(Exception):
+    """A problem with the file as a whole (unknown kind/format, unreadable header)."""
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _iso_date(value, field):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{field} must be a YYYY-MM-DD date, got {value!r}")
+
+
+def _iso_datetime(value, field):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{field} must be an ISO date/time, got {value!r}")
+
+
+def _count(value, field):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a whole number, got {value!r}")
+    if number < 0:
+        raise ValueError(f"{field} cannot be negative")
+    return number
+
+
+def _product_code(row):
+    product_code = normalize_code(_text(row.get("product_code")))
+    if not product_code:
+        raise ValueError("product_code is required")
+    return product_code
+
+
+def validate_batch(row):
+    """Returns the product_batches record for an import row, or raises ValueError."""
+    batch_number = _text(row.get("batch_number"))
+    if not batch_number:
+        raise ValueError("batch_number is required")
+    return {
+        "product_code": _product_code(row),
+        "batch_number": batch_number,
+        "manufacturer": _text(row.get("manufacturer")),
+        "manufacture_date": _iso_date(row.get("manufacture_date"), "manufacture_date"),
+        "expiry_date": _iso_date(row.get("expiry_date"), "expiry_date"),
+        "delivery_date": _iso_datetime(row.get("delivery_date"), "delivery_date"),
+        "source_distributor": _text(row.get("source_distributor")),
+    }
+
+
+def validate_serial(row):
+    """Returns the product_serials record for an import row, or raises ValueError."""
+    serial_no = _text(row.get("serial_no"))
+    if not serial_no:
+        raise ValueError("serial_no is required")
+    return {
+        "product_code": _product_code(row),
+        "serial_no": serial_no,
+        "strength_form": _text(row.get("strength_form")),
+        "units_per_pack": _count(row.get("units_per_pack"), "units_per_pack"),
+        "packs_per_box": _count(row.get("packs_per_box"), "packs_per_box"),
+        "pack_type": _text(row.get("pack_type")),
+        "batch_number": _text(row.get("batch_number")),
+    }
+
+
+# kind -> (table, key column, validator)
+KINDS = {
+    "batch": (BATCH_TABLE, "batch_number", validate_batch),
+    "serial": (SERIAL_TABLE, "serial_no", validate_serial),
+}
+
+
+def detect_format(filename, requested=None):
+    fmt = (requested or "").lower() or ("jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    if fmt not in FORMATS:
+        raise InvalidImport(f"Unsupported format {fmt!r}; use CSV or JSONL.")
+    return fmt
+
+
+def iter_rows(stream, fmt):
+    """Yields (line_number, row_dict_or_None, parse_error_or_None) from a binary file stream."""
+    lines = codecs.iterdecode(stream, "utf-8-sig")
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        if not reader.fieldnames:
+            raise InvalidImport("The CSV file is empty or has no header row.")
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for row in reader:
+            yield reader.line_num, row, None
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "each line must be a JSON object"
+                continue
+            yield line_number, row, None
+
+
+class RecordImport:
+    """One import run. Iterate `run()` for progress; `result()` has the totals and errors."""
+
+    def __init__(self, client, kind, on_chunk=None, product=None, known_products=None):
+        if kind not in KINDS:
+            raise InvalidImport(f"Unknown record type {kind!r}; expected batch or serial.")
+        self.client = client
+        self.kind = kind
+        self.table, self.key, self.validate = KINDS[kind]
+        # Used for rows without a product_code column/value
+        self.product = normalize_code(product)
+        # Codes of registered products; None skips the check
+        self.known_products = known_products
+        if self.product and known_products is not None and self.product not in known_products:
+            raise InvalidImport(f"Unknown product {self.product!r}.")
+        # Called with each chunk of records written (e.g. to refresh caches)
+        self.on_chunk = on_chunk
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    def _error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    # -------------------------------
+    # Writing (runs on the writer pool)
+    # -------------------------------
+    def _unknown_batches(self, chunk):
+        """(product_code, batch_number) pairs in a serial chunk that are not registered batches."""
+        wanted = {(record["product_code"], record["batch_number"]) for _, record in chunk if record["batch_number"]}
+        if not wanted:
+            return set()
+        rows = execute(self.client.table(BATCH_TABLE).select("product_code, batch_number")
+                       .in_("batch_number", list({batch for _, batch in wanted}))).data
+        return wanted - {(row["product_code"], row["batch_number"]) for row in rows or []}
+
+    def _upsert(self, chunk, errors):
+        """Upserts [(line, record)], halving on rejection to pin down bad rows. Returns rows written."""
+        try:
+            execute(self.client.table(self.table).upsert([record for _, record in chunk], on_conflict=self.key))
+            return len(chunk)
+        except Exception as e:
+            if not is_api_error(e):
+                raise
+            if len(chunk) == 1:
+                errors.append((chunk[0][0], e.message or str(e)))
+                return 0
+        middle = len(chunk) // 2
+        return self._upsert(chunk[:middle], errors) + self._upsert(chunk[middle:], errors)
+
+    def _write(self, chunk):
+        errors = []
+        if self.kind == "serial":
+            unknown = self._unknown_batches(chunk)
+            if unknown:
+                def is_unknown(record):
+                    return (record["product_code"], record["batch_number"]) in unknown
+                errors.extend((line, f"unknown batch_number {record['batch_number']!r} "
+                                     f"for product {record['product_code']!r}")
+                              for line, record in chunk if is_unknown(record))
+                chunk = [(line, record) for line, record in chunk if not is_unknown(record)]
+        written = self._upsert(chunk, errors) if chunk else 0
+        if written and self.on_chunk:
+            failed_lines = {line for line, _ in errors}
+            self.on_chunk(self.table, [record for line, record in chunk if line not in failed_lines])
+        return written, errors
+
+    def _collect(self, future):
+        written, errors = future.result()
+        self.imported += written
+        for line, message in errors:
+            self._error(line, message)
+
+    # -------------------------------
+    # Driving the import
+    # -------------------------------
+    def run(self, rows):
+        """Consumes (line, row, parse_error) tuples; yields progress() after each chunk is written."""
+        pending = None
+        chunk = {}
+        for line, row, parse_error in rows:
+            self.processed += 1
+            if parse_error:
+                self._error(line, parse_error)
+                continue
+            row = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+            if self.product and not _text(row.get("product_code")):
+                row["product_code"] = self.product
+            try:
+                record = self.validate(row)
+                if self.known_products is not None and record["product_code"] not in self.known_products:
+                    raise ValueError(f"unknown product_code {record['product_code']!r}")
+            except ValueError as e:
+                self._error(line, str(e))
+                continue
+            # A code repeated within a chunk is written once, with its last values
+            chunk[record[self.key]] = (line, record)
+            if len(chunk) >= CHUNK_SIZE:
+                if pending is not None:
+                    self._collect(pending)
+                    yield self.progress()
+                pending = _writer.submit(self._write, list(chunk.values()))
+                chunk = {}
+        if pending is not None:
+            self._collect(pending)
+            yield self.progress()
+        if chunk:
+            self._collect(_writer.submit(self._write, list(chunk.values())))
+            yield self.progress()
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "processed": self.processed,
+            "imported": self.imported,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(self.processed / elapsed) if elapsed > 0 else None,
+        }
+
+    def result(self):
+        result = self.progress()
+        result["kind"] = self.kind
+        result["errors"] = self.errors
+        result["errors_truncated"] = self.failed > len(self.errors)
+        return result
@@ -0,0 +1,328 @@
+"""
+Local read replica of the batch and serial registries for /api/verify.
+
+With REPLICA_PATH set, the product_batches and product_serials registries
+are copied into a local SQLite file (storage.SQLiteStore) and kept current by
+a background thread, so verifications are answered locally and keep working while Supabase
+is unreachable. pharmlogs writes already survive outages: log_queue.py spills
+them to disk and uploads them once inserts succeed again.
+
+Sync is incremental when the registries carry `updated_at`
+(sql/004 and sql/006): each run pulls rows changed since the last
+cursor, re-reading a short LOOKBACK window so rows from transactions that
+committed late are not missed. Without `updated_at`, and every
+`full_sync_interval` seconds regardless, the tables are copied in full, which
+also removes rows deleted upstream.
+
+`freshness()` says how current the replica is; /api/verify returns it so
+pharmacists can see how old the data behind an answer may be.
+
+Every gunicorn worker opens the same REPLICA_PATH, but only one process per
+host syncs it: the one holding an flock on `<path>.sync.lock` (taken over by
+another worker if it exits). The others only read the file, and run
+`on_sync` when the syncer records that rows changed.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: served by one process (serve.py), which always syncs
+    fcntl = None
+
+from data_access import execute
+from errors import is_api_error
+from dates import parse_iso_timestamp
+from storage import SQLiteStore
+from verify_cache import BATCH_TABLE, SERIAL_TABLE, BATCH_COLUMNS, SERIAL_COLUMNS
+
+# (table, natural key, columns); batches first so serials find their parent
+REGISTRIES = (
+    (BATCH_TABLE, "batch_number", BATCH_COLUMNS),
+    (SERIAL_TABLE, "serial_no", SERIAL_COLUMNS),
+)
+
+CURSOR_COLUMN = "updated_at"
+SYNC_PAGE_SIZE = 1000
+LOOKBACK = timedelta(seconds=60)
+
+# Local keys deleted per statement after a full copy
+DELETE_CHUNK_SIZE = 500
+
+STATE_TABLE_DDL = """
+create table if not exists replica_state (
+    table_name text primary key,
+    cursor text,
+    synced_at text,
+    full_synced_at text
+)
+"""
+
+# One row, bumped by the syncing process whenever a sync changed rows
+CHANGES_TABLE_DDL = """
+create table if not exists replica_changes (
+    id integer primary key check (id = 1),
+    changed_at text
+)
+"""
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _parse(value):
+    return parse_iso_timestamp(value) if value else None
+
+
+class VerificationReplica:
+
+    def __init__(self, remote, path, sync_interval=60, full_sync_interval=6 * 3600, on_sync=None):
+        self.remote = remote
+        # Parent batches can arrive after their serials during a partial sync
+        self.store = SQLiteStore(path, foreign_keys=False)
+        self.store.connection().execute(STATE_TABLE_DDL)
+        self.store.connection().execute(CHANGES_TABLE_DDL)
+        self.lock_path = f"{path}.sync.lock"
+        self._lock_file = None
+        self._seen_change = None
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        # Called after a sync that changed rows (e.g. to drop cached lookups)
+        self.on_sync = on_sync
+        # Cleared the first time the remote turns out not to have `updated_at`
+        self.delta_supported = True
+        self._sync_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.syncs = 0
+        self.failed_syncs = 0
+        self.last_error = None
+
+    # -------------------------------
+    # Sync state
+    # -------------------------------
+    def _state(self, table):
+        row = self.store.connection().execute(
+            "select cursor, synced_at, full_synced_at from replica_state where table_name = ?", (table,)).fetchone()
+        return dict(row) if row else {"cursor": None, "synced_at": None, "full_synced_at": None}
+
+    def _save_state(self, table, cursor, full):
+        now = _now().isoformat()
+        with self.store.write_lock:
+            self.store.connection().execute(
+                """insert into replica_state (table_name, cursor, synced_at, full_synced_at) values (?, ?, ?, ?)
+                   on conflict (table_name) do update set
+                       cursor = excluded.cursor,
+                       synced_at = excluded.synced_at,
+                       full_synced_at = coalesce(excluded.full_synced_at, full_synced_at)""",
+                (table, cursor, now, now if full else None))
+
+    def ready(self):
+        """True once every registry has been copied at least once."""
+        self._ensure_started()
+        return all(self._state(table)["synced_at"] for table, _, _ in REGISTRIES)
+
+    def freshness(self):
+        """{"dataAsOf": <oldest successful table sync>, "stalenessSeconds": ...}, or None before the first sync."""
+        synced = [_parse(self._state(table)["synced_at"]) for table, _, _ in REGISTRIES]
+        if not all(synced):
+            return None
+        as_of = min(synced)
+        return {
+            "dataAsOf": as_of.isoformat(timespec="seconds"),
+            "stalenessSeconds": round((_now() - as_of).total_seconds(), 1),
+        }
+
+    # -------------------------------
+    # Pulling from Supabase
+    # -------------------------------
+    def _upsert(self, table, key, rows):
+        for row in rows:
+            row.pop(CURSOR_COLUMN, None)
+        if rows:
+            self.store.table(table).upsert(rows, on_conflict=key).execute()
+
+    def _cursor_missing(self, table, error):
+        """True (and delta sync switched off) if `error` says the remote has no updated_at column."""
+        if not (self.delta_supported and error.code == "42703"):
+            return False
+        print(f"{table} has no {CURSOR_COLUMN} column (sql/004, sql/006); using full syncs")
+        self.delta_supported = False
+        return True
+
+    def _copy_delta(self, table, key, columns, cursor):
+        """Upserts rows changed since `cursor`; returns (new cursor, rows copied)."""
+        since = (_parse(cursor) - LOOKBACK).isoformat()
+        last_ts = last_key = None
+        copied = 0
+        while True:
+            query = self.remote.table(table).select(f"{columns}, {CURSOR_COLUMN}").gte(CURSOR_COLUMN, since)
+            if last_ts is not None:
+                query = query.or_(f'{CURSOR_COLUMN}.gt."{last_ts}",'
+                                  f'and({CURSOR_COLUMN}.eq."{last_ts}",{key}.gt."{last_key}")')
+            page = execute(query.order(CURSOR_COLUMN).order(key).limit(SYNC_PAGE_SIZE)).data or []
+            if page:
+                last_ts, last_key = page[-1][CURSOR_COLUMN], page[-1][key]
+                cursor = max(cursor, last_ts, key=_parse)
+            self._upsert(table, key, page)
+            copied += len(page)
+            if len(page) < SYNC_PAGE_SIZE:
+                return cursor, copied
+
+    def _copy_full(self, table, key, columns):
+        """Copies the whole table and deletes local rows that are gone upstream; returns (cursor, rows changed)."""
+        select = f"{columns}, {CURSOR_COLUMN}" if self.delta_supported else columns
+        conn = self.store.connection()
+        # Only rows that were here before the copy can be stale; apply() may add rows meanwhile
+        local = [row[0] for row in conn.execute(f'select "{key}" from "{table}"')]
+        cursor = None
+        seen = set()
+        last_key = None
+        while True:
+            query = self.remote.table(table).select(select)
+            if last_key is not None:
+                query = query.gt(key, last_key)
+            try:
+                page = execute(query.order(key).limit(SYNC_PAGE_SIZE)).data or []
+            except Exception as e:
+                if not (is_api_error(e) and self._cursor_missing(table, e)):
+                    raise
+                return self._copy_full(table, key, columns)
+            for row in page:
+                seen.add(row[key])
+                if row.get(CURSOR_COLUMN) and (cursor is None or _parse(row[CURSOR_COLUMN]) > _parse(cursor)):
+                    cursor = row[CURSOR_COLUMN]
+            self._upsert(table, key, page)
+            if len(page) < SYNC_PAGE_SIZE:
+                break
+            last_key = page[-1][key]
+
+        stale = [code for code in local if code not in seen]
+        with self.store.write_lock:
+            for start in range(0, len(stale), DELETE_CHUNK_SIZE):
+                chunk = stale[start:start + DELETE_CHUNK_SIZE]
+                conn.execute(f'delete from "{table}" where "{key}" in ({", ".join("?" * len(chunk))})', chunk)
+        return cursor or _now().isoformat(), len(seen) + len(stale)
+
+    def sync_once(self, full=False):
+        """Brings both registries up to date; returns the number of rows copied or removed."""
+        with self._sync_lock:
+            changed = 0
+            for table, key, columns in REGISTRIES:
+                state = self._state(table)
+                last_full = _parse(state["full_synced_at"])
+                full_copy = (full or not self.delta_supported or state["cursor"] is None or last_full is None
+                             or (_now() - last_full).total_seconds() >= self.full_sync_interval)
+                if not full_copy:
+                    try:
+                        cursor, count = self._copy_delta(table, key, columns, state["cursor"])
+                    except Exception as e:
+                        if not (is_api_error(e) and self._cursor_missing(table, e)):
+                            raise
+                        full_copy = True
+                if full_copy:
+                    cursor, count = self._copy_full(table, key, columns)
+                self._save_state(table, cursor, full_copy)
+                changed += count
+            self.syncs += 1
+            if changed:
+                self._record_change()
+                if self.on_sync:
+                    self.on_sync()
+            return changed
+
+    def apply(self, table, record):
+        """Writes a row the app just inserted upstream, so it verifies before the next sync."""
+        self.apply_many(table, [record])
+
+    def apply_many(self, table, records):
+        for name, key, columns in REGISTRIES:
+            if name == table:
+                columns = [c.strip() for c in columns.split(",")]
+                self._upsert(table, key, [{c: record.get(c) for c in columns} for record in records])
+
+    # -------------------------------
+    # Background sync
+    # -------------------------------
+    def _ensure_started(self):
+        # Started lazily and per process, so forked workers each get their own syncer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="registry-replica", daemon=True)
+            self._thread.start()
+
+    def start(self):
+        self._ensure_started()
+
+    def _is_syncer(self):
+        """True if this process holds the host's sync lock (taking it if it is free)."""
+        if fcntl is None:
+            return True
+        if self._lock_file is not None and self._lock_file[0] == os.getpid():
+            return True
+        handle = open(self.lock_path, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        # Held until the process exits; the OS then releases it for another worker
+        self._lock_file = (os.getpid(), handle)
+        return True
+
+    def _last_change(self):
+        row = self.store.connection().execute("select changed_at from replica_changes where id = 1").fetchone()
+        return row[0] if row else None
+
+    def _record_change(self):
+        changed_at = _now().isoformat()
+        with self.store.write_lock:
+            self.store.connection().execute(
+                "insert into replica_changes (id, changed_at) values (1, ?) "
+                "on conflict (id) do update set changed_at = excluded.changed_at", (changed_at,))
+        self._seen_change = changed_at
+
+    def _follow(self):
+        """In a non-syncing process: runs on_sync when the syncer has changed rows since we last looked."""
+        changed_at = self._last_change()
+        if changed_at != self._seen_change:
+            self._seen_change = changed_at
+            if self.on_sync:
+                self.on_sync()
+
+    def _run(self):
+        while True:
+            try:
+                if self._is_syncer():
+                    self.sync_once()
+                else:
+                    self._follow()
+                self.last_error = None
+            except Exception as e:
+                # Supabase unreachable: keep answering from the existing copy
+                print(f"Registry replica sync failed: {e}")
+                self.failed_syncs += 1
+                self.last_error = str(e)
+            time.sleep(self.sync_interval)
+
+    def stats(self):
+        conn = self.store.connection()
+        return {
+            "ready": all(self._state(table)["synced_at"] for table, _, _ in REGISTRIES),
+            "freshness": self.freshness(),
+            "rows": {table: conn.execute(f'select count(*) from "{table}"').fetchone()[0] for table, _, _ in REGISTRIES},
+            "delta_supported": self.delta_supported,
+            "syncer": fcntl is None or (self._lock_file is not None and self._lock_file[0] == os.getpid()),
+            "syncs": self.syncs,
+            "failed_syncs": self.failed_syncs,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,104 @@
+"""
+Result cache for the admin reports (/api/report, /api/report2 and their PDFs).
+
+Entries are keyed by (kind, start_day, end_day, *filters) with normalised
+dates. A range that ends before today rarely changes, so it is kept for
+`closed_ttl`; a range that includes today is kept for `live_ttl`. Either is
+dropped by `invalidate_days()` as soon as pharmlogs / report_page rows are
+written for a day it covers (a backdated /api/log row changes a closed range
+too).
+Least recently used entries are evicted beyond `max_entries`.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Cache kinds
+QUERY_REPORT = "query"
+QUERY_REPORT_PDF = "query_pdf"
+REPORT_PAGE = "report_page"
+REPORT_PAGE_PDF = "report_page_pdf"
+
+
+def today_utc():
+    # pharmlogs / report_page timestamps are stored in UTC
+    return datetime.now(timezone.utc).date()
+
+
+class ReportCache:
+
+    def __init__(self, max_entries=64, live_ttl=60, closed_ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.live_ttl = live_ttl
+        self.closed_ttl = closed_ttl
+        self._lock = threading.Lock()
+        # key -> (expires_at, includes_today, value)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(kind, start_date_str, end_date_str, *filters):
+        """
+        Normalised cache key, or None if the dates do not parse (such requests are not cached).
+        Also returns whether the range includes today.
+        """
+        try:
+            start_day = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_day = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return None, False
+        return (kind, start_day.isoformat(), end_day.isoformat()) + tuple(filters), end_day >= today_utc()
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, includes_today):
+        if key is None:
+            return
+        ttl = self.live_ttl if includes_today else self.closed_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, includes_today, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def covers(key, days):
+        """True if the range of `key` includes any of `days` (dates)."""
+        return any(key[1] <= day.isoformat() <= key[2] for day in days)
+
+    def invalidate_days(self, days, *kinds):
+        """Drops entries of the given kinds whose range includes any of `days`."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] in kinds and self.covers(key, days)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+        }
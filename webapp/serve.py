@@ -0,0 +1,112 @@
+"""
+Production launcher: `python serve.py` instead of `python app.py`.
+
+    cd webapp
+    python serve.py                              # gunicorn, sized from the CPU count
+    python serve.py --workers 4 --threads 16 --bind 0.0.0.0:8000
+    python serve.py --print-config               # show the resolved settings and exit
+
+On Linux/macOS with gunicorn installed this replaces itself with a gunicorn
+master using gunicorn.conf.py (workers, threads, preload, per-worker warm-up
+and graceful reloads are described there); the options below only override
+that file's environment variables.
+
+Windows has no gunicorn, so there (or when it is not installed) the app is
+warmed up and served by Werkzeug's threaded server in one process: it
+handles concurrent requests, but on one core.
+"""
+import argparse
+import os
+import runpy
+import sys
+
+WEBAPP_DIR = os.path.dirname(os.path.abspath(__file__))
+GUNICORN_CONFIG = os.path.join(WEBAPP_DIR, "gunicorn.conf.py")
+
+# serve.py option -> environment variable read by gunicorn.conf.py
+OPTION_ENV = {
+    "bind": "BIND",
+    "workers": "WEB_CONCURRENCY",
+    "threads": "GUNICORN_THREADS",
+    "timeout": "GUNICORN_TIMEOUT",
+    "max_requests": "GUNICORN_MAX_REQUESTS",
+}
+
+
+def gunicorn_available():
+    if os.name == "nt":
+        return False
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def apply_options(args):
+    for option, env in OPTION_ENV.items():
+        value = getattr(args, option)
+        if value is not None:
+            os.environ[env] = str(value)
+    if args.no_preload:
+        os.environ["GUNICORN_PRELOAD"] = "0"
+    if args.no_warm_up:
+        os.environ["WARM_UP"] = "0"
+
+
+def resolved_config():
+    settings = runpy.run_path(GUNICORN_CONFIG)
+    return {name: settings[name] for name in (
+        "bind", "workers", "threads", "worker_class", "preload_app", "timeout", "graceful_timeout",
+        "max_requests", "WARM_UP", "WARM_VERIFY_INDEX")}
+
+
+def serve_gunicorn():
+    os.chdir(WEBAPP_DIR)
+    # exec, so gunicorn is the process that receives HUP/USR2/TERM
+    os.execvp(sys.executable, [sys.executable, "-m", "gunicorn", "-c", GUNICORN_CONFIG, "app:app"])
+
+
+def serve_werkzeug(bind, warm):
+    from werkzeug.serving import run_simple
+
+    # No fork here, so the app starts its background work itself
+    os.environ.pop("PHARMACHECK_PRELOADED", None)
+    sys.path.insert(0, WEBAPP_DIR)
+    from app import app, precompile_templates, warm_up
+
+    host, _, port = bind.rpartition(":")
+    precompile_templates()
+    if warm:
+        print(f"Warmed up: {warm_up(verification=os.getenv('WARM_VERIFY_INDEX', '1') == '1')}")
+    print("gunicorn is not available; serving with Werkzeug's threaded server (one process).")
+    run_simple(host or "0.0.0.0", int(port), app, threaded=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bind", help="HOST:PORT (default 0.0.0.0:$PORT or 5000)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU cores)")
+    parser.add_argument("--threads", type=int, help="threads per worker (default 8)")
+    parser.add_argument("--timeout", type=int, help="seconds before a stuck worker is restarted")
+    parser.add_argument("--max-requests", type=int, help="recycle workers after this many requests")
+    parser.add_argument("--no-preload", action="store_true", help="import the app in each worker instead")
+    parser.add_argument("--no-warm-up", action="store_true", help="skip the per-worker cache warm-up")
+    parser.add_argument("--print-config", action="store_true")
+    args = parser.parse_args()
+
+    apply_options(args)
+    if args.print_config:
+        for name, value in resolved_config().items():
+            print(f"{name} = {value!r}")
+        print(f"server = {'gunicorn' if gunicorn_available() else 'werkzeug (threaded, one process)'}")
+        return
+    if gunicorn_available():
+        serve_gunicorn()
+    else:
+        config = resolved_config()
+        serve_werkzeug(config["bind"], config["WARM_UP"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Login state: a cached profile/role lookup and an optional server-side session store.
+
+Profile cache
+    Logging in used to cost two round trips: Supabase Auth, then a `profiles`
+    query for the role. `ProfileCache.role(email)` remembers each user's role
+    for `ttl_seconds`, so a warm login is the auth call alone, and guarded
+    routes check the role from memory instead of trusting the copy frozen into
+    the session at login. A role changed in `profiles` takes effect within
+    the TTL, or at once on this worker after `invalidate(email)`.
+
+Server-side sessions
+    Flask's default session is a cookie signed with SECRET_KEY, so every
+    worker must share that key. With SESSION_STORE set, the cookie holds only
+    a random session id and the session data lives in a store:
+
+    - "memory": an in-process stand-in for Redis. One worker only, and
+      sessions are lost on restart; meant for development and tests.
+    - "sqlite": one WAL-mode SQLite file (SESSION_SQLITE_PATH) shared by every
+      worker on the host, so any worker can serve any request.
+
+    Stores implement get/set/delete, which is all a Redis-backed store would
+    need. An entry expires `ttl_seconds` after its last write. Unchanged
+    sessions are only rewritten once half the TTL has passed, so reads do not
+    turn into writes.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from data_access import execute
+
+SESSION_STORES = ("cookie", "memory", "sqlite")
+
+WEBAPP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SESSION_SQLITE_PATH = os.path.join(WEBAPP_DIR, "sessions.db")
+
+# Expired rows are purged from the SQLite store once every this many writes
+PURGE_EVERY = 500
+
+# Marker stored for users without a profile row
+NO_PROFILE = None
+
+
+class ProfileCache:
+
+    def __init__(self, client, ttl_seconds=300, max_entries=50_000):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # email -> (expires_at, role or NO_PROFILE)
+        self._roles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _fetch(self, email):
+        rows = execute(self.client.table("profiles").select("role").eq("email", email).limit(1)).data or []
+        return rows[0]["role"] if rows else NO_PROFILE
+
+    def role(self, email, default=None):
+        """The user's role from `profiles`, cached; `default` if it cannot be looked up right now."""
+        with self._lock:
+            entry = self._roles.get(email)
+            if entry is not None and entry[0] > time.monotonic():
+                self._roles.move_to_end(email)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        try:
+            role = self._fetch(email)
+        except Exception as e:
+            print(f"Profile lookup for {email} failed: {e}")
+            return default
+        self.put(email, role)
+        return role
+
+    def put(self, email, role):
+        with self._lock:
+            self._roles[email] = (time.monotonic() + self.ttl_seconds, role)
+            self._roles.move_to_end(email)
+            while len(self._roles) > self.max_entries:
+                self._roles.popitem(last=False)
+
+    def invalidate(self, email=None):
+        with self._lock:
+            if email is None:
+                self._roles.clear()
+            else:
+                self._roles.pop(email, None)
+
+    def stats(self):
+        return {"profiles": len(self._roles), "hits": self.hits, "misses": self.misses}
+
+
+# -------------------------------
+# Session stores
+# -------------------------------
+class MemorySessionStore:
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # sid -> (expires_at, written_at, data)
+        self._sessions = OrderedDict()
+
+    def get(self, sid):
+        """Returns (data, written_at) or None if the session is unknown or expired."""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            expires_at, written_at, data = entry
+            if expires_at < time.time():
+                del self._sessions[sid]
+                return None
+            return data, written_at
+
+    def set(self, sid, data, ttl_seconds):
+        now = time.time()
+        with self._lock:
+            self._sessions[sid] = (now + ttl_seconds, now, data)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def stats(self):
+        return {"store": "memory", "sessions": len(self._sessions)}
+
+
+class SQLiteSessionStore:
+
+    def __init__(self, path=DEFAULT_SESSION_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self.connection().execute("""
+            create table if not exists sessions (
+                sid text primary key,
+                data text not null,
+                written_at real not null,
+                expires_at real not null
+            )
+        """)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        # Not shared with a forked worker (gunicorn preload)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode = wal")
+            conn.execute("pragma synchronous = normal")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid):
+        row = self.connection().execute(
+            "select data, written_at from sessions where sid = ? and expires_at >= ?", (sid, time.time())).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, sid, data, ttl_seconds):
+        now = time.time()
+        conn = self.connection()
+        conn.execute(
+            """insert into sessions (sid, data, written_at, expires_at) values (?, ?, ?, ?)
+               on conflict (sid) do update set
+                   data = excluded.data, written_at = excluded.written_at, expires_at = excluded.expires_at""",
+            (sid, data, now, now + ttl_seconds))
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute("delete from sessions where expires_at < ?", (now,))
+
+    def delete(self, sid):
+        self.connection().execute("delete from sessions where sid = ?", (sid,))
+
+    def stats(self):
+        count = self.connection().execute("select count(*) from sessions where expires_at >= ?", (time.time(),))
+        return {"store": "sqlite", "sessions": count.fetchone()[0]}
+
+
+def create_session_store(kind=None):
+    """The store named by SESSION_STORE, or None for Flask's signed-cookie sessions."""
+    kind = (kind or os.getenv("SESSION_STORE", "cookie")).lower()
+    if kind not in SESSION_STORES:
+        raise ValueError(f"SESSION_STORE must be one of {', '.join(SESSION_STORES)}, got {kind!r}")
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_SQLITE_PATH", DEFAULT_SESSION_SQLITE_PATH))
+    return None
+
+
+# -------------------------------
+# Flask session interface
+# -------------------------------
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False, written_at=None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.written_at = written_at
+        self.modified = False
+        # Set by rotate_session_id(); the old id is deleted on save
+        self.previous_sid = None
+
+
+def rotate_session_id(session):
+    """Gives a server-side session a fresh id (call on login to prevent session fixation)."""
+    if isinstance(session, ServerSession):
+        session.previous_sid = session.previous_sid or session.sid
+        session.sid = secrets.token_urlsafe(32)
+        session.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl_seconds=12 * 3600):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            entry = self.store.get(sid)
+            if entry is not None:
+                data, written_at = entry
+                try:
+                    return ServerSession(self.serializer.loads(data), sid=sid, written_at=written_at)
+                except ValueError:
+                    pass
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        stale = session.written_at is None or time.time() - session.written_at > self.ttl_seconds / 2
+        if not (session.modified or stale):
+            return
+        self.store.set(session.sid, self.serializer.dumps(dict(session)), self.ttl_seconds)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path,
+        )
@@ -0,0 +1,13 @@
+-- Lets PostgREST embed a serial's batch in the same response:
+--   AMOXICILLIN_SERIAL?select=serial_no,batch_number,AMOXICILLIN_BATCH(batch_number,manufacturer,expiry_date)
+-- Run once in the Supabase SQL editor. verify_cache.py falls back to a second
+-- query per serial if this relationship is missing.
+
+alter table "AMOXICILLIN_BATCH"
+    add constraint amoxicillin_batch_batch_number_key unique (batch_number);
+
+alter table "AMOXICILLIN_SERIAL"
+    add constraint amoxicillin_serial_batch_number_fkey
+    foreign key (batch_number) references "AMOXICILLIN_BATCH" (batch_number);
+
+create index if not exists amoxicillin_serial_serial_no_idx on "AMOXICILLIN_SERIAL" (serial_no);
@@ -0,0 +1,33 @@
+-- Per-serial aggregation for the verification query report (/api/report GET).
+-- Called from app.py as supabase.rpc("pharmlogs_report", {"start_ts": ..., "end_ts": ...}).
+-- Returns one row per distinct serial, so the response size no longer grows
+-- with the number of raw pharmlogs rows. app.py falls back to aggregating in
+-- Python if this function is not installed.
+
+create index if not exists pharmlogs_timestamp_idx on pharmlogs ("timestamp");
+
+create or replace function pharmlogs_report(start_ts timestamp, end_ts timestamp)
+returns table (
+    serial text,
+    total_queries bigint,
+    authentic_count bigint,
+    counterfeit_count bigint,
+    expired_count bigint,
+    other_count bigint,
+    last_query_timestamp text
+)
+language sql stable
+as $$
+    select
+        serial,
+        count(*) as total_queries,
+        count(*) filter (where upper(status) = 'AUTHENTIC') as authentic_count,
+        count(*) filter (where upper(status) = 'COUNTERFEIT') as counterfeit_count,
+        count(*) filter (where upper(status) = 'EXPIRED') as expired_count,
+        count(*) filter (where upper(status) not in ('AUTHENTIC', 'COUNTERFEIT', 'EXPIRED')) as other_count,
+        to_char(max("timestamp"), 'YYYY-MM-DD HH24:MI:SS') as last_query_timestamp
+    from pharmlogs
+    where "timestamp" >= start_ts and "timestamp" <= end_ts
+    group by serial
+    order by serial;
+$$;
@@ -0,0 +1,74 @@
+-- Daily rollups of verification activity, keyed by (day, serial, status).
+-- Kept current by a trigger on pharmlogs, so every insert (including the
+-- batched inserts from log_queue.py) bumps its day's counter. /api/report sums
+-- closed days from here through pharmlogs_rollup_report and only scans raw
+-- pharmlogs rows for today.
+
+create table if not exists pharmlogs_daily (
+    day date not null,
+    serial text not null,
+    status text not null,            -- upper-cased pharmlogs.status
+    query_count bigint not null default 0,
+    last_query_timestamp timestamp,
+    primary key (day, serial, status)
+);
+
+create or replace function pharmlogs_daily_bump()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into pharmlogs_daily as d (day, serial, status, query_count, last_query_timestamp)
+    values (new."timestamp"::date, new.serial, upper(new.status), 1, new."timestamp")
+    on conflict (day, serial, status) do update
+        set query_count = d.query_count + 1,
+            last_query_timestamp = greatest(d.last_query_timestamp, excluded.last_query_timestamp);
+    return new;
+end;
+$$;
+
+drop trigger if exists pharmlogs_daily_bump on pharmlogs;
+create trigger pharmlogs_daily_bump
+    after insert on pharmlogs
+    for each row execute function pharmlogs_daily_bump();
+
+-- Compaction / backfill: rebuilds the rollups for [from_day, to_day] from raw rows.
+-- Run once after creating the table, and again if pharmlogs rows are edited or deleted.
+create or replace function pharmlogs_daily_rebuild(from_day date, to_day date)
+returns void
+language sql
+as $$
+    delete from pharmlogs_daily where day between from_day and to_day;
+    insert into pharmlogs_daily (day, serial, status, query_count, last_query_timestamp)
+    select "timestamp"::date, serial, upper(status), count(*), max("timestamp")
+    from pharmlogs
+    where "timestamp"::date between from_day and to_day
+    group by 1, 2, 3;
+$$;
+
+-- Same columns as pharmlogs_report, computed from the rollups instead of raw rows.
+create or replace function pharmlogs_rollup_report(start_day date, end_day date)
+returns table (
+    serial text,
+    total_queries bigint,
+    authentic_count bigint,
+    counterfeit_count bigint,
+    expired_count bigint,
+    other_count bigint,
+    last_query_timestamp text
+)
+language sql stable
+as $$
+    select
+        serial,
+        sum(query_count)::bigint as total_queries,
+        coalesce(sum(query_count) filter (where status = 'AUTHENTIC'), 0)::bigint as authentic_count,
+        coalesce(sum(query_count) filter (where status = 'COUNTERFEIT'), 0)::bigint as counterfeit_count,
+        coalesce(sum(query_count) filter (where status = 'EXPIRED'), 0)::bigint as expired_count,
+        coalesce(sum(query_count) filter (where status not in ('AUTHENTIC', 'COUNTERFEIT', 'EXPIRED')), 0)::bigint as other_count,
+        to_char(max(last_query_timestamp), 'YYYY-MM-DD HH24:MI:SS') as last_query_timestamp
+    from pharmlogs_daily
+    where day between start_day and end_day
+    group by serial
+    order by serial;
+$$;
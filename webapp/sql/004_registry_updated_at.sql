@@ -0,0 +1,30 @@
+-- Change tracking for the batch and serial registries, used by the local
+-- verification replica (replica.py) to pull only rows changed since its last sync:
+--   AMOXICILLIN_BATCH?updated_at=gte.<cursor>&order=updated_at,batch_number
+-- Without this column the replica falls back to full copies.
+
+alter table "AMOXICILLIN_BATCH" add column if not exists updated_at timestamptz not null default now();
+alter table "AMOXICILLIN_SERIAL" add column if not exists updated_at timestamptz not null default now();
+
+create or replace function touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+drop trigger if exists amoxicillin_batch_touch on "AMOXICILLIN_BATCH";
+create trigger amoxicillin_batch_touch
+    before update on "AMOXICILLIN_BATCH"
+    for each row execute function touch_updated_at();
+
+drop trigger if exists amoxicillin_serial_touch on "AMOXICILLIN_SERIAL";
+create trigger amoxicillin_serial_touch
+    before update on "AMOXICILLIN_SERIAL"
+    for each row execute function touch_updated_at();
+
+create index if not exists amoxicillin_batch_updated_at_idx on "AMOXICILLIN_BATCH" (updated_at, batch_number);
+create index if not exists amoxicillin_serial_updated_at_idx on "AMOXICILLIN_SERIAL" (updated_at, serial_no);
@@ -0,0 +1,9 @@
+-- Lets the bulk importer (record_import.py) upsert serials by their number:
+--   POST AMOXICILLIN_SERIAL?on_conflict=serial_no  (Prefer: resolution=merge-duplicates)
+-- Run once in the Supabase SQL editor after removing any duplicate serial_no rows.
+-- The unique index also serves serial lookups, so the plain index from 001 can go.
+
+alter table "AMOXICILLIN_SERIAL"
+    add constraint amoxicillin_serial_serial_no_key unique (serial_no);
+
+drop index if exists amoxicillin_serial_serial_no_idx;
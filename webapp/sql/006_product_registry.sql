@@ -0,0 +1,83 @@
+-- Multi-product registry: one pair of batch/serial tables for every product,
+-- replacing the per-drug AMOXICILLIN_BATCH / AMOXICILLIN_SERIAL tables.
+--   product_batches?batch_number=eq.<code>
+--   product_serials?select=...,product_batches(...)&serial_no=eq.<code>
+-- A scan carries no product, so batch and serial numbers are unique across the
+-- whole registry; verifying a code stays one unique-index probe per table no
+-- matter how many products are registered. Each row names its product, and a
+-- serial's batch must belong to the same product.
+-- Run once in the Supabase SQL editor (after 004). The AMOXICILLIN tables are
+-- copied and left in place; drop them once the copy has been checked.
+
+create table if not exists products (
+    id bigint generated by default as identity primary key,
+    code text not null unique,
+    name text not null,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create table if not exists product_batches (
+    id bigint generated by default as identity primary key,
+    product_code text not null references products (code),
+    batch_number text not null,
+    manufacturer text,
+    manufacture_date date,
+    expiry_date date,
+    delivery_date timestamp,
+    source_distributor text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    constraint product_batches_batch_number_key unique (batch_number),
+    -- Target of the serial -> batch foreign key
+    constraint product_batches_product_batch_key unique (product_code, batch_number)
+);
+
+create table if not exists product_serials (
+    id bigint generated by default as identity primary key,
+    product_code text not null references products (code),
+    serial_no text not null,
+    strength_form text,
+    units_per_pack integer,
+    packs_per_box integer,
+    pack_type text,
+    batch_number text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    constraint product_serials_serial_no_key unique (serial_no),
+    constraint product_serials_batch_fkey foreign key (product_code, batch_number)
+        references product_batches (product_code, batch_number)
+);
+
+create index if not exists product_batches_product_code_idx on product_batches (product_code);
+create index if not exists product_serials_product_batch_idx on product_serials (product_code, batch_number);
+create index if not exists product_batches_updated_at_idx on product_batches (updated_at, batch_number);
+create index if not exists product_serials_updated_at_idx on product_serials (updated_at, serial_no);
+
+-- touch_updated_at() comes from 004
+drop trigger if exists product_batches_touch on product_batches;
+create trigger product_batches_touch
+    before update on product_batches
+    for each row execute function touch_updated_at();
+
+drop trigger if exists product_serials_touch on product_serials;
+create trigger product_serials_touch
+    before update on product_serials
+    for each row execute function touch_updated_at();
+
+-- Existing data
+insert into products (code, name) values ('AMOXICILLIN', 'Amoxicillin')
+on conflict (code) do nothing;
+
+insert into product_batches (product_code, batch_number, manufacturer, manufacture_date, expiry_date,
+                             delivery_date, source_distributor, created_at)
+select 'AMOXICILLIN', batch_number, manufacturer, manufacture_date::date, expiry_date::date,
+       delivery_date::timestamp, source_distributor, created_at
+from "AMOXICILLIN_BATCH"
+on conflict (batch_number) do nothing;
+
+insert into product_serials (product_code, serial_no, strength_form, units_per_pack, packs_per_box,
+                             pack_type, batch_number, created_at)
+select 'AMOXICILLIN', serial_no, strength_form, units_per_pack, packs_per_box, pack_type, batch_number, created_at
+from "AMOXICILLIN_SERIAL"
+on conflict (serial_no) do nothing;
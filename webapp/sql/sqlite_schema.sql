@@ -0,0 +1,95 @@
+-- Local SQLite schema for STORAGE_BACKEND=sqlite (see storage.py).
+-- Mirrors the Supabase tables app.py uses, plus sql/001-006: the product registry with its
+-- serial->batch foreign key, the pharmlogs_daily rollups with their insert trigger, and the
+-- indexes behind /api/verify and the report date ranges.
+-- Timestamps are stored as naive UTC ISO-8601 text so range filters compare as strings.
+
+create table if not exists products (
+    id integer primary key,
+    code text not null unique,
+    name text not null,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+insert or ignore into products (code, name) values ('AMOXICILLIN', 'Amoxicillin');
+
+create table if not exists product_batches (
+    id integer primary key,
+    product_code text not null references products (code),
+    batch_number text not null unique,
+    manufacturer text,
+    manufacture_date text,
+    expiry_date text,
+    delivery_date text,
+    source_distributor text,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    unique (product_code, batch_number)
+);
+
+create table if not exists product_serials (
+    id integer primary key,
+    product_code text not null references products (code),
+    serial_no text not null unique,
+    strength_form text,
+    units_per_pack integer,
+    packs_per_box integer,
+    pack_type text,
+    batch_number text,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    foreign key (product_code, batch_number) references product_batches (product_code, batch_number)
+);
+create index if not exists product_serials_product_batch_idx on product_serials (product_code, batch_number);
+
+create table if not exists pharmlogs (
+    id integer primary key,
+    user_id text,
+    serial text,
+    status text,
+    "timestamp" text not null
+);
+create index if not exists pharmlogs_timestamp_idx on pharmlogs ("timestamp", id);
+
+create table if not exists pharmlogs_daily (
+    day text not null,
+    serial text not null,
+    status text not null,
+    query_count integer not null default 0,
+    last_query_timestamp text,
+    primary key (day, serial, status)
+) without rowid;
+
+create trigger if not exists pharmlogs_daily_bump after insert on pharmlogs
+begin
+    insert into pharmlogs_daily (day, serial, status, query_count, last_query_timestamp)
+    values (substr(new."timestamp", 1, 10), new.serial, upper(new.status), 1, new."timestamp")
+    on conflict (day, serial, status) do update
+        set query_count = query_count + 1,
+            last_query_timestamp = max(last_query_timestamp, excluded.last_query_timestamp);
+end;
+
+create table if not exists report_page (
+    id integer primary key,
+    product_name text,
+    batch_serial text,
+    location text,
+    description text,
+    name text,
+    email text,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+create index if not exists report_page_created_at_idx on report_page (created_at, id);
+
+create table if not exists profiles (
+    id integer primary key,
+    user_id text unique,
+    email text unique,
+    license text,
+    role text not null default 'Pharmacist'
+);
+
+-- Local stand-in for Supabase Auth
+create table if not exists auth_users (
+    id text primary key,
+    email text not null unique,
+    password_hash text not null,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
@@ -76,22 +76,15 @@ const renderResult = (serial, result) => {
   const resultsArea = document.getElementById("results-area");
   resultsArea.innerHTML = "";
 
-  const now = new Date();
-  const logEntry = {
-    serial: serial,
-    timestamp: now.toISOString(),
-    status: result.status,
-    userId: result.user,
-  };
-
   let message, className;
   let detailsHtml = "";
 
   if (result.status === "AUTHENTIC") {
-    message = `✅ VERIFIED: This Amoxicillin ${result.serial?'Serial Number':'Batch Number'} is Authentic and Valid.`;
+    message = `✅ VERIFIED: This ${result.productName || 'product'} ${result.serial?'Serial Number':'Batch Number'} is Authentic and Valid.`;
     className = "result-authentic";
     detailsHtml = `
                     <li><strong>Status:</strong> Authentic and Safe</li>
+                    <li><strong>Product:</strong> ${result.productName || result.product}</li>
                     <li><strong>Expiry Date:</strong> ${result.expiryDate}</li>
                     <li><strong>Batch Number:</strong> ${result.batch}</li>
                     ${
@@ -104,10 +97,11 @@ const renderResult = (serial, result) => {
                     }</li>
                 `;
   } else if (result.status === "EXPIRED") {
-    message = `⚠️ WARNING: This Amoxicillin ${result.serial?'Serial Number':'Batch Number'} is Expired. Do Not Dispense.`;
+    message = `⚠️ WARNING: This ${result.productName || 'product'} ${result.serial?'Serial Number':'Batch Number'} is Expired. Do Not Dispense.`;
     className = "result-expired";
     detailsHtml = `
                     <li><strong>Status:</strong> EXPIRED!</li>
+                    <li><strong>Product:</strong> ${result.productName || result.product}</li>
                     <li><strong>Expiry Date:</strong> ${
                       result.expiryDate
                     } (Past Date)</li>
@@ -141,6 +135,11 @@ const renderResult = (serial, result) => {
     // `;
   }
 
+  // Answered from the pharmacy's local registry copy: show how current it is
+  if (result.dataAsOf) {
+    detailsHtml += `<li><strong>Registry data as of:</strong> ${new Date(result.dataAsOf).toLocaleString()}</li>`;
+  }
+
   const messageDiv = document.createElement("div");
   messageDiv.className = `result-message ${className}`;
   messageDiv.textContent = message;
@@ -157,23 +156,7 @@ const renderResult = (serial, result) => {
     messageDiv.classList.add("visible");
   }, 50);
 
-  // Log the transaction to Firestore (Objective iii: Audit Logging)
-  logTransaction(logEntry);
-};
-
-const logTransaction = (logEntry) => {
-  fetch("/api/log", {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json"
-    },
-    body: JSON.stringify(logEntry)
-  })
-  .then(res => res.json())
-  .then(data => {
-    if (!data.success) console.warn("Log not saved:", data.error);
-  })
-  .catch(err => console.error("Error logging transaction:", err));
+  // Audit logging (Objective iii) happens server-side in /api/verify
 };
 
 
@@ -0,0 +1,513 @@
+"""
+Pluggable storage backend.
+
+app.py, verify_cache.py and log_queue.py talk to storage through the
+PostgREST-style query builder of the Supabase client (`client.table(...)
+.select(...).eq(...)`, `client.rpc(...)`, `client.auth`). `create_storage_client()`
+returns either:
+
+- "supabase" (default): the pooled Supabase client from data_access.py, or
+- "sqlite": `SQLiteStore`, a local database (sql/sqlite_schema.sql) that
+  answers the same builder calls the app makes, including the report RPCs,
+  the serial->batch embed and a local stand-in for Supabase Auth.
+
+The SQLite backend lets a pharmacy with poor connectivity run entirely locally,
+and lets the app be load-tested without the live service:
+
+    STORAGE_BACKEND=sqlite SQLITE_PATH=/var/lib/pharmacheck/pharmacheck.db
+
+Only the subset of PostgREST the app uses is implemented; anything else raises
+postgrest's APIError like an unsupported request would.
+"""
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from data_access import create_pooled_client
+from errors import api_error
+
+BACKENDS = ("supabase", "sqlite")
+
+WEBAPP_DIR = os.path.dirname(os.path.abspath(__file__))
+SQLITE_SCHEMA = os.path.join(WEBAPP_DIR, "sql", "sqlite_schema.sql")
+DEFAULT_SQLITE_PATH = os.path.join(WEBAPP_DIR, "pharmacheck.db")
+
+# Stored as naive UTC ISO text, the way a `timestamp` column would hold them
+TIMESTAMP_COLUMNS = {
+    "pharmlogs": {"timestamp"},
+    "report_page": {"created_at"},
+}
+
+# Many-to-one embeds: (table, embedded table) -> (local column, remote column)
+RELATIONSHIPS = {
+    ("product_serials", "product_batches"): ("batch_number", "batch_number"),
+}
+
+# sql/002 and sql/003 in SQLite; run as a subquery so .range() paging applies
+RPC_FUNCTIONS = {
+    "pharmlogs_report": ("""
+        select
+            serial,
+            count(*) as total_queries,
+            sum(upper(status) = 'AUTHENTIC') as authentic_count,
+            sum(upper(status) = 'COUNTERFEIT') as counterfeit_count,
+            sum(upper(status) = 'EXPIRED') as expired_count,
+            sum(upper(status) not in ('AUTHENTIC', 'COUNTERFEIT', 'EXPIRED')) as other_count,
+            replace(substr(max("timestamp"), 1, 19), 'T', ' ') as last_query_timestamp
+        from pharmlogs
+        where "timestamp" >= :start_ts and "timestamp" <= :end_ts
+        group by serial
+    """, ("start_ts", "end_ts")),
+    "pharmlogs_rollup_report": ("""
+        select
+            serial,
+            sum(query_count) as total_queries,
+            sum(iif(status = 'AUTHENTIC', query_count, 0)) as authentic_count,
+            sum(iif(status = 'COUNTERFEIT', query_count, 0)) as counterfeit_count,
+            sum(iif(status = 'EXPIRED', query_count, 0)) as expired_count,
+            sum(iif(status not in ('AUTHENTIC', 'COUNTERFEIT', 'EXPIRED'), query_count, 0)) as other_count,
+            replace(substr(max(last_query_timestamp), 1, 19), 'T', ' ') as last_query_timestamp
+        from pharmlogs_daily
+        where day between :start_day and :end_day
+        group by serial
+    """, ("start_day", "end_day")),
+}
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+EMBED = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\((.*)\)$")
+
+FILTER_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+PASSWORD_HASH_ITERATIONS = 200_000
+
+
+def create_storage_client(backend=None):
+    """Storage client for STORAGE_BACKEND (or `backend`)."""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "supabase")).lower()
+    if backend == "supabase":
+        return create_pooled_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    if backend == "sqlite":
+        return SQLiteStore(os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+class LazyClient:
+    """
+    Stands in for a storage client and creates it on first use.
+
+    The app module builds all of its components around one client at import
+    time; behind this proxy, importing the app (a container cold start, the
+    gunicorn master) neither imports the Supabase client libraries nor opens
+    a connection pool. The first query, from a request or a worker's warm-up,
+    does both.
+    """
+
+    def __init__(self, factory=create_storage_client):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return client
+
+    @property
+    def created(self):
+        return self._client is not None
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+class Response:
+    """What postgrest's execute() returns: `.data` (and `.count`)."""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _quote(name):
+    if not IDENTIFIER.match(name):
+        raise api_error({"code": "42703", "message": f"invalid column or table name {name!r}"})
+    return f'"{name}"'
+
+
+def normalize_timestamp(value):
+    """ISO string or datetime -> naive UTC ISO string (values that do not parse are kept as-is)."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+
+def _sqlite_api_error(e):
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        code = "23503" if "FOREIGN KEY" in message else "23505" if "UNIQUE" in message else "23502"
+    elif "no such column" in message:
+        code = "42703"
+    else:
+        code = "XX000"
+    return api_error({"code": code, "message": message, "hint": None, "details": None})
+
+
+def _split_top_level(text):
+    """Splits a PostgREST logic expression on commas outside quotes and parentheses."""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+class SQLiteQuery:
+    """The part of postgrest's request builder the app uses, compiled to one SQL statement."""
+
+    def __init__(self, store, table, source=None, source_params=None):
+        self.store = store
+        self.table = table
+        # Tables are selected from directly; RPCs from their function body
+        self.source = source or _quote(table)
+        self.params = dict(source_params or {})
+        self.operation = "select"
+        self.columns = ["*"]
+        self.embeds = []
+        self.where = []
+        self.ordering = []
+        self.limit_count = None
+        self.offset = None
+        self.single_row = False
+        self.payload = None
+        self.on_conflict = None
+
+    # --- builder ---
+    def select(self, columns="*", **kwargs):
+        self.columns, self.embeds = [], []
+        for part in _split_top_level(columns):
+            embed = EMBED.match(part)
+            if embed:
+                self.embeds.append((embed.group(1), [c.strip() for c in embed.group(2).split(",")]))
+            else:
+                self.columns.append(part)
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.operation, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict="", **kwargs):
+        self.operation, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        return self
+
+    def _column(self, name):
+        """Quoted column name. Unknown columns raise like PostgREST (SQLite would read them as string literals)."""
+        quoted = _quote(name)
+        columns = self.store.table_columns(self.table)
+        if columns is not None and name not in columns:
+            raise api_error({"code": "42703", "message": f"column {self.table}.{name} does not exist"})
+        return quoted
+
+    def _value(self, column, value):
+        if column in TIMESTAMP_COLUMNS.get(self.table, ()):
+            value = normalize_timestamp(value)
+        key = f"p{len(self.params)}"
+        self.params[key] = value
+        return f":{key}"
+
+    def _compare(self, column, op, value):
+        return f"{self._column(column)} {FILTER_OPERATORS[op]} {self._value(column, value)}"
+
+    def eq(self, column, value):
+        self.where.append(self._compare(column, "eq", value))
+        return self
+
+    def neq(self, column, value):
+        self.where.append(self._compare(column, "neq", value))
+        return self
+
+    def gt(self, column, value):
+        self.where.append(self._compare(column, "gt", value))
+        return self
+
+    def gte(self, column, value):
+        self.where.append(self._compare(column, "gte", value))
+        return self
+
+    def lt(self, column, value):
+        self.where.append(self._compare(column, "lt", value))
+        return self
+
+    def lte(self, column, value):
+        self.where.append(self._compare(column, "lte", value))
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.where.append("0")
+        else:
+            self.where.append(f"{self._column(column)} in ({', '.join(self._value(column, v) for v in values)})")
+        return self
+
+    def or_(self, filters, **kwargs):
+        self.where.append(self._logic("or", filters))
+        return self
+
+    def _logic(self, joiner, expression):
+        terms = []
+        for term in _split_top_level(expression):
+            nested = re.match(r"^(and|or)\((.*)\)$", term)
+            if nested:
+                terms.append(self._logic(nested.group(1), nested.group(2)))
+                continue
+            column, op, value = term.split(".", 2)
+            if op == "is" and value == "null":
+                terms.append(f"{self._column(column)} is null")
+            elif op in FILTER_OPERATORS:
+                terms.append(self._compare(column, op, _unquote(value)))
+            else:
+                raise api_error({"code": "PGRST100", "message": f"unsupported filter operator {op!r}"})
+        return "(" + f" {joiner} ".join(terms) + ")"
+
+    def order(self, column, desc=False, nullsfirst=None, **kwargs):
+        direction = "desc" if desc else "asc"
+        if nullsfirst is not None:
+            direction += " nulls first" if nullsfirst else " nulls last"
+        self.ordering.append(f"{self._column(column)} {direction}")
+        return self
+
+    def limit(self, size, **kwargs):
+        self.limit_count = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset, self.limit_count = start, end - start + 1
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    # --- execution ---
+    def execute(self):
+        try:
+            if self.operation == "select":
+                return self._execute_select()
+            return self._execute_write()
+        except sqlite3.Error as e:
+            raise _sqlite_api_error(e)
+
+    def _execute_select(self):
+        columns = ", ".join("*" if c == "*" else self._column(c) for c in self.columns) or "*"
+        # Embedded rows are joined on this column, so make sure it is selected
+        extra = []
+        for embed_table, _ in self.embeds:
+            local, _ = self._relationship(embed_table)
+            if "*" not in self.columns and local not in self.columns:
+                extra.append(local)
+        if extra:
+            columns += ", " + ", ".join(self._column(c) for c in extra)
+
+        sql = f"select {columns} from {self.source}"
+        if self.where:
+            sql += " where " + " and ".join(self.where)
+        if self.ordering:
+            sql += " order by " + ", ".join(self.ordering)
+        if self.limit_count is not None or self.offset:
+            sql += f" limit {int(self.limit_count if self.limit_count is not None else -1)}"
+            if self.offset:
+                sql += f" offset {int(self.offset)}"
+
+        rows = [dict(row) for row in self.store.connection().execute(sql, self.params)]
+        for embed_table, embed_columns in self.embeds:
+            self._attach(rows, embed_table, embed_columns)
+        for row in rows:
+            for column in extra:
+                row.pop(column, None)
+
+        if self.single_row:
+            if len(rows) != 1:
+                raise api_error({"code": "PGRST116", "message": f"JSON object requested, {len(rows)} rows returned"})
+            return Response(rows[0])
+        return Response(rows)
+
+    def _relationship(self, embed_table):
+        relationship = RELATIONSHIPS.get((self.table, embed_table))
+        if relationship is None:
+            raise api_error({"code": "PGRST200",
+                            "message": f"Could not find a relationship between '{self.table}' and '{embed_table}'"})
+        return relationship
+
+    def _attach(self, rows, embed_table, embed_columns):
+        """Many-to-one embed with one `in` query for all parent keys."""
+        local, remote = self._relationship(embed_table)
+        keys = list({row[local] for row in rows if row.get(local) is not None})
+        parents = {}
+        if keys:
+            wanted = ["*"] if "*" in embed_columns else list(dict.fromkeys(embed_columns + [remote]))
+            query = SQLiteQuery(self.store, embed_table).select(", ".join(wanted)).in_(remote, keys)
+            for parent in query.execute().data:
+                parents[parent[remote]] = parent
+        for row in rows:
+            parent = parents.get(row.get(local))
+            if parent is not None and "*" not in embed_columns and remote not in embed_columns:
+                parent = {k: v for k, v in parent.items() if k != remote}
+            row[embed_table] = parent
+
+    def _execute_write(self):
+        records = self.payload if isinstance(self.payload, list) else [self.payload]
+        timestamp_columns = TIMESTAMP_COLUMNS.get(self.table, ())
+        inserted = []
+        conn = self.store.connection()
+        with self.store.write_lock:
+            conn.execute("begin immediate")
+            try:
+                for record in records:
+                    record = {k: (normalize_timestamp(v) if k in timestamp_columns else v) for k, v in record.items()}
+                    names = ", ".join(self._column(k) for k in record)
+                    placeholders = ", ".join(f":{i}" for i in range(len(record)))
+                    values = {str(i): v for i, v in enumerate(record.values())}
+                    sql = f"insert into {self.source} ({names}) values ({placeholders})"
+                    if self.operation == "upsert":
+                        conflict = [c.strip() for c in self.on_conflict.split(",") if c.strip()] or ["id"]
+                        updates = [k for k in record if k not in conflict]
+                        sql += f" on conflict ({', '.join(self._column(c) for c in conflict)}) do "
+                        sql += ("update set " + ", ".join(f"{self._column(k)} = excluded.{self._column(k)}" for k in updates)
+                                if updates else "nothing")
+                    sql += " returning *"
+                    inserted.extend(dict(row) for row in conn.execute(sql, values))
+                conn.execute("commit")
+            except BaseException:
+                conn.execute("rollback")
+                raise
+        return Response(inserted)
+
+
+class LocalAuth:
+    """Email/password sign-up and sign-in against the local auth_users table."""
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def hash_password(password, salt=None):
+        salt = salt or secrets.token_hex(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), PASSWORD_HASH_ITERATIONS)
+        return f"pbkdf2_sha256${PASSWORD_HASH_ITERATIONS}${salt}${digest.hex()}"
+
+    @staticmethod
+    def check_password(password, password_hash):
+        _, iterations, salt, digest = password_hash.split("$")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), int(iterations))
+        return hmac.compare_digest(candidate.hex(), digest)
+
+    def sign_up(self, credentials):
+        user = SimpleNamespace(id=str(uuid.uuid4()), email=credentials["email"])
+        self.store.table("auth_users").insert({
+            "id": user.id,
+            "email": user.email,
+            "password_hash": self.hash_password(credentials["password"]),
+        }).execute()
+        return SimpleNamespace(user=user, session=None)
+
+    def sign_in_with_password(self, credentials):
+        rows = self.store.table("auth_users").select("id, email, password_hash") \
+            .eq("email", credentials["email"]).execute().data
+        if not rows or not self.check_password(credentials["password"], rows[0]["password_hash"]):
+            raise api_error({"code": "invalid_credentials", "message": "Invalid login credentials"})
+        user = SimpleNamespace(id=rows[0]["id"], email=rows[0]["email"])
+        return SimpleNamespace(user=user, session=None)
+
+
+class SQLiteStore:
+    """
+    Local storage backend with the Supabase client's `table()` / `rpc()` / `auth` surface.
+
+    Each thread gets its own connection (WAL mode, so readers never wait for the
+    log flusher); writes are serialised with `write_lock`.
+    """
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, foreign_keys=True):
+        self.path = path
+        self.foreign_keys = foreign_keys
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        self._columns = {}
+        self.auth = LocalAuth(self)
+        with open(SQLITE_SCHEMA) as f:
+            self.connection().executescript(f.read())
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection opened before a fork (gunicorn preload) must not be used by the worker
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("pragma journal_mode = wal")
+            conn.execute("pragma synchronous = normal")
+            conn.execute(f"pragma foreign_keys = {'on' if self.foreign_keys else 'off'}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def table_columns(self, table):
+        """Column names of a table, or None if there is no such table (e.g. an RPC subquery)."""
+        columns = self._columns.get(table)
+        if columns is None:
+            columns = {row["name"] for row in self.connection().execute("select name from pragma_table_info(?)", (table,))}
+            if not columns:
+                return None
+            self._columns[table] = columns
+        return columns
+
+    def table(self, name):
+        return SQLiteQuery(self, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, name, params=None):
+        if name not in RPC_FUNCTIONS:
+            raise api_error({"code": "PGRST202", "message": f"Could not find the function public.{name}"})
+        body, expected = RPC_FUNCTIONS[name]
+        params = dict(params or {})
+        if set(params) != set(expected):
+            raise api_error({"code": "PGRST202", "message": f"{name} expects parameters {', '.join(expected)}"})
+        params = {k: normalize_timestamp(v) if k.endswith("_ts") else v for k, v in params.items()}
+        # Both report functions return one row per serial, ordered by serial
+        return SQLiteQuery(self, name, source=f"({body})", source_params=params).order("serial")
@@ -0,0 +1,316 @@
+"""
+In-memory verification index for /api/verify.
+
+Keeps the registry rows that scans touch in process memory so a repeat scan
+is answered with a dictionary lookup instead of two or three Supabase round
+trips. Batches and serials of every product share one table each
+(sql/006_product_registry.sql) and codes are unique across products, so a
+lookup never depends on how many products are registered.
+
+- Entries are read-through: a code that is not in the index is looked up in
+  Supabase once and the answer (found or not found) is remembered.
+- Every entry expires after `ttl_seconds`, so rows changed from another worker
+  or from the Supabase dashboard are picked up on the next scan after that.
+  Not-found answers expire after `missing_ttl` (a few seconds) instead: a code
+  registered by another worker must not scan as counterfeit for minutes.
+- `put_batch` / `put_serial` are called by the admin add-record routes so a new
+  record is visible to this worker straight away.
+- `warm()` bulk-loads both tables, e.g. when a worker starts. The loaded
+  entries expire after `ttl_seconds` too, so a warm-up only covers the first
+  scans after start; later misses read through as usual.
+- With a `code_filter` (code_filter.KnownCodes), codes that are definitely not
+  in either table are answered as unknown without a query.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from data_access import execute, run_concurrently
+from errors import is_api_error
+
+BATCH_TABLE = "product_batches"
+SERIAL_TABLE = "product_serials"
+
+BATCH_COLUMNS = "product_code, batch_number, manufacturer, expiry_date"
+SERIAL_COLUMNS = "product_code, serial_no, batch_number"
+# Serial with its parent batch embedded (uses the FK from sql/006_product_registry.sql)
+SERIAL_WITH_BATCH_COLUMNS = f"{SERIAL_COLUMNS}, {BATCH_TABLE}({BATCH_COLUMNS})"
+
+# PostgREST caps a single response (1000 rows by default), so bulk loads page
+PAGE_SIZE = 1000
+
+# Codes per `in_` filter; keeps the generated query string well under URL limits
+IN_CHUNK_SIZE = 200
+
+# PostgREST: no relationship between the tables in the schema cache (the FK is missing)
+MISSING_RELATIONSHIP = "PGRST200"
+
+# Marker stored for codes we looked up and did not find
+MISSING = None
+
+
+class VerificationIndex:
+
+    def __init__(self, client, ttl_seconds=300, max_entries=200_000, code_filter=None, missing_ttl=5):
+        self.client = client
+        self.code_filter = code_filter
+        self.ttl_seconds = ttl_seconds
+        self.missing_ttl = missing_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # code -> (expires_at, record or MISSING)
+        self._batches = OrderedDict()
+        self._serials = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Cleared if PostgREST reports the FK missing (PGRST200); we then fall back to a second query
+        self.embed_batches = True
+
+    # -------------------------------
+    # Cache primitives
+    # -------------------------------
+    def _get(self, table, code):
+        """Returns (found_in_cache, record). Expired entries count as not cached."""
+        with self._lock:
+            entry = table.get(code)
+            if entry is None:
+                return False, MISSING
+            expires_at, record = entry
+            if expires_at < time.monotonic():
+                del table[code]
+                return False, MISSING
+            table.move_to_end(code)
+            return True, record
+
+    def _set(self, table, code, record):
+        ttl = self.missing_ttl if record is MISSING else self.ttl_seconds
+        with self._lock:
+            table[code] = (time.monotonic() + ttl, record)
+            table.move_to_end(code)
+            while len(table) > self.max_entries:
+                table.popitem(last=False)
+
+    # -------------------------------
+    # Supabase fallbacks (cache misses)
+    # -------------------------------
+    def _fetch_batch(self, batch_number):
+        response = execute(self.client.table(BATCH_TABLE).select(BATCH_COLUMNS).eq("batch_number", batch_number))
+        record = response.data[0] if response.data else MISSING
+        self._set(self._batches, batch_number, record)
+        return record
+
+    def _select_serials(self, apply_filter):
+        """
+        Selects serials with their batch embedded, or plain columns if the schema has no
+        serial->batch relationship. Other errors (timeouts, 5xx) are raised as usual and
+        do not switch embedding off.
+        """
+        if self.embed_batches:
+            try:
+                return execute(apply_filter(self.client.table(SERIAL_TABLE).select(SERIAL_WITH_BATCH_COLUMNS))).data or []
+            except Exception as e:
+                if not is_api_error(e, MISSING_RELATIONSHIP):
+                    raise
+                print(f"No serial->batch relationship, using separate batch lookups: {e}")
+                self.embed_batches = False
+        return execute(apply_filter(self.client.table(SERIAL_TABLE).select(SERIAL_COLUMNS))).data or []
+
+    def _store_serial(self, record):
+        """Caches a serial row and, if present, the batch row embedded in it."""
+        batch = record.pop(BATCH_TABLE, None)
+        if isinstance(batch, list):
+            batch = batch[0] if batch else None
+        if batch:
+            self._set(self._batches, batch["batch_number"], batch)
+        self._set(self._serials, record["serial_no"], record)
+        return record
+
+    def _fetch_serial(self, serial_no):
+        rows = self._select_serials(lambda query: query.eq("serial_no", serial_no))
+        if rows:
+            return self._store_serial(rows[0])
+        self._set(self._serials, serial_no, MISSING)
+        return MISSING
+
+    def _cached(self, table, code):
+        cached, record = self._get(table, code)
+        if cached:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return cached, record
+
+    def get_batch(self, batch_number):
+        cached, record = self._cached(self._batches, batch_number)
+        return record if cached else self._fetch_batch(batch_number)
+
+    def get_serial(self, serial_no):
+        cached, record = self._cached(self._serials, serial_no)
+        return record if cached else self._fetch_serial(serial_no)
+
+    # -------------------------------
+    # Public API
+    # -------------------------------
+    def lookup(self, code):
+        """
+        Resolves a scanned code.
+
+        Returns (batch_record, serial_record). batch_record is None when the code
+        is unknown (counterfeit); serial_record is None when the code was a batch number.
+        """
+        if self.code_filter is not None and not self.code_filter.might_contain(code):
+            return None, None
+
+        batch_cached, batch = self._cached(self._batches, code)
+        if batch_cached and batch is not MISSING:
+            return batch, None
+
+        serial_cached, serial = self._cached(self._serials, code)
+        if not batch_cached and not serial_cached:
+            # Cold code: probe both tables at once so the miss costs one round trip
+            batch, serial = run_concurrently(lambda: self._fetch_batch(code), lambda: self._fetch_serial(code))
+        elif not batch_cached:
+            batch = self._fetch_batch(code)
+        elif not serial_cached:
+            serial = self._fetch_serial(code)
+
+        if batch is not MISSING:
+            return batch, None
+        if serial is MISSING:
+            return None, None
+
+        # Normally already cached from the embedded select
+        return self.get_batch(serial["batch_number"]), serial
+
+    def _fetch_many(self, table, key, codes):
+        """Resolves `codes` with chunked `in_` queries and caches every answer, including misses."""
+        found = {}
+        codes = list(codes)
+        for start in range(0, len(codes), IN_CHUNK_SIZE):
+            chunk = codes[start:start + IN_CHUNK_SIZE]
+            if table == BATCH_TABLE:
+                rows = execute(self.client.table(BATCH_TABLE).select(BATCH_COLUMNS).in_(key, chunk)).data or []
+            else:
+                rows = [self._store_serial(row) for row in self._select_serials(lambda query: query.in_(key, chunk))]
+            for record in rows:
+                found[record[key]] = record
+        cache = self._batches if table == BATCH_TABLE else self._serials
+        for code in codes:
+            self._set(cache, code, found.get(code, MISSING))
+        return found
+
+    def _get_many(self, table, key, codes):
+        """Cache-first lookup of many codes; the misses go to Supabase as one set-based query."""
+        cache = self._batches if table == BATCH_TABLE else self._serials
+        records = {}
+        uncached = []
+        for code in codes:
+            cached, record = self._cached(cache, code)
+            if cached:
+                records[code] = record
+            else:
+                uncached.append(code)
+        if uncached:
+            found = self._fetch_many(table, key, uncached)
+            for code in uncached:
+                records[code] = found.get(code, MISSING)
+        return records
+
+    def lookup_many(self, codes):
+        """
+        Resolves many scanned codes at once.
+
+        Returns {code: (batch_record, serial_record)} with the same meaning as lookup().
+        The batch and serial `in_` probes run side by side, and serials carry their
+        batch embedded, so the number of round trips does not grow with the codes passed.
+        """
+        codes = list(dict.fromkeys(codes))
+        results = {}
+        if self.code_filter is not None:
+            known = [code for code in codes if self.code_filter.might_contain(code)]
+            results = dict.fromkeys(set(codes) - set(known), (None, None))
+            codes = known
+        batches, serials = run_concurrently(lambda: self._get_many(BATCH_TABLE, "batch_number", codes),
+                                            lambda: self._get_many(SERIAL_TABLE, "serial_no", codes))
+
+        # Parents are already cached when the embedded select worked
+        parents = {serial["batch_number"] for code, serial in serials.items()
+                   if serial is not MISSING and batches[code] is MISSING}
+        parent_batches = self._get_many(BATCH_TABLE, "batch_number", parents)
+
+        for code in codes:
+            if batches[code] is not MISSING:
+                results[code] = (batches[code], None)
+            elif serials[code] is not MISSING:
+                results[code] = (parent_batches[serials[code]["batch_number"]], serials[code])
+            else:
+                results[code] = (None, None)
+        return results
+
+    def put_batch(self, record):
+        """Called after a batch is inserted so the new batch is served from memory."""
+        if self.code_filter is not None:
+            self.code_filter.add(record["batch_number"])
+        self._set(self._batches, record["batch_number"], {
+            "product_code": record["product_code"],
+            "batch_number": record["batch_number"],
+            "manufacturer": record.get("manufacturer"),
+            "expiry_date": record.get("expiry_date"),
+        })
+
+    def put_serial(self, record):
+        """Called after a serial is inserted so the new serial is served from memory."""
+        if self.code_filter is not None:
+            self.code_filter.add(record["serial_no"])
+        self._set(self._serials, record["serial_no"], {
+            "product_code": record["product_code"],
+            "serial_no": record["serial_no"],
+            "batch_number": record.get("batch_number"),
+        })
+
+    def invalidate(self, code=None):
+        """Drops one code (batch or serial) or, with no argument, the whole index."""
+        with self._lock:
+            if code is None:
+                self._batches.clear()
+                self._serials.clear()
+            else:
+                self._batches.pop(code, None)
+                self._serials.pop(code, None)
+
+    def _fetch_all(self, table, columns, key):
+        # Keyset pages ordered by the unique code column: stable without a snapshot,
+        # and each page is an index range scan instead of an ever deeper OFFSET
+        last = None
+        while True:
+            query = self.client.table(table).select(columns)
+            if last is not None:
+                query = query.gt(key, last)
+            page = execute(query.order(key).limit(PAGE_SIZE)).data or []
+            yield from page
+            if len(page) < PAGE_SIZE:
+                break
+            last = page[-1][key]
+
+    def warm(self):
+        """
+        Loads every batch and serial into the index. Returns the number of rows loaded.
+        Warmed entries expire after `ttl_seconds` like any other, so this only saves
+        the first scan of each code in that window; call it again to re-warm.
+        """
+        loaded = 0
+        for record in self._fetch_all(BATCH_TABLE, BATCH_COLUMNS, "batch_number"):
+            self._set(self._batches, record["batch_number"], record)
+            loaded += 1
+        for record in self._fetch_all(SERIAL_TABLE, SERIAL_COLUMNS, "serial_no"):
+            self._set(self._serials, record["serial_no"], record)
+            loaded += 1
+        return loaded
+
+    def stats(self):
+        return {
+            "batches": len(self._batches),
+            "serials": len(self._serials),
+            "hits": self.hits,
+            "misses": self.misses,
+        }